@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Microbenchmarks of the codec functions of core, each in isolation:
+ops/s and peak allocated octets per call, compared against the stored
+baseline. Run from the root of the repository:
+
+    python benchmarks/bench_codec.py             # compare, exit 1 if slower
+    python benchmarks/bench_codec.py --save      # store a new baseline
+
+The datetime cases depend on whether pytz is installed, which the
+baseline records: they are skipped when it differs.
+
+A case regresses when its ops/s drop, or its allocations grow, by more
+than its threshold: 30% by default, or three times the spread of its
+speed over the rounds of the baseline (median absolute deviation) if
+larger. The speed of a case is
+compared relative to that of a fixed reference loop, timed in
+alternation with it, which absorbs most of the difference of speed
+between machines and of the load of the machine. The cases of large
+payloads are memory-bound, and scaled by a memory-bound reference loop
+instead. Each case keeps the median of several rounds.
+
+To regenerate the baseline, on an idle machine and once the code is
+known not to have regressed:
+
+    python benchmarks/bench_codec.py --save --rounds 5
+    python benchmarks/bench_codec.py             # 3 times, must pass
+
+then commit codec_baseline.json.
+"""
+
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from hein import core
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'codec_baseline.json')
+
+
+def _zone(name):
+    return core.pytz.timezone(name) if core.TZON else None
+
+
+def _stamp(i, zone):
+    t = datetime(2020, 1, 2, 3, 4, 5, i)
+    return zone.localize(t) if zone is not None else t
+
+
+# messages given to json_dumps, and their results to the other paths
+PAYLOADS = {
+    'flat numeric': dict(('k{:d}'.format(i), i * 1.5) for i in range(20)),
+    'nested lists': [[i, [i * 2, [i * 3, None]], True] for i in range(20)],
+    'datetimes': [{'t': _stamp(i, _zone('Europe/Paris')),
+                   'u': _stamp(i, _zone('UTC')), 'v': i}
+                  for i in range(10)],
+    # quotes are not escaped back by json_loads
+    'bytes 64k': bytes(bytearray(i for i in range(256)
+                                     if i not in (34, 92))) * 260,
+    'messageend': {'s': bytes(core.MESSAGEEND) * 50,
+                   'b': bytes(core.DMESSAGEEND) + b'abc' * 10},
+}
+
+# cases which values are time-zone aware if pytz is installed
+ZONED = ('datetimes', 'datetime')
+
+# cases which payloads are large enough to be memory-bound
+LARGE = ('bytes 64k',)
+
+# version of the measures, the baseline must be saved again when it
+# changes
+VERSION = 2
+
+# single values given to extended_type2bytes
+VALUES = {
+    'int': 123456789,
+    'float': 0.3333333333333333,
+    'datetime': _stamp(1, _zone('Europe/Paris')),
+    'bytes 64k': PAYLOADS['bytes 64k'],
+    'messageend': bytes(core.MESSAGEEND) * 50,
+}
+
+
+def cases():
+    """Returns the (name, callable) of all cases
+    """
+    res = []
+    for name, v in PAYLOADS.items():
+        dumped = core.json_dumps(v)
+        packed = core.package_message(dumped)
+        flow = bytes(packed) * 10
+        res += [('json_dumps/' + name, lambda v=v: core.json_dumps(v)),
+                ('json_loads/' + name,
+                 lambda d=dumped: core.json_loads(d)),
+                ('package_message/' + name,
+                 lambda d=dumped: core.package_message(d)),
+                ('split_flow/' + name, lambda f=flow: core.split_flow(f))]
+    for name, v in VALUES.items():
+        typed = core.extended_type2bytes(v, True)
+        res += [('extended_type2bytes/' + name,
+                 lambda v=v: core.extended_type2bytes(v, True)),
+                ('bytes2type/' + name, lambda t=typed: core.bytes2type(t))]
+    return res
+
+
+def _zoned(name):
+    return name.split('/', 1)[1] in ZONED
+
+
+def _large(name):
+    return name.split('/', 1)[1] in LARGE
+
+
+def _reference():
+    """Fixed workload, to scale the ops/s of the cases
+    """
+    d = {}
+    for i in range(100):
+        d[str(i)] = b''.join((b'x', repr(i * 1.5).encode()))
+    return sorted(d)
+
+
+_BLOCK = bytes(bytearray(range(256))) * 1024
+
+
+def _memory_reference():
+    """Fixed memory-bound workload, to scale the ops/s of the cases
+    of large payloads
+    """
+    return bytes(bytearray(_BLOCK)).replace(b'\x00', b'\x01')
+
+
+def _calls(fct, duration):
+    """Returns the number of calls of fct lasting about duration
+    """
+    n = 1
+    while True:
+        t = timeit.timeit(fct, number=n)
+        if t >= duration / 10:
+            break
+        n *= 10
+    return max(1, int(n * duration / max(t, 1e-9)))
+
+
+def measure(fct, reference=_reference, duration=0.2, repeat=5):
+    """Returns the best ops/s over repeat runs of about duration / 5
+    seconds each, the same relative to the reference loop run in
+    alternation, and the peak octets allocated by one call
+    """
+    n = _calls(fct, duration / 5)
+    nref = _calls(reference, duration / 5)
+    best = bestref = float('inf')
+    for i in range(repeat):
+        bestref = min(bestref, timeit.timeit(reference, number=nref))
+        best = min(best, timeit.timeit(fct, number=n))
+    ops = n / best
+    fct()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        fct()
+        alloc = tracemalloc.get_traced_memory()[1] - start
+    finally:
+        tracemalloc.stop()
+    return ops, ops / (nref / bestref), alloc
+
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.
+
+
+def run(selected, rounds=3, duration=0.2):
+    """Returns the median ops/s, the median relative speed, the
+    allocated octets and the relative spread of the speed over rounds
+    (median absolute deviation, which ignores a stalled round) of all
+    the (name, callable) cases selected, by name
+    """
+    runs = dict((name, []) for name, fct in selected)
+    # rounds go through all the cases, to spread the load changes
+    for i in range(max(1, int(rounds))):
+        for name, fct in selected:
+            runs[name].append(measure(
+                fct, _memory_reference if _large(name) else _reference,
+                duration=duration))
+    res = {}
+    for name, measures in runs.items():
+        rels = [rel for ops, rel, alloc in measures]
+        rel = _median(rels)
+        res[name] = (_median([ops for ops, rel, alloc in measures]), rel,
+                     measures[-1][2],
+                     _median([abs(r - rel) for r in rels]) / rel)
+    return res
+
+
+def compare(results, baseline, threshold):
+    """Returns the names of the regressed cases, printing them all
+    """
+    bad = []
+    print("{:<32} {:>12} {:>8} {:>10} {:>8} {:>6}".format(
+        "case", "ops/s", "vs base", "alloc (o)", "vs base", "tol"))
+    for name, (ops, rel, alloc, spread) in results.items():
+        ref = baseline.get(name)
+        if ref is None:
+            print("{:<32} {:>12.0f} {:>8} {:>10d} {:>8} {:>6}".format(
+                name, ops, "new", alloc, "new", ""))
+            continue
+        tol = max(threshold, 3 * ref.get('spread', 0.))
+        rops = rel / ref['rel']
+        # a few octets of slack for the small cases
+        ralloc = (alloc + 64.) / (ref['alloc'] + 64.)
+        flag = ""
+        if rops < 1 - tol or ralloc > 1 + threshold:
+            bad.append(name)
+            flag = "  REGRESSED"
+        print("{:<32} {:>12.0f} {:>8.2f} {:>10d} {:>8.2f} {:>6.2f}{}"\
+                .format(name, ops, rops, alloc, ralloc, tol, flag))
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--save', action='store_true',
+                        help="store the results as the new baseline")
+    parser.add_argument('--baseline', default=BASELINE,
+                        help="path of the baseline file")
+    parser.add_argument('--threshold', type=float, default=0.3,
+                        help="tolerated relative regression")
+    parser.add_argument('--duration', type=float, default=0.2,
+                        help="seconds per timing run")
+    parser.add_argument('--rounds', type=int, default=3,
+                        help="rounds of timing runs of each case")
+    parser.add_argument('-k', dest='pattern', default='',
+                        help="only run the cases containing this text")
+    args = parser.parse_args()
+    if not core.TZON:
+        print("WARNING: pytz could not be imported, datetimes are naive")
+    results = run([(name, fct) for name, fct in cases()
+                        if args.pattern in name],
+                  rounds=args.rounds, duration=args.duration)
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                stored = json.load(f)
+            baseline = stored['cases']
+            if stored.get('version') != VERSION:
+                baseline = {}
+            elif stored.get('pytz') != core.TZON:
+                # not comparable to the ones measured now
+                baseline = dict((name, ref) for name, ref
+                                    in baseline.items() if not _zoned(name))
+        baseline.update((name, {'ops': round(ops, 1), 'rel': round(rel, 6),
+                                'alloc': alloc, 'spread': round(spread, 4)})
+                        for name, (ops, rel, alloc, spread)
+                            in results.items())
+        with open(args.baseline, 'w') as f:
+            json.dump({'version': VERSION,
+                       'rounds': args.rounds,
+                       'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'pytz': core.TZON,
+                       'date': time.strftime('%Y-%m-%d'),
+                       'cases': baseline}, f, indent=1, sort_keys=True)
+            f.write('\n')
+        compare(results, {}, args.threshold)
+        print("baseline saved to {}".format(args.baseline))
+        return 0
+    if not os.path.exists(args.baseline):
+        print("no baseline at {}, run with --save".format(args.baseline))
+        return 2
+    with open(args.baseline) as f:
+        stored = json.load(f)
+    if stored.get('version') != VERSION:
+        print("baseline made by an older version of this script, run "\
+              "with --save")
+        return 2
+    if stored.get('python') != platform.python_version():
+        print("WARNING: baseline made with python {}".format(
+            stored.get('python')))
+    if stored.get('pytz') != core.TZON:
+        print("WARNING: baseline made {} pytz, datetime cases skipped"\
+                .format('without' if core.TZON else 'with'))
+        results = dict((name, res) for name, res in results.items()
+                            if not _zoned(name))
+    bad = compare(results, stored['cases'], args.threshold)
+    if bad:
+        print("{:d} case(s) regressed by more than {:.0%}".format(
+            len(bad), args.threshold))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
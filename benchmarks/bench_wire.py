@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Per-message cost of the wire path: framing a message as
+``SocTransmitter.tell`` does, and splitting and decoding it as the
+receivers do. Run from the root of the repository:
+
+    python benchmarks/bench_wire.py
+
+Each payload is run through two paths, which produce the same frames:
+
+  * before: the Byt-based framing and decoding the package used
+    before the wire path moved to native bytes, kept here so that
+    both sides are measured on the same interpreter and machine
+  * after: the current framing of the transmitter and dispatch of
+    the receivers
+
+The saved column is the per-message overhead removed, in us.
+"""
+
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from byt import Byt
+
+from hein import core
+from hein.soctransmitter import SocTransmitter
+from hein.socreceiver import SocReceiver
+
+
+class _Receiver(SocReceiver):
+    def process(self, data, tag):
+        self.data = data
+
+
+RECEIVER = _Receiver(port=0, name='bench', connect=False,
+                     hostname='127.0.0.1')
+
+
+PAYLOADS = {
+    'int': 42,
+    'flat dict': dict(('k{:d}'.format(i), i * 1.5) for i in range(10)),
+    'nested': {'a': [1, 2, [3, 4]], 'b': {'c': 'hello', 'd': None}},
+    'datetime': {'t': datetime(2020, 1, 2, 3, 4, 5, 6), 'v': 1},
+    # quotes are not escaped back by json_loads
+    'bytes 4k': bytes(bytearray(i for i in range(256)
+                                    if i not in (34, 92))) * 16,
+}
+
+
+def _byt_base2bytes(v, keep_typ, json=False):
+    """``core.base_type2bytes`` before the move to native bytes
+    """
+    if isinstance(v, Byt):
+        data, code = v, core.BYTCODE
+    elif isinstance(v, bool):
+        data, code = core._ONE if v else core._ZERO, core.BOOLCODE
+    elif isinstance(v, int):
+        data, code = Byt(repr(v)), core.INTCODE
+    elif isinstance(v, float):
+        data, code = Byt(repr(v)), core.FLOATCODE
+    elif v is None:
+        data, code = core._EMPTY, core.NONECODE
+    elif isinstance(v, str):
+        data, code = Byt(v.encode(core.ENCODING)), core.UNICODE
+    elif isinstance(v, bytes):
+        data, code = Byt(v), core.BYTESCODE
+    else:
+        data, code = Byt(repr(v).encode(core.ENCODING)), core.UNICODE
+    if json and code not in (core.BOOLCODE, core.INTCODE,
+                             core.FLOATCODE, core.NONECODE):
+        data = data.replace(core._QUOTE, core._ESCQUOTE)
+    if keep_typ:
+        return code + core.DICTMAPPER + data
+    return data
+
+
+def _byt_ext2bytes(v, keep_typ, json=False):
+    """``core.extended_type2bytes`` before the move to native bytes
+    """
+    if isinstance(v, datetime):
+        data = Byt("{:d},{:d},{:d},{:d},{:d},{:d},{:d},{}"\
+                    .format(v.year, v.month, v.day, v.hour,
+                            v.minute, v.second, v.microsecond,
+                            getattr(v.tzinfo, "zone", "")))
+        if keep_typ:
+            return core.DTCODE + core.DICTMAPPER + data
+        return data
+    return _byt_base2bytes(v, keep_typ, json)
+
+
+def _byt_dumps(data):
+    """``core.json_dumps`` before the move to native bytes
+    """
+    if isinstance(data, (list, tuple)):
+        ret = core._BRACKETL
+        ret += core._COMMA.join([_byt_dumps(item) for item in data])
+        ret += core._BRACKETR
+        return ret
+    elif isinstance(data, dict):
+        ret = core._CURLYL
+        ret += core._COMMA.join([core._QUOTE + Byt(k) + core._QUOTECOLON
+                                 + _byt_dumps(v) for k, v in data.items()])
+        ret += core._CURLYR
+        return ret
+    return core._QUOTE\
+        + _byt_ext2bytes(data, keep_typ=True, json=True)\
+            .replace(core._QUOTE, core._ESCQUOTE)\
+        + core._QUOTE
+
+
+def _byt_unpack(d):
+    if isinstance(d, (list, tuple)):
+        return [_byt_unpack(item) for item in d]
+    elif isinstance(d, dict):
+        return dict((str(k), _byt_unpack(v)) for k, v in d.items())
+    return core.bytes2type(d)
+
+
+def encode_before(v):
+    """Frames a message as the transmitter did on Byt
+    """
+    txt = _byt_dumps(v)
+    extra = Byt('tag') + core.DICTMAPPER + core._ONE + core.DICTMAPPER
+    return core.JSONKEY + extra\
+        + txt.replace(core.MESSAGEEND, core.ESCAPEDMESSAGEEND)\
+        + core.DMESSAGEEND
+
+
+def decode_before(frame):
+    """Splits and decodes a frame as the receivers did on Byt
+    """
+    res = Byt(frame).split(core.DMESSAGEEND)
+    comm = res[0].replace(core.ESCAPEDMESSAGEEND, core.MESSAGEEND)
+    thekey, comm = comm[:core.KEYLENGTH], comm[core.KEYLENGTH:]
+    tag, unpack, comm = comm.split(core.DICTMAPPER, 2)
+    tag = str(tag) if len(tag) > 0 else None
+    if thekey == core.JSONKEY and int(unpack) == 1:
+        return _byt_unpack(json.loads(str(comm), strict=False))
+
+
+def encode(v):
+    """Frames a message as the transmitter does
+    """
+    dumps = getattr(core, '_dumps', core.json_dumps)
+    return SocTransmitter._frame(None, dumps(v), core.JSONKEY, 'tag', True)
+
+
+def decode(frame):
+    """Splits and decodes a frame as the receivers do
+    """
+    comm = memoryview(frame)[:-len(core.DMESSAGEEND)]
+    if core.Byt(frame).find(core.ESCAPEDMESSAGEEND) >= 0:
+        # FrameReader un-escapes into a Byt
+        comm = core.Byt(bytes(comm)).replace(core.ESCAPEDMESSAGEEND,
+                                             core.MESSAGEEND)
+    RECEIVER._dispatch(comm)
+    return RECEIVER.data
+
+
+def _time(fct, arg, n):
+    """Returns the time of a call in us
+    """
+    return timeit.timeit(lambda: fct(arg), number=n) / n * 1e6
+
+
+def main(number=20000):
+    print("{:<12} {:>8} {:>8} {:>8}   {:>8} {:>8} {:>8}".format(
+        "payload", "enc bef", "enc aft", "saved",
+        "dec bef", "dec aft", "saved"))
+    for name, v in PAYLOADS.items():
+        frame = encode(v)
+        # both paths put the same octets on the wire
+        assert bytes(encode_before(v)) == bytes(frame)
+        assert decode_before(frame) == decode(frame) == v
+        n = number if len(frame) < 1024 else number // 10
+        enc = _time(encode_before, v, n), _time(encode, v, n)
+        dec = _time(decode_before, frame, n), _time(decode, frame, n)
+        print("{:<12} {:>8.2f} {:>8.2f} {:>8.2f}   {:>8.2f} {:>8.2f} "
+              "{:>8.2f}".format(name, enc[0], enc[1], enc[0] - enc[1],
+                                dec[0], dec[1], dec[0] - dec[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -40,5 +40,12 @@ except:
 
 from .soctransmitter import *
 from .socreceiver import *
+from .multireceiver import *
+from .journal import *
+from .schema import *
+from .batch import *
+from .relay import *
+from .reactor import *
+from .profiler import *
 from ._version import __version__, __major__, __minor__, __micro__
 from .core import *
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+from datetime import datetime
+from datetime import date
+NUMPYON = True
+try:
+    import numpy as np
+except ImportError:
+    NUMPYON = False
+
+from .schema import _FIXED
+
+
+__all__ = ['MessageBatch']
+
+
+try:
+    _INTTYPES = (int, long)
+except NameError:
+    _INTTYPES = (int,)
+
+# numpy types of the fixed-size schema codes
+_NPFIXED = {'?': '?', 'q': '<i8', 'd': '<f8'}
+
+
+def _utc(v):
+    """Returns the naive UTC equivalent of a datetime
+    """
+    if v.tzinfo is None:
+        return v
+    return (v - v.utcoffset()).replace(tzinfo=None)
+
+
+def _column(values):
+    """Returns a numpy array of values if they share a numerical or
+    time type, else the list of values
+    """
+    if not NUMPYON or len(values) == 0:
+        return values
+    if all(isinstance(v, bool) for v in values):
+        return np.array(values, dtype=bool)
+    if all(isinstance(v, _INTTYPES) and not isinstance(v, bool)
+                for v in values):
+        try:
+            return np.array(values, dtype=np.int64)
+        except OverflowError:
+            return values
+    if all(isinstance(v, (float,) + _INTTYPES) and not isinstance(v, bool)
+                for v in values):
+        return np.array(values, dtype=np.float64)
+    if all(isinstance(v, datetime) for v in values):
+        return np.array([_utc(v) for v in values], dtype='datetime64[us]')
+    if all(isinstance(v, date) and not isinstance(v, datetime)
+                for v in values):
+        return np.array(values, dtype='datetime64[D]')
+    return values
+
+
+class MessageBatch(object):
+    def __init__(self, columns, tag=None):
+        """A run of dict messages of the same tag, stored as one
+        column per key: a numpy array if numpy is installed and the
+        values share a numerical, bool or time type, else a list.
+        Datetimes become UTC ``datetime64[us]`` columns
+
+        Args:
+          * columns (dict): the name: column items
+          * tag (str or None): the tag of the messages
+
+        Note:
+          * Use ``from_dicts`` or ``from_packed`` to build a batch
+        """
+        self.columns = columns
+        self.tag = tag
+        # metadata of the messages of a stamping transmitter, or None
+        self.meta = None
+        self._size = len(next(iter(columns.values()))) if columns else 0
+
+    def __str__(self):
+        return "MessageBatch of {:d} messages ({})".format(
+            len(self), ', '.join(self.names))
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    @property
+    def names(self):
+        """The names of the columns
+        """
+        return list(self.columns.keys())
+
+    @names.setter
+    def names(self, value):
+        pass
+
+    def rows(self):
+        """Iterates over the messages as dicts, values being numpy
+        scalars for numpy columns
+        """
+        names = self.names
+        for i in range(len(self)):
+            yield dict((name, self.columns[name][i]) for name in names)
+
+    @classmethod
+    def from_dicts(cls, messages, tag=None):
+        """Builds a batch from dicts, with one column per key found in
+        any of them, in order of first appearance. Missing keys give
+        ``None`` values
+
+        Args:
+          * messages (list of dict): the messages
+          * tag (str or None): the tag of the messages
+
+        Raises TypeError if a message is not a dict
+        """
+        if not messages:
+            return cls({}, tag=tag)
+        if not all(isinstance(m, dict) for m in messages):
+            raise TypeError("messages must be dicts")
+        names = []
+        seen = set()
+        for m in messages:
+            for name in m:
+                if name not in seen:
+                    seen.add(name)
+                    names.append(name)
+        columns = {}
+        for name in names:
+            columns[name] = _column([m.get(name) for m in messages])
+        return cls(columns, tag=tag)
+
+    @classmethod
+    def from_packed(cls, schema, payloads, tag=None):
+        """Builds a batch from messages packed with a schema, decoding
+        all the fixed-size fields at once if possible
+
+        Args:
+          * schema (Schema): the schema of the messages
+          * payloads (list of Byt or bytes): the packed messages
+          * tag (str or None): the tag of the messages
+
+        Raises ValueError if a message was packed with another schema
+        """
+        if schema._var or not payloads:
+            return cls.from_dicts([dict(zip(schema.names,
+                                            _values(schema.unpack(p))))
+                                        for p in payloads], tag=tag)
+        data = b''.join(bytes(p) for p in payloads)
+        if len(data) != schema._struct.size * len(payloads):
+            raise ValueError("data does not match the schema")
+        if NUMPYON:
+            dtype = np.dtype([('_fingerprint', '<u4')]
+                        + [(str(i), _NPFIXED[_FIXED[schema.codes[i]]])
+                                for i in schema._fixed])
+            arr = np.frombuffer(data, dtype=dtype)
+            if np.any(arr['_fingerprint'] != schema.fingerprint):
+                raise ValueError("data does not match the schema")
+            columns = dict((schema.names[i], arr[str(i)].copy())
+                                for i in schema._fixed)
+        else:
+            rows = list(zip(*schema._struct.iter_unpack(data)))
+            if any(f != schema.fingerprint for f in rows[0]):
+                raise ValueError("data does not match the schema")
+            columns = dict((schema.names[i], list(col))
+                                for i, col in zip(schema._fixed, rows[1:]))
+        return cls(columns, tag=tag)
+
+
+def _values(record):
+    """Returns the values of an unpacked dict or record
+    """
+    if isinstance(record, dict):
+        return record.values()
+    return tuple(record)
@@ -34,6 +34,16 @@ from datetime import time
 import json
 import re
 import sys
+import os
+import errno
+import struct
+SPLICEON = hasattr(os, 'splice')
+FIONREADON = True
+try:
+    import fcntl
+    import termios
+except ImportError:
+    FIONREADON = False
 TZON = True
 try:
     import pytz
@@ -50,6 +60,12 @@ __all__ = ['Message']
 
 # acknowledgement character
 ACK = Byt('\x06')
+# retransmission request character, followed by a record
+NAK = Byt('\x15')
+# character of a receiver which cannot read the shared memory ring
+SHMOFF = Byt('\x18')
+# acknowledgement character of a schema query which schema is held
+SCHEMAOK = Byt('\x11')
 
 
 # basic encoding
@@ -67,6 +83,8 @@ ESCAPEDMESSAGEEND = MESSAGEEND + ESCAPE
 
 # maximum tag length
 TAGLEN = 15
+# maximum length of the header of a communication, after the key
+HEADLEN = 48
 
 # length of pre-pending keys - all must have the same length
 KEYPADDING = Byt('__')
@@ -80,6 +98,36 @@ PINGKEY = KEYPADDING + Byt('png') + KEYPADDING
 RAWKEY = KEYPADDING + Byt('raw') + KEYPADDING
 # send this with a JSON-type message
 JSONKEY = KEYPADDING + Byt('jsn') + KEYPADDING
+# send this with a schema-packed message
+SCHEMAKEY = KEYPADDING + Byt('sch') + KEYPADDING
+# send this with the fingerprint of a schema to a new receiver, which
+# acknowledges it with SCHEMAOK if it holds the same schema
+SCHEMAQKEY = KEYPADDING + Byt('scq') + KEYPADDING
+# send this with a delta-encoded dict message
+DELTAKEY = KEYPADDING + Byt('dlt') + KEYPADDING
+# kinds of delta-encoded messages
+DELTAFULL = Byt('k')
+DELTADIFF = Byt('d')
+# send this with a chunk of a streamed message
+STREAMKEY = KEYPADDING + Byt('stm') + KEYPADDING
+# phases of a streamed message
+STREAMSTART = Byt('s')
+STREAMCHUNK = Byt('c')
+STREAMEND = Byt('e')
+STREAMABORT = Byt('a')
+# send this followed with the raw content of a file
+FILEKEY = KEYPADDING + Byt('fil') + KEYPADDING
+# send this with the multicast group to a new receiver
+MCASTKEY = KEYPADDING + Byt('mca') + KEYPADDING
+# send this with a line retransmitted instead of multicast
+REPAIRKEY = KEYPADDING + Byt('rep') + KEYPADDING
+# send this with the name of the shared memory ring to a new receiver
+SHMOPENKEY = KEYPADDING + Byt('sho') + KEYPADDING
+# send this with the position of a record in the shared memory ring
+SHMKEY = KEYPADDING + Byt('shm') + KEYPADDING
+# send this with the sending and acknowledgement times of the last ping
+# to a receiver, to estimate its clock offset
+CLOCKKEY = KEYPADDING + Byt('clk') + KEYPADDING
 
 # tags for type conservation
 BOOLCODE = Byt("b")
@@ -95,6 +143,8 @@ UNICODE = Byt("u")
 STRCODE = Byt("s")
 
 _EMPTY = Byt("")
+# length of each frame of a record of the shared memory ring
+_SHMFRAME = struct.Struct('<I')
 _SPACE = Byt(" ")
 _ONE = Byt("1")
 _ZERO = Byt("0")
@@ -109,9 +159,34 @@ _CURLYR = Byt('}')
 _BRACKETL = Byt('[')
 _BRACKETR = Byt(']')
 
+# native bytes of the wire path, which avoid the Byt wrappers
+_B = dict((code, bytes(code)) for code in (
+    BOOLCODE, INTCODE, FLOATCODE, BYTESCODE, NONECODE, BYTCODE, DTCODE,
+    DATECODE, TIMECODE, UNICODE, STRCODE))
+_BMESSAGEEND = bytes(MESSAGEEND)
+_BDMESSAGEEND = bytes(DMESSAGEEND)
+_BESCAPEDMESSAGEEND = bytes(ESCAPEDMESSAGEEND)
+_BMAPPER = bytes(DICTMAPPER)
+_BQUOTE = b'"'
+_BESCQUOTE = b'\\"'
+_BCOMMA = b','
+_BONE = b'1'
+_BZERO = b'0'
+# follows the unpack flag of a frame which asks for no acknowledgement
+_BNOACK = b'~'
+# separates the unpack flag from the sending time of a stamped frame
+_BSTAMP = b'@'
+_LATIN = 'ISO-8859-1'
+
 # sending frequency in Hz
 SENDBUFFERFREQ = 100
 
+# priorities of the messages, control messages (ping, die) always go
+# first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
 ALLOWCHAR = re.compile('[^a-zA-Z\.\-_0-9 ]')
 
 STRINGTYPES = (unicode, Byt, str, bytes)
@@ -168,7 +243,11 @@ def esc_quote(v):
     Args:
       * v (Byt): the string to escape
     """
-    return v.replace(_QUOTE, _ESCQUOTE)
+    return to_byt(_esc_quote(v))
+
+
+def _esc_quote(v):
+    return bytes.replace(v, _BQUOTE, _BESCQUOTE)
 
 
 def clean_name(txt):
@@ -177,6 +256,15 @@ def clean_name(txt):
     return ALLOWCHAR.sub('', txt)
 
 
+def clean_tag(tag):
+    """Returns the tag as transmitted, or ``None``
+    """
+    if tag is None:
+        return None
+    tag = clean_name(str(tag)[:TAGLEN])
+    return tag if len(tag) > 0 else None
+
+
 def extended_type2bytes(v, keep_typ, json=False):
     """Returns a bytes representation of v
 
@@ -191,29 +279,35 @@ def extended_type2bytes(v, keep_typ, json=False):
         types in (Byt, unicode, str, bytes)
       * Any other type will undergo a repr() call
     """
+    return to_byt(_ext2bytes(v, keep_typ, json))
+
+
+def _typed(code, data, keep_typ):
+    if keep_typ:
+        return b''.join((_B[code], _BMAPPER, data))
+    return data
+
+
+def _ext2bytes(v, keep_typ, json=False):
+    """Same as ``extended_type2bytes``, returns bytes
+    """
     if isinstance(v, datetime):
-        data = Byt("{:d},{:d},{:d},{:d},{:d},{:d},{:d},{}"\
+        data = "{:d},{:d},{:d},{:d},{:d},{:d},{:d},{}"\
                     .format(v.year, v.month, v.day, v.hour,
                             v.minute, v.second, v.microsecond,
-                            getattr(v.tzinfo, "zone", "")))
-        if keep_typ:
-            return DTCODE + DICTMAPPER + data
-        return data
+                            getattr(v.tzinfo, "zone", ""))
+        return _typed(DTCODE, data.encode(_LATIN), keep_typ)
     elif isinstance(v, date):
-        data = Byt("{:d},{:d},{:d}".format(v.year, v.month, v.day))
-        if keep_typ:
-            return DATECODE + DICTMAPPER + data
-        return data
+        data = "{:d},{:d},{:d}".format(v.year, v.month, v.day)
+        return _typed(DATECODE, data.encode(_LATIN), keep_typ)
     elif isinstance(v, time):
-        data = Byt("{:d},{:d},{:d},{:d},{}"\
+        data = "{:d},{:d},{:d},{:d},{}"\
                     .format(v.hour, v.minute, v.second,
                             v.microsecond,
-                            getattr(v.tzinfo, "zone", "")))
-        if keep_typ:
-            return TIMECODE + DICTMAPPER + data
-        return data
+                            getattr(v.tzinfo, "zone", ""))
+        return _typed(TIMECODE, data.encode(_LATIN), keep_typ)
     else:
-        return base_type2bytes(v, keep_typ, json)
+        return _base2bytes(v, keep_typ, json)
 
 
 def base_type2bytes(v, keep_typ, json=False):
@@ -229,53 +323,42 @@ def base_type2bytes(v, keep_typ, json=False):
         types in (Byt, unicode, str, bytes)
       * Any other type will undergo a repr() call
     """
+    return to_byt(_base2bytes(v, keep_typ, json))
+
+
+def _base2bytes(v, keep_typ, json=False):
+    """Same as ``base_type2bytes``, returns bytes, or v itself if it
+    is a Byt that needs no transformation
+    """
     if isinstance(v, Byt):
         if json:
-            v = esc_quote(v)
-        if keep_typ:
-            return BYTCODE + DICTMAPPER + v
-        return v
+            v = _esc_quote(v)
+        return _typed(BYTCODE, v, keep_typ)
     elif isinstance(v, bool):
-        data = _ONE if v else _ZERO
-        if keep_typ:
-            return BOOLCODE + DICTMAPPER + data
-        return data
+        return _typed(BOOLCODE, _BONE if v else _BZERO, keep_typ)
     elif isinstance(v, int):
-        if keep_typ:
-            return INTCODE + DICTMAPPER + Byt(repr(v))
-        return Byt(repr(v))
+        return _typed(INTCODE, repr(v).encode(_LATIN), keep_typ)
     elif isinstance(v, float):
-        if keep_typ:
-            return FLOATCODE + DICTMAPPER + Byt(repr(v))
-        return Byt(repr(v))
+        return _typed(FLOATCODE, repr(v).encode(_LATIN), keep_typ)
     elif v is None:
-        if keep_typ:
-            return NONECODE + DICTMAPPER
-        return _EMPTY
+        return _typed(NONECODE, b'', keep_typ)
     # catches python3 str and python2 unicode
     elif isinstance(v, unicode):
-        data = Byt(v.encode(ENCODING))
+        data = v.encode(ENCODING)
         if json:
-            data = esc_quote(data)
-        if keep_typ:
-            return UNICODE + DICTMAPPER + data
-        return data
+            data = _esc_quote(data)
+        return _typed(UNICODE, data, keep_typ)
     # only python2 str reach here
     elif isinstance(v, str):
-        data = Byt(v)
+        data = bytes(v)
         if json:
-            data = esc_quote(data)
-        if keep_typ:
-            return STRCODE + DICTMAPPER + data
-        return data
+            data = _esc_quote(data)
+        return _typed(STRCODE, data, keep_typ)
     # only python3 bytes here
     elif isinstance(v, bytes):
-        data = Byt(v)
         if json:
-            data = esc_quote(data)
-        if keep_typ:
-            return BYTESCODE + DICTMAPPER + data
-        return data
+            v = _esc_quote(v)
+        return _typed(BYTESCODE, v, keep_typ)
     else:
         data = repr(v)
         # catches python3 str and python2 unicode
@@ -285,12 +368,9 @@ def base_type2bytes(v, keep_typ, json=False):
         # only python2 str reach here
         else:
             code = STRCODE
-        data = Byt(data)
         if json:
-            data = esc_quote(data)
-        if keep_typ:
-            return code + DICTMAPPER + data
-        return data
+            data = _esc_quote(data)
+        return _typed(code, data, keep_typ)
 
 def bytes2type(v):
     typ, v = Byt(v).split(DICTMAPPER, 1)
@@ -343,7 +423,14 @@ def package_message(txt):
     Args:
       * txt (Byt): the message to escape
     """
-    return txt.replace(MESSAGEEND, ESCAPEDMESSAGEEND) + DMESSAGEEND
+    return to_byt(_package(txt))
+
+
+def _package(txt):
+    """Same as ``package_message``, returns bytes
+    """
+    return b''.join((bytes.replace(txt, _BMESSAGEEND, _BESCAPEDMESSAGEEND),
+                     _BDMESSAGEEND))
 
 
 def split_flow(data, n=-1):
@@ -357,13 +444,393 @@ def split_flow(data, n=-1):
         set to -1 for all
 
     """
-    res = data.split(DMESSAGEEND, int(n))
+    res = bytes.split(data, _BDMESSAGEEND, int(n))
     if len(res) <= 1:  # no split found
-        return res
+        return [to_byt(item) for item in res]
     # apply recovery of escaped chars to all splits found except last one
-    return [item.replace(ESCAPEDMESSAGEEND, MESSAGEEND)\
+    return [Byt(item.replace(_BESCAPEDMESSAGEEND, _BMESSAGEEND))\
                 for item in res[:-1]]\
-            + res[-1:]
+            + [Byt(res[-1])]
+
+
+def to_byt(v):
+    """Returns v as a Byt, copying only if needed
+
+    Args:
+      * v (Byt, bytes, bytearray or memoryview): the chain of bytes
+    """
+    if isinstance(v, Byt):
+        return v
+    return Byt(bytes(v))
+
+
+def split_fields(comm, n, start=0):
+    """
+    Splits the n first fields of comm separated by DICTMAPPER, and
+    returns them as Byt followed by the remainder, which keeps the type
+    of comm (Byt or memoryview)
+
+    Args:
+      * comm (Byt or memoryview): the chain of bytes to split
+      * n (int): the number of fields to split
+      * start (int): where the first field starts
+    """
+    if isinstance(comm, memoryview):
+        # the fields are short, only copy what's needed to parse them
+        head = comm[:start + HEADLEN].tobytes()
+    else:
+        head = comm
+    res = []
+    for i in range(n):
+        end = bytes.find(head, _BMAPPER, start)
+        res.append(to_byt(head[start:end]))
+        start = end + 1
+    res.append(comm[start:])
+    return res
+
+
+def _split_header(comm):
+    """Same as ``split_header``, returns the key as Byt, the tag as
+    str or None, the unpack flag as bool and the sending time of a
+    stamped frame as float or None
+    """
+    head = memoryview(comm)[:KEYLENGTH + HEADLEN].tobytes()
+    i = head.find(_BMAPPER, KEYLENGTH)
+    j = head.find(_BMAPPER, i + 1)
+    tag = head[KEYLENGTH:i].decode(_LATIN) if i > KEYLENGTH else None
+    stamp = None
+    if j - i > 2:
+        k = head.find(_BSTAMP, i + 2, j)
+        if k > 0:
+            stamp = float(head[k + 1:j])
+    return Byt(head[:KEYLENGTH]), tag, head[i + 1:i + 2] == _BONE, stamp,\
+            comm[j + 1:]
+
+
+def _acked(comm):
+    """Whether a communication asks for an acknowledgement, which all
+    do but those which unpack flag is followed by '~'
+
+    Args:
+      * comm (Byt or memoryview): the communication
+    """
+    head = memoryview(comm)[:KEYLENGTH + HEADLEN].tobytes()
+    i = head.find(_BMAPPER, KEYLENGTH)
+    return head[i + 2:i + 3] != _BNOACK
+
+
+def _unstamp(frames):
+    """Returns the frames joined without the sending times of the
+    stamped ones, and the positions in the result where to write new
+    ones, or None if none was stamped
+
+    Args:
+      * frames (list of Byt, bytes or memoryview): the frames,
+        packaged or not
+    """
+    pieces = []
+    stamps = []
+    size = 0
+    for comm in frames:
+        head = memoryview(comm)[:KEYLENGTH + HEADLEN].tobytes()
+        i = head.find(_BMAPPER, KEYLENGTH)
+        j = head.find(_BMAPPER, i + 1)
+        k = head.find(_BSTAMP, i + 2, j) if j - i > 2 else -1
+        if k < 0:
+            pieces.append(comm)
+            size += len(comm)
+            continue
+        pieces += [comm[:k], comm[j:]]
+        stamps.append(size + k)
+        size += len(comm) - (j - k)
+    return b''.join(pieces), stamps or None
+
+
+def split_header(comm):
+    """
+    Splits a communication into its key, tag, unpack flag and
+    payload. The header items are returned as Byt, and the payload
+    keeps the type of comm (Byt or memoryview). The unpack flag of a
+    frame which asks for no acknowledgement is followed by '~', and
+    the one of a stamped frame by '@' and its sending time
+
+    Args:
+      * comm (Byt or memoryview): the communication, without its end
+        characters
+    """
+    thekey = to_byt(comm[:KEYLENGTH])
+    return [thekey] + split_fields(comm, 2, start=KEYLENGTH)
+
+
+class FrameReader(object):
+    def __init__(self, sock, buffer_size=1024):
+        """
+        Reads the data flow of a socket into a reusable buffer, and
+        splits it into communications without intermediate copies
+
+        Args:
+          * sock (socket): the socket to read from
+          * buffer_size (int): the initial size in octets of the buffer,
+            which grows to fit the pending data and the largest
+            communication
+        """
+        self.sock = sock
+        self._buf = bytearray(max(64, int(buffer_size)))
+        self._view = memoryview(self._buf)
+        # unconsumed data is self._buf[self._start:self._end]
+        self._start = 0
+        self._end = 0
+        # where to resume the search for the end characters
+        self._scan = 0
+        self._flag = getattr(socket, 'MSG_DONTWAIT', 0)
+
+    def __len__(self):
+        return self._end - self._start
+
+    def _pending(self):
+        """Returns the number of octets waiting in the socket, or 0
+        if unknown
+        """
+        if not FIONREADON:
+            return 0
+        try:
+            res = fcntl.ioctl(self.sock.fileno(), termios.FIONREAD,
+                              b'\0\0\0\0')
+            return struct.unpack('i', res)[0]
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def _room(self, n):
+        """Makes sure that at least n octets are free at the end of the
+        buffer
+        """
+        if len(self._buf) - self._end >= n:
+            return
+        used = self._end - self._start
+        if len(self._buf) - used >= n:
+            # enough space once the remainder is moved to the front
+            self._buf[:used] = self._buf[self._start:self._end]
+        else:
+            size = len(self._buf)
+            while size - used < n:
+                size *= 2
+            buf = bytearray(size)
+            buf[:used] = self._buf[self._start:self._end]
+            self._buf = buf
+            self._view = memoryview(buf)
+        self._scan -= self._start
+        self._start = 0
+        self._end = used
+
+    def read(self, timeout=1.):
+        """
+        Reads all the data available on the socket into the buffer, and
+        returns the number of octets read, 0 if the socket was closed,
+        or ``None`` if nothing came within the timeout
+
+        Args:
+          * timeout (float): the timeout in seconds, used only if the
+            socket would block
+        """
+        if self._start == self._end:
+            # everything consumed, rewind for free
+            self._start = self._end = self._scan = 0
+        self._room(max(self._pending(), 64))
+        for attempt in range(2):
+            if attempt or not self._flag:
+                ready = select.select([self.sock], [], [], timeout)
+                if not ready[0]:
+                    return None
+                self._room(max(self._pending(), 64))
+            try:
+                n = self.sock.recv_into(self._view[self._end:],
+                                        len(self._buf) - self._end,
+                                        0 if attempt else self._flag)
+            except socket.error as e:
+                if e.args and e.args[0] in (errno.EAGAIN,
+                                            errno.EWOULDBLOCK):
+                    continue
+                return 0
+            self._end += n
+            return n
+        return None
+
+    def take(self, n):
+        """
+        Consumes and returns at most n octets of the buffer, as a
+        memoryview only valid until the next call to ``read``
+
+        Args:
+          * n (int): the maximum number of octets
+        """
+        n = min(n, self._end - self._start)
+        start = self._start
+        self._start += n
+        self._scan = max(self._scan, self._start)
+        return self._view[start:start + n]
+
+    def frames(self, raw=False):
+        """
+        Iterates over the full communications available in the buffer,
+        and consumes them. The communications are memoryviews on the
+        buffer, only valid until the next call to ``read``, unless they
+        had to be un-escaped, in which case they are Byt
+
+        Args:
+          * raw (bool): if ``True``, yields the communications still
+            escaped and with their end characters, as received
+        """
+        lend = len(DMESSAGEEND)
+        while True:
+            idx = self._buf.find(DMESSAGEEND, max(self._start, self._scan),
+                                 self._end)
+            if idx < 0:
+                self._scan = max(self._start, self._end - lend + 1)
+                return
+            start = self._start
+            self._start = self._scan = idx + lend
+            if raw:
+                yield self._view[start:idx + lend]
+            elif self._buf.find(ESCAPEDMESSAGEEND, start, idx) >= 0:
+                yield Byt(bytes(self._buf[start:idx]))\
+                        .replace(ESCAPEDMESSAGEEND, MESSAGEEND)
+            else:
+                yield self._view[start:idx]
+
+
+class FileSink(object):
+    def __init__(self, size, path=None, name="", tag=None):
+        """
+        Receives a raw payload of known size from a socket, either
+        straight into a file, or into memory
+
+        Args:
+          * size (int): the size in octets of the payload
+          * path (str or None): the file to write, or ``None`` to keep
+            the payload in memory
+          * name (str): the name of the payload given by the sender
+          * tag (str or None): the tag given by the sender
+        """
+        self.size = int(size)
+        self.remaining = self.size
+        self.path = path
+        self.name = name
+        self.tag = tag
+        self._pipe = None
+        if path is None:
+            self._fd = None
+            self._data = bytearray(self.size)
+            self._view = memoryview(self._data)
+        else:
+            self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                               0o644)
+            self._data = None
+            self._view = None
+
+    @property
+    def done(self):
+        """Whether the whole payload was received
+        """
+        return self.remaining == 0
+
+    @done.setter
+    def done(self, value):
+        pass
+
+    def _write(self, data):
+        if self._fd is None:
+            start = self.size - self.remaining
+            self._view[start:start + len(data)] = data
+        else:
+            view = memoryview(data)
+            while len(view) > 0:
+                view = view[os.write(self._fd, view):]
+        self.remaining -= len(data)
+
+    def feed(self, reader):
+        """Consumes the part of the payload already in a FrameReader
+        buffer
+
+        Args:
+          * reader (FrameReader): the reader of the socket
+        """
+        self._write(reader.take(self.remaining))
+
+    def pull(self, sock):
+        """Reads the part of the payload available on a socket, without
+        going through python buffers when writing to a file. Returns
+        False if the socket was closed
+
+        Args:
+          * sock (socket): the socket to read from
+        """
+        try:
+            if self._fd is None:
+                start = self.size - self.remaining
+                n = sock.recv_into(self._view[start:], self.remaining)
+                self.remaining -= n
+            elif SPLICEON:
+                if self._pipe is None:
+                    self._pipe = os.pipe()
+                n = os.splice(sock.fileno(), self._pipe[1],
+                              min(self.remaining, 2**20))
+                left = n
+                while left > 0:
+                    left -= os.splice(self._pipe[0], self._fd, left)
+                self.remaining -= n
+            else:
+                data = sock.recv(min(self.remaining, 2**16))
+                n = len(data)
+                self._write(data)
+        except (socket.error, OSError) as e:
+            if e.args and e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            return False
+        return n > 0
+
+    def close(self):
+        """Closes the sink and returns the path of the file written, or
+        the payload as a Byt
+        """
+        if self._pipe is not None:
+            os.close(self._pipe[0])
+            os.close(self._pipe[1])
+            self._pipe = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            return self.path
+        self._view = None
+        return Byt(self._data)
+
+
+def sendfile(sock, f, size):
+    """
+    Sends size octets of a file object to a socket, with zero-copy if
+    possible, padding with null octets if the file is shorter
+
+    Args:
+      * sock (socket): the socket to write to
+      * f (file): the file, opened in binary mode
+      * size (int): the number of octets to send
+    """
+    if hasattr(sock, 'sendfile'):
+        sent = sock.sendfile(f, 0, size) if size > 0 else 0
+    else:
+        sent = 0
+        while sent < size:
+            data = f.read(min(size - sent, 2**16))
+            if not data:
+                break
+            sock.sendall(data)
+            sent += len(data)
+    if sent < size:
+        # file was truncated in between, keep the flow in sync
+        sock.sendall(b'\0' * (size - sent))
+
+
+# json.loads would build a decoder at each call because of strict
+_DECODER = json.JSONDecoder(strict=False)
 
 
 def json_loads(data):
@@ -372,46 +839,78 @@ def json_loads(data):
     Args:
       * data (Byt or str): the raw extended-json string to unpack
     """
-    def unpack(d):
-        if isinstance(d, (list, tuple)):
-            return [unpack(item) for item in d]
-        elif isinstance(d, dict):
-            return dict((str(k), unpack(v)) for k, v in d.items())
-        else:
-            return bytes2type(d)
     if PYTHON3:
-        return unpack(json.loads(str(data), strict=False))
+        if not isinstance(data, str):
+            # decodes Byt, bytes, bytearray and memoryview alike
+            data = str(data, _LATIN)
+        return _unpack(_DECODER.decode(data))
     else:
         return json.loads(str(data), cls=NoUTFUnpacker)
 
 
+def _unpack(d):
+    if isinstance(d, list):
+        return [_unpack(item) for item in d]
+    elif isinstance(d, dict):
+        return dict((str(k), _unpack(v)) for k, v in d.items())
+    elif not isinstance(d, unicode):
+        return bytes2type(d)
+    # same as bytes2type, without going through Byt
+    typ, sep, v = d.partition(':')
+    if typ == 'i':
+        return int(v)
+    elif typ == 'f':
+        return float(v)
+    elif typ == 'u':
+        return v
+    elif typ == 'b':
+        return bool(int(v))
+    elif typ == 'n':
+        return None
+    elif typ == 'y' or typ == 's':
+        return v.encode(_LATIN)
+    elif typ == 'Y':
+        return Byt(v)
+    return bytes2type(d)
+
+
 def json_dumps(data):
     """Dumps an extended json variable
 
     Args:
       * data: the variable to dump to json
     """
+    return to_byt(_dumps(data))
+
+
+def _dumps(data):
+    """Same as ``json_dumps``, returns bytes
+    """
     if isinstance(data, (list, tuple)):
-        ret = _BRACKETL
-        ret += _COMMA.join([json_dumps(item) for item in data])
-        ret += _BRACKETR
-        return ret
+        return b''.join((b'[', _BCOMMA.join([_dumps(item) for item in data]),
+                         b']'))
     elif isinstance(data, dict):
-        ret = _CURLYL
-        ret += _COMMA.join([_QUOTE + Byt(k) + _QUOTECOLON + json_dumps(v)\
-                                for k, v in data.items()])
-        ret += _CURLYR
-        return ret
+        return b''.join((b'{', _BCOMMA.join([
+            b''.join((_BQUOTE, _key(k), b'":', _dumps(v)))
+                for k, v in data.items()]), b'}'))
     else:
-        return _QUOTE\
-            + esc_quote(extended_type2bytes(data, keep_typ=True, json=True))\
-            + _QUOTE
+        return b''.join((_BQUOTE,
+                         _esc_quote(_ext2bytes(data, keep_typ=True,
+                                               json=True)),
+                         _BQUOTE))
+
+
+def _key(k):
+    if isinstance(k, unicode):
+        return k.encode(_LATIN)
+    return Byt(k)
 
 
 class Message(object):
-    def __init__(self, v):
+    def __init__(self, v, loads=None):
         self._raw = v
         self._message = None
+        self._loads = json_loads if loads is None else loads
 
     def __repr__(self):
         return str(self.message)
@@ -433,7 +932,7 @@ class Message(object):
         """Unpack the message
         """
         if self._message is None:
-            self._message = json_loads(self.raw)
+            self._message = self._loads(self.raw)
         return self._message
 
     @message.setter
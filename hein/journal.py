@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import os
+import mmap
+import struct
+import time
+from zlib import crc32
+from threading import Lock
+from byt import Byt
+
+
+__all__ = ['Journal']
+
+
+# record header: sequence number, timestamp, length of the framed bytes,
+# and crc32 of these fields followed by the framed bytes
+_RECORD = struct.Struct('<QdII')
+# fields of the record header covered by the crc32
+_HEAD = struct.Struct('<QdI')
+# sparse index entry: sequence number, timestamp, offset in segment
+_INDEX = struct.Struct('<QdQ')
+
+_SEGEXT = '.seg'
+_IDXEXT = '.idx'
+
+
+class _Segment(object):
+    """A journal segment on disk, named after its first sequence number
+    """
+    def __init__(self, path, first):
+        self.first = int(first)
+        self.base = os.path.join(path, "{:020d}".format(self.first))
+        # list of (seq, ts, offset)
+        self.index = []
+        self.last = self.first - 1
+        self.last_ts = 0.
+        self.size = 0
+
+    @property
+    def segpath(self):
+        return self.base + _SEGEXT
+
+    @property
+    def idxpath(self):
+        return self.base + _IDXEXT
+
+    def load_index(self):
+        self.index = []
+        if not os.path.isfile(self.idxpath):
+            return
+        with open(self.idxpath, 'rb') as f:
+            raw = f.read()
+        for i in range(len(raw) // _INDEX.size):
+            self.index.append(_INDEX.unpack_from(raw, i * _INDEX.size))
+
+    def remove(self):
+        for p in (self.segpath, self.idxpath):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+
+def _crc(head, frame):
+    return crc32(frame, crc32(head)) & 0xffffffff
+
+
+def _iter_records(buf, pos, end):
+    """Yields (seq, ts, offset, length) of the records found in buf
+    from pos to end; stops at the first blank (pre-allocated) header,
+    or at the first record which checksum does not match (torn write)
+    """
+    while pos + _RECORD.size <= end:
+        seq, ts, n, crc = _RECORD.unpack_from(buf, pos)
+        start = pos + _RECORD.size
+        if seq == 0 or start + n > end:
+            return
+        if _crc(buf[pos:pos + _HEAD.size], buf[start:start + n]) != crc:
+            return
+        yield seq, ts, pos, n
+        pos = start + n
+
+
+class Journal(object):
+    def __init__(self, path, segment_size=64*2**20, max_bytes=None,
+                 max_age=None, index_interval=64):
+        """Segmented, memory-mapped, append-only journal of framed
+        messages, for audit and durable replay.
+
+        Args:
+          * path (str): the directory holding the segments, created if
+            needed. An existing journal is reopened and appended to
+          * segment_size (int): the size in octets of a segment before
+            rotation
+          * max_bytes (int or None): the maximum total size in octets
+            of the closed segments to retain, or ``None`` for no limit
+          * max_age (float or None): the maximum age in seconds of a
+            closed segment's last record before it is deleted, or
+            ``None`` for no limit
+          * index_interval (int): one record out of ``index_interval``
+            is written to the sparse index
+
+        Note:
+          * Sequence numbers start at 1 and are strictly increasing
+          * Each record has a checksum: on reopening, the journal is
+            cut at the first record which does not match it
+          * The journal is thread-safe
+        """
+        self.path = str(path)
+        self.segment_size = max(4096, int(segment_size))
+        self.max_bytes = None if max_bytes is None else int(max_bytes)
+        self.max_age = None if max_age is None else float(max_age)
+        self.index_interval = max(1, int(index_interval))
+        self._lock = Lock()
+        self._segments = []
+        self._mm = None
+        self._f = None
+        self._idx = None
+        self._pos = 0
+        self._count = 0
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self._open()
+
+    def __str__(self):
+        return "Journal in '{}' (seq {}-{}, {:d} segments)".format(
+            self.path, self.first_seq, self.last_seq, len(self._segments))
+
+    __repr__ = __str__
+
+    @property
+    def first_seq(self):
+        """The sequence number of the oldest record retained
+        """
+        if not self._segments:
+            return 0
+        return self._segments[0].first
+
+    @first_seq.setter
+    def first_seq(self, value):
+        pass
+
+    @property
+    def last_seq(self):
+        """The sequence number of the last record appended, 0 if empty
+        """
+        if not self._segments:
+            return 0
+        return self._segments[-1].last
+
+    @last_seq.setter
+    def last_seq(self, value):
+        pass
+
+    @property
+    def closed(self):
+        """Whether the journal is closed
+        """
+        return self._mm is None
+
+    @closed.setter
+    def closed(self, value):
+        pass
+
+    def _open(self):
+        """Loads the existing segments, cuts the journal at the first
+        record which does not match its checksum, and recovers the write
+        position of the last segment
+        """
+        names = sorted(f for f in os.listdir(self.path)
+                            if f.endswith(_SEGEXT))
+        for name in names:
+            seg = _Segment(self.path, name[:-len(_SEGEXT)])
+            seg.load_index()
+            seg.size = os.path.getsize(seg.segpath)
+            self._segments.append(seg)
+        if not self._segments:
+            self._new_segment(1, self.segment_size)
+            return
+        for i, seg in enumerate(self._segments):
+            # closed segments were flushed and trimmed, only need their
+            # last sequence and timestamp, the active one is checked
+            active = i == len(self._segments) - 1
+            end = self._scan(seg, full=active)
+            if not active and end < seg.size:
+                # a bad record, the following ones are lost
+                for later in self._segments[i + 1:]:
+                    later.remove()
+                del self._segments[i + 1:]
+                active = True
+            if active:
+                self._cut(seg, end)
+                break
+        seg = self._segments[-1]
+        self._map(seg, max(seg.size, self.segment_size))
+        self._pos = seg.size
+        self._count = seg.last - seg.first + 1
+
+    def _scan(self, seg, full=False):
+        """Updates last sequence of a segment from its content, from
+        its start if full else from its last index entry, and returns
+        the end position of its valid records
+        """
+        pos = 0
+        if seg.index and not full:
+            seq, ts, pos = seg.index[-1]
+            seg.last = seq - 1
+            seg.last_ts = ts
+        if seg.size == 0:
+            return 0
+        with open(seg.segpath, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for seq, ts, pos, n in _iter_records(buf, pos, len(buf)):
+                seg.last = seq
+                seg.last_ts = ts
+                pos += _RECORD.size + n
+        finally:
+            buf.close()
+        return pos
+
+    def _cut(self, seg, end):
+        """Truncates a segment and its index at the end of its valid
+        records, so that the space after them reads as blank
+        """
+        with open(seg.segpath, 'r+b') as f:
+            f.truncate(end)
+        seg.size = end
+        seg.index = [entry for entry in seg.index if entry[2] < end]
+        with open(seg.idxpath, 'wb') as f:
+            for entry in seg.index:
+                f.write(_INDEX.pack(*entry))
+
+    def _map(self, seg, size):
+        self._f = open(seg.segpath, 'r+b' if os.path.isfile(seg.segpath)
+                                        else 'w+b')
+        self._f.truncate(size)
+        self._mm = mmap.mmap(self._f.fileno(), size)
+        self._idx = open(seg.idxpath, 'ab')
+
+    def _new_segment(self, first, size):
+        seg = _Segment(self.path, first)
+        self._segments.append(seg)
+        self._map(seg, size)
+        self._pos = 0
+        self._count = 0
+
+    def _close_segment(self):
+        """Trims the active segment to its written size and unmaps it
+        """
+        if self._mm is None:
+            return
+        self._mm.flush()
+        self._mm.close()
+        self._f.truncate(self._pos)
+        self._f.close()
+        self._idx.close()
+        self._segments[-1].size = self._pos
+        self._mm = None
+
+    def _rotate(self, size):
+        size = max(size, self.segment_size)
+        if self._pos == 0:
+            # empty segment too small for the record, just grow it
+            seg = self._segments[-1]
+            self._close_segment()
+            self._map(seg, size)
+            return
+        self._close_segment()
+        self._new_segment(self.last_seq + 1, size)
+        self._retain()
+
+    def _retain(self):
+        """Deletes the oldest closed segments that exceed the size or
+        age retention limits
+        """
+        now = time.time()
+        closed = self._segments[:-1]
+        total = sum(seg.size for seg in closed)
+        for seg in closed:
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            too_old = self.max_age is not None\
+                        and now - seg.last_ts > self.max_age
+            if not (too_big or too_old):
+                break
+            seg.remove()
+            total -= seg.size
+            self._segments.remove(seg)
+
+    def append(self, frame, ts=None):
+        """Appends a framed message to the journal and returns its
+        sequence number
+
+        Args:
+          * frame (Byt or bytes): the framed message
+          * ts (float or None): the timestamp of the record, default
+            is ``time.time()``
+        """
+        ts = time.time() if ts is None else float(ts)
+        n = len(frame)
+        with self._lock:
+            if self._mm is None:
+                raise ValueError("journal is closed")
+            if self._pos + _RECORD.size + n > len(self._mm):
+                self._rotate(_RECORD.size + n)
+            seg = self._segments[-1]
+            seq = seg.last + 1
+            _RECORD.pack_into(self._mm, self._pos, seq, ts, n,
+                              _crc(_HEAD.pack(seq, ts, n), frame))
+            start = self._pos + _RECORD.size
+            self._mm[start:start + n] = frame
+            if self._count % self.index_interval == 0:
+                entry = (seq, ts, self._pos)
+                seg.index.append(entry)
+                self._idx.write(_INDEX.pack(*entry))
+            self._pos = start + n
+            self._count += 1
+            seg.last = seq
+            seg.last_ts = ts
+        return seq
+
+    def flush(self):
+        """Flushes the active segment and its index to disk
+        """
+        with self._lock:
+            if self._mm is not None:
+                self._mm.flush()
+                self._idx.flush()
+
+    def close(self):
+        """Flushes and closes the journal
+        """
+        with self._lock:
+            self._close_segment()
+
+    def _locate(self, seq=None, ts=None):
+        """Returns the segment position and a starting offset from which
+        to scan forward to reach seq or ts
+        """
+        segs = self._segments
+        i = 0
+        if seq is not None:
+            while i + 1 < len(segs) and segs[i + 1].first <= seq:
+                i += 1
+            key = 0
+            target = seq
+        elif ts is not None:
+            while i + 1 < len(segs) and segs[i].last_ts < ts:
+                i += 1
+            key = 1
+            target = ts
+        else:
+            return 0, 0
+        offset = 0
+        for entry in segs[i].index:
+            if entry[key] > target:
+                break
+            offset = entry[2]
+        return i, offset
+
+    def seek(self, seq=None, timestamp=None):
+        """Returns the sequence number of the first record at or after
+        the given sequence number or timestamp, or ``None`` if there
+        is no such record
+
+        Args:
+          * seq (int or None): the sequence number to seek
+          * timestamp (float or None): the timestamp to seek
+        """
+        for item in self.replay(start=seq, start_time=timestamp):
+            return item[0]
+        return None
+
+    def _read_segment(self, i, offset):
+        """Yields (seq, ts, frame) of segment i starting at offset
+        """
+        with self._lock:
+            if i >= len(self._segments):
+                return
+            seg = self._segments[i]
+            if i == len(self._segments) - 1 and self._mm is not None:
+                # active segment: copy the written part under lock
+                buf = self._mm[:self._pos]
+            else:
+                buf = None
+        if buf is None:
+            if seg.size == 0:
+                return
+            try:
+                f = open(seg.segpath, 'rb')
+            except IOError:  # deleted by retention in between
+                return
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            f.close()
+        try:
+            for seq, ts, pos, n in _iter_records(buf, offset, len(buf)):
+                start = pos + _RECORD.size
+                yield seq, ts, Byt(buf[start:start + n])
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+    def replay(self, start=None, stop=None, start_time=None,
+               stop_time=None):
+        """Iterates over the records of the journal as tuples
+        (seq, timestamp, frame), where frame is the framed message
+
+        Args:
+          * start (int or None): the first sequence number to replay
+          * stop (int or None): the last sequence number to replay
+          * start_time (float or None): the first timestamp to replay
+          * stop_time (float or None): the last timestamp to replay
+        """
+        i, offset = self._locate(seq=start, ts=start_time)
+        while i < len(self._segments):
+            for seq, ts, frame in self._read_segment(i, offset):
+                if start is not None and seq < start:
+                    continue
+                if start_time is not None and ts < start_time:
+                    continue
+                if (stop is not None and seq > stop)\
+                        or (stop_time is not None and ts > stop_time):
+                    return
+                yield seq, ts, frame
+            i += 1
+            offset = 0
+
+    def replay_to(self, sock, start=None, stop=None, start_time=None,
+                  stop_time=None):
+        """Sends the frames of the journal to a socket, and returns the
+        number of frames sent
+
+        Args:
+          * sock (socket): the socket to write to
+          * start, stop, start_time, stop_time: see ``replay``
+        """
+        cnt = 0
+        for seq, ts, frame in self.replay(start=start, stop=stop,
+                                          start_time=start_time,
+                                          stop_time=stop_time):
+            sock.sendall(frame)
+            cnt += 1
+        return cnt
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+
+import os
+import socket
+import struct
+import select
+import time
+from threading import Thread
+from collections import deque
+
+
+__all__ = ['McastSender', 'McastListener']
+
+
+# datagram header: session, sequence number of the line, index of the
+# fragment, number of fragments or 0 for a heartbeat
+_DGRAM = struct.Struct('!IQHH')
+# retransmission request following a NAK on the control connection:
+# first and last sequence numbers missing
+NAKRECORD = struct.Struct('!QQ')
+# IP and UDP headers
+_UDPHEAD = 28
+# lines skipped when a receiver lags by more than its window
+_WINDOW = 4096
+
+
+def parse_group(group):
+    """Returns the (address, port) of a multicast group given as
+    'address:port' or as a tuple
+    """
+    if isinstance(group, (tuple, list)):
+        host, port = group
+    else:
+        host, port = str(group).rsplit(':', 1)
+    return str(host), int(port)
+
+
+class McastSender(object):
+    def __init__(self, group, ttl=1, mtu=1400, history=1024,
+                 interface=None):
+        """Sends lines to a multicast group as sequenced datagrams,
+        fragmented to fit the MTU, and keeps the last ones for
+        retransmission
+
+        Args:
+          * group (str or tuple): the group, as 'address:port'
+          * ttl (int): the number of hops of the datagrams, 1 for the
+            local network
+          * mtu (int): the maximum size in octets of the IP packets
+          * history (int): the number of lines kept for retransmission
+          * interface (str or None): the address of the interface to
+            send from, default is chosen by the system
+        """
+        self.group = parse_group(group)
+        # changes at each start, so that receivers tell restarts apart
+        self.session = struct.unpack('!I', os.urandom(4))[0]
+        # sequence number of the last line sent
+        self.seq = 0
+        self.payload = max(64, int(mtu) - _UDPHEAD - _DGRAM.size)
+        self._history = deque(maxlen=max(1, int(history)))
+        self.last = time.time()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                   socket.IPPROTO_UDP)
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                              int(ttl))
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP,
+                              1)
+        if interface is not None:
+            self._sock.setsockopt(socket.IPPROTO_IP,
+                                  socket.IP_MULTICAST_IF,
+                                  socket.inet_aton(interface))
+
+    def __str__(self):
+        return "Multicast sender to {}:{:d}, sequence {:d}".format(
+            self.group[0], self.group[1], self.seq)
+
+    __repr__ = __str__
+
+    def send(self, line):
+        """Sends a line, and returns its sequence number
+
+        Args:
+          * line (bytes-like): the line
+        """
+        view = memoryview(line)
+        n = max(1, -(-len(view) // self.payload))
+        if n > 0xffff:
+            raise ValueError("line too large for multicast")
+        self.seq += 1
+        self._history.append(line)
+        for i in range(n):
+            self._emit(b''.join((
+                _DGRAM.pack(self.session, self.seq, i, n),
+                view[i * self.payload:(i + 1) * self.payload])))
+        return self.seq
+
+    def heartbeat(self):
+        """Sends the sequence number of the last line, so that the
+        receivers detect the loss of the last lines
+        """
+        self._emit(_DGRAM.pack(self.session, self.seq, 0, 0))
+
+    def _emit(self, data):
+        try:
+            self._sock.sendto(data, self.group)
+        except socket.error:
+            # lost datagrams are retransmitted on request
+            pass
+        self.last = time.time()
+
+    def get(self, seq):
+        """Returns the line of a sequence number, or ``None`` if it is
+        not kept anymore
+
+        Args:
+          * seq (int): the sequence number
+        """
+        first = self.seq - len(self._history) + 1
+        if first <= seq <= self.seq:
+            return self._history[seq - first]
+        return None
+
+    def close(self):
+        self._sock.close()
+
+
+class McastListener(object):
+    def __init__(self, group, session, seq, deliver, nak, nak_interval=0.2,
+                 window=_WINDOW):
+        """Joins a multicast group and hands over the lines of a session
+        in order, requesting the missing ones
+
+        Args:
+          * group (str or tuple): the group, as 'address:port'
+          * session (int): the session of the sender
+          * seq (int): the sequence number of the last line sent
+            before joining
+          * deliver (callable): called with each line, in order
+          * nak (callable): called with the first and last sequence
+            numbers of the missing lines
+          * nak_interval (float): the waiting time in seconds before
+            requesting missing lines again
+          * window (int): the number of lines after which missing
+            lines are given up
+        """
+        self.group = parse_group(group)
+        self.session = int(session)
+        self.expected = int(seq) + 1
+        self.deliver = deliver
+        self.nak = nak
+        self.nak_interval = float(nak_interval)
+        self.window = max(1, int(window))
+        # highest sequence number known to be sent
+        self.last = int(seq)
+        # number of lines given up
+        self.lost = 0
+        # seq: line, complete and waiting for the previous ones, or
+        # None for a line given up
+        self._ready = {}
+        # seq: fragments received
+        self._parts = {}
+        self._repairs = deque()
+        self._nak_t = 0.
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                   socket.IPPROTO_UDP)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                  2**22)
+        except socket.error:
+            pass
+        self._sock.bind(('', self.group[1]))
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                              socket.inet_aton(self.group[0])
+                                + socket.inet_aton('0.0.0.0'))
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._running = True
+        loopy = Thread(target=self._loop)
+        loopy.daemon = True
+        loopy.start()
+
+    def __str__(self):
+        return "Multicast listener of {}:{:d}, sequence {:d}".format(
+            self.group[0], self.group[1], self.expected - 1)
+
+    __repr__ = __str__
+
+    def repair(self, seq, line):
+        """Fills the place of a missing line with its retransmission,
+        or gives it up if line is ``None``. Safe to call from any thread
+
+        Args:
+          * seq (int): the sequence number
+          * line (bytes or None): the line
+        """
+        self._repairs.append((seq, line))
+        try:
+            self._wake_w.send(b'\x00')
+        except socket.error:
+            pass
+
+    def close(self):
+        self._running = False
+        try:
+            self._wake_w.send(b'\x00')
+        except socket.error:
+            pass
+
+    def _loop(self):
+        while self._running:
+            ready = select.select([self._sock, self._wake_r], [], [],
+                                 self.nak_interval / 2)[0]
+            if self._wake_r in ready:
+                self._wake_r.recv(4096)
+            while self._repairs:
+                seq, line = self._repairs.popleft()
+                if seq >= self.expected and self._ready.get(seq) is None:
+                    self._parts.pop(seq, None)
+                    self._ready[seq] = line
+                    self.last = max(self.last, seq)
+            if self._sock in ready:
+                try:
+                    self._datagram(self._sock.recv(65536))
+                except socket.error:
+                    pass
+            self._flush()
+            self._request()
+        for sock in (self._sock, self._wake_r, self._wake_w):
+            sock.close()
+
+    def _datagram(self, data):
+        if len(data) < _DGRAM.size:
+            return
+        session, seq, i, n = _DGRAM.unpack_from(data)
+        if session != self.session:
+            return
+        self.last = max(self.last, seq)
+        if n == 0 or seq < self.expected or seq in self._ready:
+            return
+        if n == 1:
+            self._ready[seq] = data[_DGRAM.size:]
+            return
+        parts = self._parts.get(seq)
+        if parts is None:
+            parts = self._parts[seq] = [None] * n
+        if i < n and parts[i] is None:
+            parts[i] = data[_DGRAM.size:]
+            if all(part is not None for part in parts):
+                del self._parts[seq]
+                self._ready[seq] = b''.join(parts)
+
+    def _flush(self):
+        """Hands over the lines which previous ones are all there
+        """
+        if self.last - self.expected >= self.window:
+            # lagging too much, give up what is missing
+            start = min(self._ready) if self._ready else self.last + 1
+            start = max(start, self.last - self.window + 1)
+            for seq in range(self.expected, start):
+                if seq not in self._ready:
+                    self.lost += 1
+                    self._parts.pop(seq, None)
+            self.expected = start
+        while self.expected in self._ready:
+            line = self._ready.pop(self.expected)
+            self.expected += 1
+            if line is None:
+                self.lost += 1
+            else:
+                self.deliver(line)
+
+    def _request(self):
+        """Requests the missing lines, every nak_interval
+        """
+        if self.last < self.expected:
+            return
+        now = time.time()
+        if now - self._nak_t < self.nak_interval:
+            return
+        self._nak_t = now
+        first = None
+        for seq in range(self.expected, self.last + 2):
+            if seq <= self.last and seq not in self._ready:
+                if first is None:
+                    first = seq
+            elif first is not None:
+                self.nak(first, seq - 1)
+                first = None
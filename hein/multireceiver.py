@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import socket
+from threading import Thread
+try:
+    import selectors
+except ImportError:
+    # python2 backport
+    import selectors34 as selectors
+
+from . import core
+from .socreceiver import SocReceiver, OPEN, _Source, _drop, _on_event
+from .socreceiver import _tick, _react, _halt
+from .profiler import PROCESS
+
+
+__all__ = ['MultiSocReceiver']
+
+
+class MultiSocReceiver(SocReceiver):
+    def __init__(self, sources, name, buffer_size=1024, connect=True,
+                 connectWait=0.5, hostname=None, zerocopy=False,
+                 file_dir=None, inbox=None, reactor=None, profiler=None):
+        """
+        Listens to many transmitters from a single thread. Each
+        transmitter connection is tried and re-tried independently
+        until ``close`` is called.
+
+        Args:
+          * sources (iterable or dict): the transmitters to listen
+            to, given as ports or (hostname, port) tuples. If a dict,
+            its keys are used as source identifiers, else the
+            identifiers are the "hostname:port" strings
+          * name (str[15]): the name of the receiver, for identification
+            purposes
+          * buffer_size (int): the size in octet of each listening
+          * connect (bool): whether to start the connection loop
+            at initialization. If ``False``, use ``connect`` method.
+          * connectWait (float >0.1): the duration in second between two
+            successive connection attempts to a transmitter
+          * hostname (str): the default name of the host to connect to,
+            default is given by ``socket.gethostbyname``
+          * zerocopy (bool): if ``True``, raw messages are given to
+            ``process`` as memoryviews on the receiving buffer, which
+            are only valid until ``process`` returns
+          * file_dir (str or None): the directory where the files sent
+            with ``tell_file`` are written, see ``SocReceiver``
+          * inbox (int or None): if not ``None``, the size of the inbox
+            in which the messages are stored instead of being given to
+            ``process``, see ``SocReceiver``. Messages are then
+            (data, tag, source) tuples. The listening of all the
+            transmitters waits while the inbox is full
+          * reactor (Reactor, bool or None): the reactor on which the
+            connections and the listening run, instead of a thread, see
+            ``SocReceiver``
+          * profiler (Profiler or None): times the stages of the
+            messages, see ``Profiler``
+        """
+        SocReceiver.__init__(self, port=0, name=name,
+                             buffer_size=buffer_size, connect=False,
+                             connectWait=connectWait, hostname=hostname,
+                             zerocopy=zerocopy, file_dir=file_dir,
+                             inbox=inbox, reactor=reactor,
+                             profiler=profiler)
+        self.port = None
+        self._sel = None
+        if self.reactor is None:
+            self._wake_r, self._wake_w = socket.socketpair()
+            self._wake_r.setblocking(0)
+        if isinstance(sources, dict):
+            sources = list(sources.items())
+        else:
+            sources = [(None, item) for item in sources]
+        for source, item in sources:
+            if isinstance(item, (tuple, list)):
+                self.add_source(port=item[1], hostname=item[0], source=source)
+            else:
+                self.add_source(port=item, source=source)
+        if connect:
+            self.connect()
+
+    def __str__(self):
+        return "Multi-socket receiver on {:d} sources, {:d} connected ({})"\
+            .format(len(self._sources), len(self.connected_sources),
+                    'on' if self.running else 'off')
+
+    __repr__ = __str__
+
+    @property
+    def sources(self):
+        """The identifiers of all transmitters listened to
+        """
+        return list(self._sources.keys())
+
+    @sources.setter
+    def sources(self, value):
+        pass
+
+    @property
+    def connected_sources(self):
+        """The identifiers of the transmitters currently connected
+        """
+        return [k for k, v in list(self._sources.items())
+                    if v.state == OPEN]
+
+    @connected_sources.setter
+    def connected_sources(self, value):
+        pass
+
+    @property
+    def connected(self):
+        """
+        Whether the receiver is connected to at least one transmitter
+        """
+        return len(self.connected_sources) > 0
+
+    @connected.setter
+    def connected(self, value):
+        pass
+
+    def add_source(self, port, hostname=None, source=None):
+        """
+        Adds a transmitter to listen to, and returns its identifier
+
+        Args:
+          * port (int): the communication port
+          * hostname (str): the name of the host to connect to, default
+            is the receiver's default hostname
+          * source: the identifier of the transmitter, default is
+            "hostname:port"
+        """
+        host = self.host if hostname is None else str(hostname)
+        port = int(port)
+        if source is None:
+            source = "{}:{:d}".format(host, port)
+        with self._lock:
+            if source not in self._sources:
+                self._sources[source] = _Source(source, host, port)
+        self._wake()
+        return source
+
+    def remove_source(self, source):
+        """
+        Stops listening to a transmitter
+
+        Args:
+          * source: the identifier of the transmitter
+        """
+        with self._lock:
+            src = self._sources.pop(source, None)
+            if src is not None:
+                # socket is closed by the loop
+                src.state = None
+                self._removed.append(src)
+        self._clocks.pop(source, None)
+        self._wake()
+
+    def connect(self):
+        """
+        If not already running, starts the listening and connection loop
+        """
+        self._loopConnect = True
+        if self.running:
+            return
+        self._running = True
+        if self.reactor is not None:
+            self.reactor.call_soon(_react, self)
+            return
+        loopy = Thread(target=listenall, args=(self, ))
+        loopy.daemon = True
+        loopy.start()
+
+    def stop_connectLoop(self):
+        """
+        Stops connecting to new transmitters, but does not stop the
+        current connections nor communications
+        """
+        self._loopConnect = False
+        self._wake()
+
+    def _start(self):
+        return False
+
+    def close(self):
+        """
+        Shuts down the receiver and all its connections
+        """
+        if not self.running:
+            return
+        self._loopConnect = False
+        self._running = False
+        if self.reactor is not None:
+            self.reactor.call(_halt, self)
+        else:
+            self._wake()
+
+    def _wake(self):
+        if self.reactor is not None:
+            self.reactor.call_soon(_react, self)
+            return
+        try:
+            self._wake_w.send(core.ACK)
+        except socket.error:
+            pass
+
+    def _control_sock(self, source=None):
+        src = self._sources.get(source)
+        return None if src is None else src.sock
+
+    def _die(self, source=None):
+        src = self._sources.get(source)
+        if src is not None:
+            _drop(self, src)
+
+    def _deliver(self, data, tag, source=None, meta=None):
+        if self._inbox is not None:
+            self._store((data, tag, source), meta)
+            return
+        self.meta = meta
+        if self.profiler is not None:
+            self.profiler.call(PROCESS, self.process, data=data, tag=tag,
+                               source=source)
+        else:
+            self.process(data=data, tag=tag, source=source)
+
+    def process(self, data, tag, source):
+        """
+        Replace this function with your own data processing
+
+        Args:
+          * data: the data transmitted
+          * tag: the tag given by the sender, or None
+          * source: the identifier of the transmitter
+
+        See ``SocReceiver.process``
+        """
+        print("{}{}{}".format(source,
+                              ": " if tag is None else " {}: ".format(tag),
+                              data))
+
+    def _deliver_file(self, name, tag, path, data, source=None):
+        self.process_file(name=name, tag=tag, path=path, data=data,
+                          source=source)
+
+    def process_file(self, name, tag, path, data, source):
+        """
+        Replace this function with your own processing of the files
+        sent with ``tell_file``
+
+        Args:
+          * name, tag, path, data: see ``SocReceiver.process_file``
+          * source: the identifier of the transmitter
+        """
+        print("{}: file {} received{}".format(
+            source, name, "" if path is None else " in {}".format(path)))
+
+    def _opened(self, src):
+        self._newconnection(src.source)
+
+    def _closed(self, src):
+        pass
+
+    def _newconnection(self, source):
+        """
+        Replace this function with proper new connection processing
+
+        Args:
+          * source: the identifier of the transmitter
+        """
+        print("connected: {}".format(source))
+
+
+def listenall(self):
+    """
+    Infinite loop connecting to the transmitters and listening to the
+    data from all of them
+    """
+    self._sel = selectors.DefaultSelector()
+    self._sel.register(self._wake_r, selectors.EVENT_READ, None)
+    while self.running:
+        timeout = _tick(self)
+        timeout = 1. if timeout is None else min(1., timeout)
+        for key, mask in self._sel.select(timeout):
+            src = key.data
+            if src is None:
+                try:
+                    while self._wake_r.recv(64):
+                        pass
+                except socket.error:
+                    pass
+                continue
+            if src.state is None:  # removed in between
+                _drop(self, src)
+                continue
+            _on_event(self, src, mask)
+    _halt(self)
+    self._sel.close()
+    self._sel = None
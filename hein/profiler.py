@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import os
+import json
+import time
+from threading import Lock
+from threading import local
+try:
+    from threading import get_ident
+except ImportError:
+    # python2
+    from thread import get_ident
+
+
+__all__ = ['Profiler']
+
+
+# stages of the pipeline, in order
+ENCODE = 'encode'
+QUEUE = 'queue'
+PACING = 'pacing'
+SEND = 'send'
+ACK = 'ack'
+SPLIT = 'split'
+DECODE = 'decode'
+PROCESS = 'process'
+STAGES = (ENCODE, QUEUE, PACING, SEND, ACK, SPLIT, DECODE, PROCESS)
+
+# monotonic clock
+_clock = getattr(time, 'perf_counter', time.time)
+
+# histogram buckets: i holds the durations below 2**i microseconds
+_NBUCKETS = 40
+
+
+class _Stage(object):
+    """Histogram of the durations of a stage
+    """
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.buckets = [0] * _NBUCKETS
+
+    def add(self, d):
+        self.count += 1
+        self.total += d
+        if d > self.max:
+            self.max = d
+        i = int(max(0., d) * 1e6).bit_length()
+        self.buckets[min(i, _NBUCKETS - 1)] += 1
+
+    def quantile(self, q):
+        """Returns the upper bound in seconds of the bucket holding the
+        q-quantile
+        """
+        n = 0
+        for i, cnt in enumerate(self.buckets):
+            n += cnt
+            if n >= q * self.count:
+                return min(2**i * 1e-6, self.max)
+        return self.max
+
+    def stats(self):
+        """Returns the count, and the mean, maximum, median, 90th and
+        99th percentiles of the durations
+        """
+        return {'count': self.count,
+                'mean': self.total / max(1, self.count),
+                'max': self.max,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99)}
+
+
+class Profiler(object):
+    def __init__(self, sample=1, trace=None):
+        """Times the stages of the messages through transmitters and
+        receivers, into per-stage histograms and optionally a trace
+        file. Give it as ``profiler`` to ``SocTransmitter`` and
+        ``SocReceiver``; one profiler can serve several of them
+
+        Args:
+          * sample (int): one occurrence of each stage out of sample
+            is timed
+          * trace (str or None): the path of a trace file to write,
+            in the Chrome trace event format (chrome://tracing,
+            Perfetto), or ``None``
+
+        Note:
+          * The stages are: 'encode' (serialization and framing in
+            ``tell``), 'queue' (waiting in the sending buffer),
+            'pacing' (pause between two sendings), 'send' (writing a
+            line to a receiver), 'ack' (waiting for its
+            acknowledgement), 'split' (extracting a frame from the
+            received data), 'decode' (decoding a frame, not counting
+            'process') and 'process' (the user's ``process``)
+          * Sending through shard workers is not timed
+        """
+        self.sample = max(1, int(sample))
+        self.trace = None if trace is None else str(trace)
+        self._lock = Lock()
+        self._local = local()
+        self._stages = {}
+        self._counts = {}
+        self._pid = os.getpid()
+        self._file = None
+        if self.trace is not None:
+            self._file = open(self.trace, 'w')
+            self._file.write('[')
+            self._first = True
+
+    def __str__(self):
+        return "Profiler of {:d} stages, 1 in {:d} sampled{}".format(
+            len(self._stages), self.sample,
+            "" if self.trace is None else ", trace in {}".format(
+                self.trace))
+
+    __repr__ = __str__
+
+    @staticmethod
+    def clock():
+        """Returns the time of the monotonic clock, in seconds
+        """
+        return _clock()
+
+    def start(self, stage):
+        """Returns the current time if this occurrence of the stage is
+        sampled, else ``None``
+        """
+        if self.sample == 1:
+            return _clock()
+        n = self._counts.get(stage, 0) + 1
+        self._counts[stage] = n % self.sample
+        return _clock() if n == self.sample else None
+
+    def record(self, stage, t0, t1=None):
+        """Records a stage which started at t0 and ended at t1, or now,
+        and returns its end
+
+        Args:
+          * stage (str): the name of the stage
+          * t0 (float): the start, from ``clock`` or ``start``
+          * t1 (float or None): the end, or ``None`` for now
+        """
+        if t1 is None:
+            t1 = _clock()
+        self._add(stage, t0, t1 - t0, t1 - t0)
+        return t1
+
+    def call(self, stage, fct, *args, **kwargs):
+        """Calls fct(*args, **kwargs) and returns its result, timing it
+        as a stage if sampled. A stage called within another one is
+        timed along with it, and is not counted in it
+        """
+        stack = self._stack()
+        if stack:
+            if stack[-1] is None:
+                # within a stage not sampled
+                return fct(*args, **kwargs)
+            t0 = _clock()
+        else:
+            t0 = self.start(stage)
+            if t0 is None:
+                stack.append(None)
+                try:
+                    return fct(*args, **kwargs)
+                finally:
+                    stack.pop()
+        current = [0.]
+        stack.append(current)
+        try:
+            return fct(*args, **kwargs)
+        finally:
+            stack.pop()
+            d = _clock() - t0
+            if stack and stack[-1] is not None:
+                stack[-1][0] += d
+            self._add(stage, t0, d, d - current[0])
+
+    def frames(self, frames):
+        """Iterates over the frames of a ``FrameReader``, timing their
+        extraction as the 'split' stage
+        """
+        while True:
+            t0 = self.start(SPLIT)
+            try:
+                comm = next(frames)
+            except StopIteration:
+                return
+            if t0 is not None:
+                self.record(SPLIT, t0)
+            yield comm
+
+    def _stack(self):
+        """Returns the stages being timed in this thread
+        """
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _add(self, stage, t0, d, own):
+        with self._lock:
+            hist = self._stages.get(stage)
+            if hist is None:
+                hist = self._stages[stage] = _Stage()
+            hist.add(own)
+            if self._file is not None:
+                self._file.write('{}\n{}'.format(
+                    '' if self._first else ',', json.dumps({
+                        'name': stage, 'cat': 'hein', 'ph': 'X',
+                        'ts': round(t0 * 1e6, 3), 'dur': round(d * 1e6, 3),
+                        'pid': self._pid, 'tid': get_ident()})))
+                self._first = False
+
+    def stats(self, reset=False):
+        """Returns the count, and the mean, maximum, median, 90th and
+        99th percentiles in seconds of the durations of each stage.
+        The percentiles are the upper bounds of the histogram buckets
+
+        Args:
+          * reset (bool): whether to reset the histograms
+        """
+        with self._lock:
+            stages = self._stages
+            if reset:
+                self._stages = {}
+        order = [stage for stage in STAGES if stage in stages]
+        order += sorted(stage for stage in stages if stage not in STAGES)
+        return dict((stage, stages[stage].stats()) for stage in order)
+
+    def histogram(self, stage):
+        """Returns the histogram of the durations of a stage, as a list
+        of (upper bound in seconds, count) of the non-empty buckets
+
+        Args:
+          * stage (str): the name of the stage
+        """
+        with self._lock:
+            hist = self._stages.get(stage)
+            buckets = [] if hist is None else list(hist.buckets)
+        return [(2**i * 1e-6, cnt) for i, cnt in enumerate(buckets) if cnt]
+
+    def report(self):
+        """Returns the statistics of all stages as a text table, in
+        microseconds
+        """
+        lines = ["{:<10} {:>9} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+            "stage", "count", "mean", "p50", "p90", "p99", "max")]
+        for stage, st in self.stats().items():
+            lines.append("{:<10} {:>9d} {:>10.1f} {:>10.1f} {:>10.1f} "\
+                         "{:>10.1f} {:>10.1f}".format(
+                            stage, st['count'], st['mean'] * 1e6,
+                            st['p50'] * 1e6, st['p90'] * 1e6,
+                            st['p99'] * 1e6, st['max'] * 1e6))
+        return '\n'.join(lines)
+
+    def close(self):
+        """Ends the trace file, if any
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.write('\n]\n')
+                self._file.close()
+                self._file = None
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import socket
+import time
+import heapq
+from itertools import count
+from collections import deque
+from threading import Thread
+from threading import Lock
+from threading import Event
+from threading import current_thread
+try:
+    import queue
+except ImportError:
+    # python2
+    import Queue as queue
+try:
+    import selectors
+except ImportError:
+    # python2 backport
+    import selectors34 as selectors
+
+
+__all__ = ['Reactor', 'shared_reactor']
+
+
+READ = selectors.EVENT_READ
+WRITE = selectors.EVENT_WRITE
+
+
+class _Timer(object):
+    """A call scheduled on a reactor
+    """
+    __slots__ = ('when', 'fct', 'args', 'cancelled')
+
+    def __init__(self, when, fct, args):
+        self.when = when
+        self.fct = fct
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Prevents the call, if it was not done yet
+        """
+        self.cancelled = True
+
+
+class Reactor(object):
+    def __init__(self, workers=2):
+        """Event loop that many transmitters and receivers of a process
+        can share instead of running their own threads: a single
+        selector thread watches all their sockets and timers, and a
+        pool of worker threads runs the sending, which waits for
+        acknowledgements. Nothing wakes up while nothing happens
+
+        Args:
+          * workers (int): the minimum number of worker threads, at
+            least 1; the pool grows to one worker per attached
+            transmitter, see ``attach``
+
+        Note:
+          * The data received is processed in the selector thread, so
+            ``process`` should return quickly, and should not wait for
+            a transmitter of the same reactor (e.g. ``ping``)
+        """
+        self.workers = max(1, int(workers))
+        self._sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(0)
+        self._sel.register(self._wake_r, READ, None)
+        self._lock = Lock()
+        self._calls = deque()
+        self._timers = []
+        # breaks the ties between timers of a same time
+        self._seq = count()
+        self._woken = False
+        self._jobs = queue.Queue()
+        self._running = True
+        self._thread = Thread(target=react, args=(self,))
+        self._thread.daemon = True
+        self._thread.start()
+        self._pool = []
+        self._attached = 0
+        self._resize()
+
+    def __str__(self):
+        return "Reactor of {:d} sockets, {:d} workers ({})".format(
+            max(0, len(self._sel.get_map() or ()) - 1), len(self._pool),
+            'on' if self.running else 'off')
+
+    __repr__ = __str__
+
+    @property
+    def running(self):
+        """Whether the reactor is running
+        """
+        return self._running
+
+    @running.setter
+    def running(self, value):
+        pass
+
+    def in_thread(self):
+        """Whether the caller runs in the selector thread
+        """
+        return current_thread() is self._thread
+
+    def call(self, fct, *args):
+        """Calls fct(*args) in the selector thread: right away if
+        called from it, else as soon as possible
+        """
+        if self.in_thread():
+            fct(*args)
+        else:
+            self.call_soon(fct, *args)
+
+    def call_soon(self, fct, *args):
+        """Calls fct(*args) in the selector thread as soon as possible
+        """
+        with self._lock:
+            self._calls.append((fct, args))
+            wake = not self._woken
+            self._woken = True
+        if wake:
+            self._wake()
+
+    def call_later(self, delay, fct, *args):
+        """Calls fct(*args) in the selector thread in delay seconds,
+        and returns a timer which ``cancel`` method prevents the call
+        """
+        timer = _Timer(time.time() + max(0., delay), fct, args)
+        with self._lock:
+            heapq.heappush(self._timers, (timer.when, next(self._seq),
+                                          timer))
+            first = self._timers[0][2] is timer
+        if first and current_thread() is not self._thread:
+            self._wake()
+        return timer
+
+    def submit(self, fct, *args):
+        """Calls fct(*args) in a worker thread
+        """
+        self._jobs.put((fct, args))
+
+    def attach(self):
+        """Adds a worker thread to the pool for a transmitter, beyond
+        the minimum number of workers: a transmitter waiting for the
+        acknowledgements of its receivers then never holds up the
+        sending of another one. To be balanced by ``detach``
+        """
+        with self._lock:
+            self._attached += 1
+        self._resize()
+
+    def detach(self):
+        """Removes the worker thread added by ``attach``
+        """
+        with self._lock:
+            self._attached = max(0, self._attached - 1)
+        self._resize()
+
+    def _resize(self):
+        """Starts or stops worker threads to match the number of
+        attached transmitters
+        """
+        with self._lock:
+            if not self.running:
+                return
+            size = max(self.workers, self._attached)
+            while len(self._pool) < size:
+                loopy = Thread(target=work, args=(self,))
+                loopy.daemon = True
+                loopy.start()
+                self._pool.append(loopy)
+            # any idle worker exits on None
+            while len(self._pool) > size:
+                self._pool.pop()
+                self._jobs.put(None)
+
+    def register(self, sock, callback, events=READ):
+        """Calls callback(mask) in the selector thread each time a
+        socket is ready
+
+        Args:
+          * sock (socket): the socket to watch
+          * callback (callable): called with the selectors event mask
+          * events (int): the selectors events to watch, reading by
+            default
+        """
+        self.call(self._sel.register, sock, events, callback)
+
+    def modify(self, sock, events):
+        """Changes the events watched on a registered socket
+        """
+        self.call(_modify, self._sel, sock, events)
+
+    def unregister(self, sock):
+        """Stops watching a socket, and returns once it is done: the
+        socket must not be closed before, or its number could be reused
+        by a new socket while still watched
+        """
+        if current_thread() is self._thread or not self.running:
+            _unregister(self._sel, sock)
+            return
+        done = Event()
+        self.call_soon(_unregister, self._sel, sock, done)
+        done.wait(1.)
+
+    def close(self):
+        """Stops the selector and worker threads. Sockets still
+        registered are not closed
+        """
+        if not self.running:
+            return
+        with self._lock:
+            self._running = False
+            pool, self._pool = self._pool, []
+        self._wake()
+        for loopy in pool:
+            self._jobs.put(None)
+        if current_thread() is not self._thread:
+            self._thread.join(1.)
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\x00')
+        except socket.error:
+            pass
+
+    def _due(self):
+        """Runs the calls and timers due, and returns the time in
+        seconds until the next timer, or ``None``
+        """
+        with self._lock:
+            calls, self._calls = self._calls, deque()
+            self._woken = False
+        for fct, args in calls:
+            _call(fct, args)
+        now = time.time()
+        while True:
+            with self._lock:
+                if not self._timers:
+                    return None
+                when, seq, timer = self._timers[0]
+                if timer.cancelled:
+                    heapq.heappop(self._timers)
+                    continue
+                if when > now:
+                    return when - now
+                heapq.heappop(self._timers)
+            _call(timer.fct, timer.args)
+
+
+def _modify(sel, sock, events):
+    key = sel.get_key(sock)
+    sel.modify(sock, events, key.data)
+
+
+def _unregister(sel, sock, done=None):
+    try:
+        sel.unregister(sock)
+    except (KeyError, ValueError):
+        pass
+    if done is not None:
+        done.set()
+
+
+def _call(fct, args):
+    """Calls a callback, which failure must not stop its thread
+    """
+    try:
+        fct(*args)
+    except Exception as e:
+        print("WARNING: reactor callback {} failed ({}: {})".format(
+            getattr(fct, '__name__', fct), type(e).__name__, e))
+
+
+def react(self):
+    """Infinite loop of the selector thread of a reactor
+    """
+    while self.running:
+        timeout = self._due()
+        if self._calls:
+            timeout = 0.
+        for key, mask in self._sel.select(timeout):
+            if key.data is None:
+                try:
+                    while self._wake_r.recv(64):
+                        pass
+                except socket.error:
+                    pass
+                continue
+            # unregistered by a previous callback of the same select
+            current = self._sel.get_map().get(key.fd)
+            if current is None or current.data is not key.data:
+                continue
+            _call(key.data, (mask,))
+    self._sel.close()
+    self._wake_r.close()
+    self._wake_w.close()
+
+
+def work(self):
+    """Infinite loop of a worker thread of a reactor
+    """
+    while True:
+        job = self._jobs.get()
+        if job is None:
+            break
+        _call(*job)
+
+
+_SHARED = None
+_SHARED_LOCK = Lock()
+
+
+def shared_reactor():
+    """Returns the reactor shared by the whole process, started on
+    first use
+    """
+    global _SHARED
+    with _SHARED_LOCK:
+        if _SHARED is None or not _SHARED.running:
+            _SHARED = Reactor()
+        return _SHARED
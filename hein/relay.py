@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+
+import os
+import shutil
+import tempfile
+from threading import Thread
+from threading import Semaphore
+
+from . import core
+from .socreceiver import SocReceiver, getfile
+from .shmring import Overrun
+from .soctransmitter import SocTransmitter
+from .sendqueue import _Frame
+
+
+__all__ = ['Relay']
+
+
+_PINGKEY = bytes(core.PINGKEY)
+_DIEKEY = bytes(core.DIEKEY)
+_FILEKEY = bytes(core.FILEKEY)
+_CLOCKKEY = bytes(core.CLOCKKEY)
+# frames of the multicast and shared memory transports of the upstream
+# transmitter, consumed by the relay
+_TRANSPORTKEYS = (bytes(core.MCASTKEY), bytes(core.REPAIRKEY),
+                  bytes(core.SHMOPENKEY), bytes(core.SHMKEY))
+
+
+class Relay(SocReceiver):
+    def __init__(self, port, name, relay_port, nreceivermax=5,
+                 hostname=None, connect=True, connectWait=0.5,
+                 buffer_size=1024, portname="", timeoutACK=0.5,
+                 propagate_ack=True, file_dir=None):
+        """
+        Node of a distribution tree: listens to a transmitter like a
+        receiver, and re-broadcasts the frames received as they are,
+        without decoding them, through a local transmitter to which
+        receivers or other relays can listen
+
+        Args:
+          * port (int): the port of the upstream transmitter
+          * name (str[15]): the name of the relay, for identification
+            purposes upstream
+          * relay_port (int): the port of the local transmitter
+          * nreceivermax (int): the maximum amount of local receivers,
+            from 1 to 5
+          * hostname (str): the name of the host of the upstream
+            transmitter, default is given by ``socket.gethostbyname``
+          * connect (bool): whether to start the connection loop at
+            initialization. If ``False``, use ``connect`` method
+          * connectWait (float >0.1): see ``SocReceiver``
+          * buffer_size (int): see ``SocReceiver``
+          * portname (str[15]): the name of the local transmitter, for
+            display purposes only
+          * timeoutACK (float or None): see ``SocTransmitter``, for the
+            local receivers
+          * propagate_ack (bool): whether to acknowledge the frames
+            upstream only once the local receivers acknowledged them,
+            else as soon as they are received
+          * file_dir (str or None): the directory where the files are
+            stored while forwarded, default is a temporary directory
+
+        Note:
+          * With propagate_ack, timeoutACK should be shorter than the
+            one of the upstream transmitter, so that a dead local
+            receiver is dropped before the relay itself is
+          * Pings are answered by the relay, the local receivers are
+            pinged by the local transmitter
+          * When the upstream transmitter closes, the local receivers
+            stay connected to the relay, and get the frames again once
+            the relay reconnected
+          * A receiver joining a relay in the middle of delta messages
+            waits for the next keyframe
+          * If the upstream transmitter uses multicast or a shared
+            memory ring, the relay reads them and forwards their frames
+            over its local transmitter
+          * Stamped frames are stamped again by the local transmitter
+            when it sends them, which then pings the local receivers to
+            estimate their clock offsets: the latency measured by a
+            receiver of a relay is the one from the relay
+        """
+        self.propagate_ack = bool(propagate_ack)
+        # released once the last frames read from the upstream
+        # transports are sent, or None
+        self._relayed = None
+        self._tmp = None
+        if file_dir is None:
+            self._tmp = tempfile.mkdtemp(prefix='hein-relay-')
+            file_dir = self._tmp
+        self.transmitter = SocTransmitter(port=relay_port,
+                                          nreceivermax=nreceivermax,
+                                          portname=portname,
+                                          timeoutACK=timeoutACK)
+        self._lane = self.transmitter.sending_buffer.lane(
+            core.PRIORITY_NORMAL)
+        super(Relay, self).__init__(port=port, name=name,
+                                    buffer_size=buffer_size,
+                                    connect=connect,
+                                    connectWait=connectWait,
+                                    portname=portname, hostname=hostname,
+                                    file_dir=file_dir)
+
+    def __str__(self):
+        return "Relay from port {:d} ({}) to port {:d} ({})".format(
+            self.port,
+            'on' if self.connected and self.running else 'off',
+            self.transmitter.port,
+            'on' if self.transmitter.running else 'off')
+
+    __repr__ = __str__
+
+    def _start(self):
+        if not self.running and self.connected:
+            self._running = True
+            loopy = Thread(target=relayme, args=(self, ))
+            loopy.daemon = True
+            loopy.start()
+            return True
+        else:
+            return False
+
+    def shutdown(self):
+        """
+        Stops the connection loop, the listening and the local
+        transmitter, which forces the local receivers to drop
+        """
+        self._loopConnect = False
+        self.close()
+        self.transmitter.close()
+        if self._tmp is not None:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+
+    def file_destination(self, name, tag, size):
+        fd, path = tempfile.mkstemp(dir=self.file_dir)
+        os.close(fd)
+        return path
+
+    def _forward(self, line=None, path=None, name=None, tag=None, ack=True,
+                 stamps=None):
+        """Queues a line, or a file, in the local transmitter, and
+        returns the semaphore released once it is sent. ack tells
+        whether a frame of the line asks for an acknowledgement, and
+        stamps are the positions where to write the sending time
+        """
+        sent = Semaphore(0)
+        if path is None:
+            frame = _Frame(line, sent=sent, lane=self._lane, ack=ack)
+            if stamps is not None:
+                frame.stamp_at = stamps
+                # for the local receivers to estimate their clock offsets
+                self.transmitter.stamp = True
+        else:
+            frame = _Frame((tag, name), path=path, sent=sent,
+                           lane=self._lane)
+        self.transmitter.sending_buffer.append(frame)
+        return sent
+
+    def _mcast_line(self, line, source=None):
+        """Forwards a multicast line, which frames are packaged
+        already
+        """
+        comms = core.split_flow(line)[:-1]
+        ack = any(core._acked(comm) for comm in comms)
+        stamps = None
+        if any(core._split_header(comm)[3] is not None for comm in comms):
+            line, stamps = core._unstamp([core._package(comm)
+                                              for comm in comms])
+        self._forward(line, ack=ack, stamps=stamps)
+
+    def _shm_read(self, pos, source=None):
+        """Forwards the frames of a record of the shared memory ring
+        """
+        ring = self._rings.get(source)
+        if ring is None:
+            return
+        try:
+            res = ring.read(pos)
+        except Overrun:
+            res = None
+        if res is None:
+            self.shm_overruns += 1
+            return
+        data, start = res[0], 0
+        lines = []
+        while start < len(data):
+            l = core._SHMFRAME.unpack_from(data, start)[0]
+            start += core._SHMFRAME.size
+            lines.append(data[start:start + l])
+            start += l
+        ack = any(core._acked(comm) for comm in lines)
+        line, stamps = core._unstamp([core._package(comm) for comm in lines])
+        self._relayed = self._forward(line, ack=ack, stamps=stamps)
+
+    def _wait(self, sent):
+        """Waits until a forwarded line is sent, and returns whether it
+        was
+        """
+        while self.transmitter.running:
+            if sent.acquire(True, 1.):
+                return True
+        return False
+
+    def _file_done(self, sink, source=None):
+        res = sink.close()
+        path = sink.path
+        if path is None:
+            # could not be written, received in memory
+            path = self.file_destination(sink.name, sink.tag, sink.size)
+            with open(path, 'wb') as f:
+                f.write(res)
+        self._wait(self._forward(path=path, name=sink.name, tag=sink.tag))
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _unescape(raw, lend):
+    """Returns a raw frame without its end characters and escaping
+    """
+    return core.Byt(bytes(raw[:-lend])).replace(core.ESCAPEDMESSAGEEND,
+                                                 core.MESSAGEEND)
+
+
+def _forward_frames(self, frames, ack):
+    """Forwards raw frames, to be stamped again when sent
+    """
+    line, stamps = core._unstamp(frames)
+    return self._forward(line, ack=ack, stamps=stamps)
+
+
+def _ack(self, sent=None):
+    """Acknowledges the frames received, once sent is released if
+    given, and returns whether it could
+    """
+    if sent is not None:
+        self._wait(sent)
+    try:
+        self._soc.send(core.ACK)
+    except:  # socket died for good
+        self._soc.close()
+        self._running = False
+        return False
+    return True
+
+
+def relayme(self):
+    """
+    Infinite loop to forward the frames from the port
+    """
+    reader = core.FrameReader(self._soc, self.buffer_size)
+    lend = len(core.DMESSAGEEND)
+    while self.running:
+        n = reader.read(1.)
+        if n is None:
+            continue
+        if not self.running:
+            self.close()
+            break
+        if n == 0:
+            # maybe the socket died, let's give it a chance
+            try:
+                self.close()
+            except:
+                pass
+            continue
+        while True:
+            nframes = 0
+            lines = []
+            header = None
+            die = False
+            # whether a frame asks for an acknowledgement, of the chunk
+            # and of the lines to forward
+            ack = False
+            fwd_ack = False
+            sent = None
+            for raw in reader.frames(raw=True):
+                nframes += 1
+                key = bytes(raw[:core.KEYLENGTH])
+                acked = core._acked(raw)
+                ack = ack or acked
+                # pings are answered by the ACK
+                if key == _PINGKEY:
+                    continue
+                # the clock of the upstream transmitter is not the one
+                # of the local transmitter
+                elif key == _CLOCKKEY:
+                    continue
+                elif key == _DIEKEY:
+                    die = True
+                    break
+                elif key == _FILEKEY:
+                    # raw file content follows, not frames
+                    header = _unescape(raw, lend)
+                    break
+                elif key in _TRANSPORTKEYS:
+                    # keep the order of the frames forwarded
+                    if lines:
+                        sent = _forward_frames(self, lines, fwd_ack)
+                        lines = []
+                        fwd_ack = False
+                    self._relayed = None
+                    self._dispatch(_unescape(raw, lend))
+                    if self._relayed is not None:
+                        sent = self._relayed
+                    continue
+                lines.append(raw)
+                fwd_ack = fwd_ack or acked
+            if nframes == 0:
+                break
+            if lines:
+                # the views are only valid until the next read
+                sent = _forward_frames(self, lines, fwd_ack)
+            if ack and not _ack(self, sent if self.propagate_ack
+                                            else None):
+                return
+            if die:
+                self._die()
+                break
+            if header is None:
+                break
+            self._dispatch(header)
+            if not getfile(self, reader):
+                break
+    if self._sink is not None:
+        self._sink.close()
+        self._sink = None
+    self._running = False
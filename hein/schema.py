@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import struct
+from collections import namedtuple
+from datetime import datetime
+from datetime import date
+from datetime import time
+from zlib import crc32
+from byt import Byt
+
+from . import core
+
+
+__all__ = ['Schema']
+
+
+# python types to type codes
+_TYPECODES = {
+    bool: core.BOOLCODE,
+    int: core.INTCODE,
+    float: core.FLOATCODE,
+    core.unicode: core.UNICODE,
+    bytes: core.BYTESCODE,
+    Byt: core.BYTCODE,
+    datetime: core.DTCODE,
+    date: core.DATECODE,
+    time: core.TIMECODE}
+
+# fixed-size codes, as struct formats
+_FIXED = {
+    core.BOOLCODE: '?',
+    core.INTCODE: 'q',
+    core.FLOATCODE: 'd'}
+
+# length prefix of variable-size values
+_LEN = struct.Struct('<I')
+
+try:
+    _INTTYPES = (int, long)
+except NameError:
+    _INTTYPES = (int,)
+
+
+def _check(code, v):
+    """Whether v has exactly the type given by code
+    """
+    if code == core.BOOLCODE:
+        return isinstance(v, bool)
+    elif code == core.INTCODE:
+        return isinstance(v, _INTTYPES) and not isinstance(v, bool)
+    elif code == core.FLOATCODE:
+        return isinstance(v, float)
+    elif code == core.UNICODE:
+        return isinstance(v, core.unicode)
+    elif code == core.BYTESCODE:
+        return isinstance(v, bytes) and not isinstance(v, Byt)
+    elif code == core.BYTCODE:
+        return isinstance(v, Byt)
+    elif code == core.DTCODE:
+        return isinstance(v, datetime)
+    elif code == core.DATECODE:
+        return isinstance(v, date) and not isinstance(v, datetime)
+    elif code == core.TIMECODE:
+        return isinstance(v, time)
+    return False
+
+
+class Schema(object):
+    def __init__(self, fields, record=False):
+        """Describes dictionaries that always have the same keys and
+        value types, so they can be sent as positional packed values
+
+        Args:
+          * fields (list or OrderedDict): the (name, type) pairs of the
+            dictionary items, in a fixed order. Types can be bool, int,
+            float, str, unicode, bytes, Byt, datetime, date or time
+          * record (bool): if ``True``, unpacked messages are
+            lightweight named-tuples instead of dicts
+        """
+        if hasattr(fields, 'items'):
+            fields = list(fields.items())
+        self.names = [str(name) for name, typ in fields]
+        self.codes = []
+        for name, typ in fields:
+            code = _TYPECODES.get(typ, typ)
+            if not isinstance(code, Byt):
+                code = Byt(str(code))
+            if code not in _TYPECODES.values():
+                raise TypeError("unsupported type '{}' for field '{}'"\
+                                    .format(typ, name))
+            self.codes.append(code)
+        self.record = bool(record)
+        self._fixed = [i for i, code in enumerate(self.codes)
+                            if code in _FIXED]
+        self._var = [i for i, code in enumerate(self.codes)
+                            if code not in _FIXED]
+        self._struct = struct.Struct(
+            '<I' + ''.join(_FIXED[self.codes[i]] for i in self._fixed))
+        desc = ','.join("{}:{}".format(name, code)
+                            for name, code in zip(self.names, self.codes))
+        self.fingerprint = crc32(desc.encode(core.ENCODING)) & 0xffffffff
+        self._record = namedtuple('Record', self.names, rename=True)
+
+    def __str__(self):
+        return "Schema({})".format(', '.join(
+            "{}:{}".format(name, code)
+                for name, code in zip(self.names, self.codes)))
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return len(self.names)
+
+    def pack(self, v):
+        """Returns the packed positional values of the dictionary v,
+        prefixed with the schema fingerprint
+
+        Raises ValueError if v does not match the schema
+        """
+        if len(v) != len(self.names):
+            raise ValueError("keys do not match the schema")
+        try:
+            values = [v[name] for name in self.names]
+        except KeyError:
+            raise ValueError("keys do not match the schema")
+        for code, item in zip(self.codes, values):
+            if not _check(code, item):
+                raise ValueError("types do not match the schema")
+        try:
+            res = [self._struct.pack(self.fingerprint,
+                                     *[values[i] for i in self._fixed])]
+        except struct.error:
+            # e.g. int overflow
+            raise ValueError("values do not match the schema")
+        for i in self._var:
+            code = self.codes[i]
+            if code == core.UNICODE:
+                data = values[i].encode(core.ENCODING)
+            else:
+                data = core._ext2bytes(values[i], keep_typ=False)
+            res.append(_LEN.pack(len(data)))
+            res.append(bytes(data))
+        return Byt(b''.join(res))
+
+    def unpack(self, data):
+        """Returns the dict, or record, packed in data
+
+        Raises ValueError if data was packed with another schema
+        """
+        data = bytes(data)
+        values = [None] * len(self.names)
+        fixed = self._struct.unpack_from(data, 0)
+        if fixed[0] != self.fingerprint:
+            raise ValueError("data does not match the schema")
+        for i, item in zip(self._fixed, fixed[1:]):
+            values[i] = item
+        pos = self._struct.size
+        for i in self._var:
+            n = _LEN.unpack_from(data, pos)[0]
+            pos += _LEN.size
+            item = data[pos:pos + n]
+            pos += n
+            code = self.codes[i]
+            if code == core.UNICODE:
+                values[i] = item.decode(core.ENCODING)
+            elif code == core.BYTESCODE:
+                values[i] = item
+            elif code == core.BYTCODE:
+                values[i] = Byt(item)
+            else:
+                values[i] = core.bytes2type(code + core.DICTMAPPER
+                                            + Byt(item))
+        if self.record:
+            return self._record(*values)
+        return dict(zip(self.names, values))
@@ -0,0 +1,584 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import time
+from collections import deque
+from threading import Condition
+
+from . import core
+
+
+__all__ = ['SendQueue']
+
+
+# lane of the control frames (ping, die), before the priority lanes
+CONTROL = 0
+
+LANENAMES = {
+    CONTROL: 'control',
+    core.PRIORITY_HIGH + 1: 'high',
+    core.PRIORITY_NORMAL + 1: 'normal',
+    core.PRIORITY_LOW + 1: 'low'}
+
+
+class _Frame(object):
+    """A line waiting in the sending buffer
+    """
+    __slots__ = ('line', 'ping', 'target', 'sent', 'path', 'lane', 't',
+                 'size', 'deadline', 'tag', 'coalesce', 'distributed',
+                 'route_key', 'once', 'stamp', 'probe', 'ack', 'journaled',
+                 'paced', 'stamp_at', 'droppable')
+
+    def __init__(self, line, ping=False, target=None, sent=None, path=None,
+                 lane=core.PRIORITY_NORMAL + 1, deadline=None, tag=None,
+                 coalesce=False, distributed=False, route_key=None,
+                 once=False, probe=False, ack=True, paced=True,
+                 droppable=True):
+        self.line = line
+        self.ping = ping
+        # whether the ping only measures the round trips to estimate the
+        # clock offsets of the receivers, and has no caller waiting
+        self.probe = probe
+        # name of the only receiver to send to, or None for all
+        self.target = target
+        # semaphore released once the line is sent, or None
+        self.sent = sent
+        # file which content follows the line, the line is then the
+        # tag only and the header is built when sending
+        self.path = path
+        self.lane = lane
+        # queuing time
+        self.t = 0.
+        self.size = 0 if path is not None else len(line)
+        # time after which the frame is not worth sending, or None
+        self.deadline = deadline
+        self.tag = tag
+        # whether the frame can be replaced by a later one of its tag
+        self.coalesce = coalesce
+        # whether the frame goes to one receiver only, chosen when
+        # sending, and the key to choose it in key-hash mode
+        self.distributed = distributed
+        self.route_key = route_key
+        # whether the frame is sent once for all receivers, to the
+        # multicast group or the shared memory ring
+        self.once = once
+        # clock time when queued, if profiled
+        self.stamp = None
+        # whether the receivers acknowledge the line
+        self.ack = ack
+        # whether the line goes to the journal once sent
+        self.journaled = False
+        # whether the following lines wait for the sending frequency,
+        # which the chunks of a stream do not
+        self.paced = paced
+        # position in the line where the sending time is written just
+        # before sending, list of positions for merged frames, or None
+        self.stamp_at = None
+        # whether the frame can be dropped on overflow, which would
+        # break the delta messages and streams following it
+        self.droppable = droppable
+
+    @property
+    def mergeable(self):
+        """Whether the line can be concatenated with others
+        """
+        return not self.ping and self.path is None
+
+
+# behaviours when the high water mark is reached
+BLOCK = 'block'
+REJECT = 'reject'
+DROP = 'drop'
+OVERFLOWS = (BLOCK, REJECT, DROP)
+
+
+class _LaneStats(object):
+    __slots__ = ('sent', 'dropped', 'expired', 'coalesced', 'redelivered',
+                 'wait', 'wait_max')
+
+    def __init__(self):
+        self.sent = 0
+        self.dropped = 0
+        self.expired = 0
+        self.coalesced = 0
+        self.redelivered = 0
+        self.wait = 0.
+        self.wait_max = 0.
+
+
+class SendQueue(object):
+    def __init__(self, starvation=0.5, high_water=None, low_water=None,
+                 high_water_bytes=None, low_water_bytes=None,
+                 overflow=BLOCK, on_backpressure=None, on_ready=None):
+        """Sending buffer of a transmitter, made of priority lanes.
+        Control frames always go first, then the frames of the highest
+        priority, unless a lower priority frame has waited for too long
+
+        Args:
+          * starvation (float or None): the waiting time in seconds
+            after which a frame is sent before the frames of higher
+            priorities (but after control frames), or ``None`` for
+            strict priorities
+          * high_water (int or None): the number of queued frames above
+            which new frames undergo the overflow behaviour, or
+            ``None`` for no limit
+          * low_water (int or None): the number of queued frames below
+            which the backpressure ends, default is half the high water
+            mark
+          * high_water_bytes (int or None): same as high_water, in
+            octets of queued frames
+          * low_water_bytes (int or None): same as low_water, in octets
+            of queued frames
+          * overflow (str): the behaviour when a high water mark is
+            reached: 'block' waits for room, 'reject' refuses the new
+            frame, 'drop' drops the oldest frames
+          * on_backpressure (callable or None): called with ``True``
+            when a high water mark is reached, and with ``False`` when
+            the queue is back below the low water marks
+          * on_ready (callable or None): called without argument each
+            time frames are queued, for a sender which does not wait
+            on the queue
+
+        Note:
+          * Control frames are never refused nor dropped
+          * Frames which are not droppable (delta messages, stream
+            chunks) are not dropped by the 'drop' behaviour, which may
+            leave the queue above the high water mark
+        """
+        if overflow not in OVERFLOWS:
+            raise ValueError("overflow must be one of {}".format(OVERFLOWS))
+        self.starvation = None if starvation is None else float(starvation)
+        self.high_water, self.low_water = _marks(high_water, low_water)
+        self.high_water_bytes, self.low_water_bytes = _marks(
+            high_water_bytes, low_water_bytes)
+        self.overflow = overflow
+        self.on_backpressure = on_backpressure
+        self.on_ready = on_ready
+        self._lanes = [deque() for i in range(len(LANENAMES))]
+        self._stats = [_LaneStats() for i in range(len(LANENAMES))]
+        self._cond = Condition()
+        self._bytes = 0
+        self._count = 0
+        # number of frames taken but not sent yet
+        self._inflight = 0
+        self._full = False
+        # number of coalescable frames queued since last coalescing
+        self._coalescable = 0
+
+    def __str__(self):
+        return "Send queue ({})".format(', '.join(
+            "{}: {:d}".format(LANENAMES[i], len(lane))
+                for i, lane in enumerate(self._lanes)))
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self):
+        """The number of octets of the queued frames
+        """
+        return self._bytes
+
+    @nbytes.setter
+    def nbytes(self, value):
+        pass
+
+    @property
+    def full(self):
+        """Whether the queue is under backpressure
+        """
+        return self._full
+
+    @full.setter
+    def full(self, value):
+        pass
+
+    def __iter__(self):
+        """Iterates over a copy of the queued frames, in lane order
+        """
+        with self._cond:
+            frames = [frame for lane in self._lanes for frame in lane]
+        return iter(frames)
+
+    @staticmethod
+    def lane(priority):
+        """Returns the lane of a priority
+
+        Args:
+          * priority (int): one of ``core.PRIORITY_HIGH``,
+            ``core.PRIORITY_NORMAL`` or ``core.PRIORITY_LOW``
+        """
+        priority = int(priority)
+        if not core.PRIORITY_HIGH <= priority <= core.PRIORITY_LOW:
+            raise ValueError("unknown priority {}".format(priority))
+        return priority + 1
+
+    def _over(self, beyond=False):
+        """Returns whether a high water mark is reached, or exceeded if
+        beyond
+        """
+        return (self.high_water is not None
+                    and self._count >= self.high_water + beyond)\
+            or (self.high_water_bytes is not None
+                    and self._bytes >= self.high_water_bytes + beyond)
+
+    def _under(self):
+        return (self.low_water is None or self._count <= self.low_water)\
+            and (self.low_water_bytes is None
+                    or self._bytes <= self.low_water_bytes)
+
+    def _update(self):
+        """Updates the backpressure state, and returns it if it changed,
+        else None
+        """
+        if not self._full and self._over():
+            self._full = True
+            return True
+        elif self._full and self._under():
+            self._full = False
+            return False
+        return None
+
+    def _notify(self, change):
+        if change is not None and self.on_backpressure is not None:
+            self.on_backpressure(change)
+
+    def _ready(self):
+        if self.on_ready is not None:
+            self.on_ready()
+
+    def _push(self, frame):
+        self._lanes[frame.lane].append(frame)
+        self._count += 1
+        self._bytes += frame.size
+        if frame.coalesce:
+            self._coalescable += 1
+
+    def _pop(self, i):
+        frame = self._lanes[i].popleft()
+        self._count -= 1
+        self._bytes -= frame.size
+        return frame
+
+    def _expired(self, i, frame, now):
+        """Discards the frame just popped from lane i if its deadline
+        passed, and returns whether it did
+        """
+        if frame.deadline is None or frame.deadline > now:
+            return False
+        self._stats[i].expired += 1
+        if frame.sent is not None:
+            frame.sent.release()
+        return True
+
+    def _drop_oldest(self):
+        """Drops the oldest droppable data frame, and returns it, or
+        None if there is none
+        """
+        oldest = None
+        for i in range(CONTROL + 1, len(self._lanes)):
+            for k, frame in enumerate(self._lanes[i]):
+                if frame.droppable:
+                    if oldest is None or frame.t < oldest[2].t:
+                        oldest = (i, k, frame)
+                    break
+        if oldest is None:
+            return None
+        i, k, frame = oldest
+        del self._lanes[i][k]
+        self._count -= 1
+        self._bytes -= frame.size
+        self._stats[i].dropped += 1
+        if frame.sent is not None:
+            frame.sent.release()
+        return frame
+
+    def append(self, frame):
+        """Queues a frame in its lane, regardless of the water marks
+        """
+        frame.t = time.time()
+        with self._cond:
+            self._push(frame)
+            change = self._update()
+            self._cond.notify_all()
+        self._notify(change)
+        self._ready()
+
+    def put(self, frame, timeout=1.):
+        """Queues a frame in its lane, applying the overflow behaviour
+        if the queue is full, and returns whether the frame was queued
+
+        Args:
+          * frame (_Frame): the frame
+          * timeout (float or None): with the 'block' behaviour, the
+            maximum waiting time in seconds, or ``None`` to wait
+            indefinitely
+        """
+        if frame.lane == CONTROL:
+            self.append(frame)
+            return True
+        end = None if timeout is None else time.time() + timeout
+        queued = True
+        with self._cond:
+            if self.overflow == BLOCK:
+                while self._over():
+                    left = None if end is None else end - time.time()
+                    if left is not None and left <= 0:
+                        self._stats[frame.lane].dropped += 1
+                        return False
+                    self._cond.wait(left)
+            elif self.overflow == REJECT and self._over():
+                self._stats[frame.lane].dropped += 1
+                change = self._update()
+                queued = False
+            if queued:
+                frame.t = time.time()
+                self._push(frame)
+                if self.overflow == DROP:
+                    while self._over(beyond=True):
+                        dropped = self._drop_oldest()
+                        if dropped is None:
+                            break
+                        if dropped is frame:
+                            queued = False
+                            break
+                change = self._update()
+                self._cond.notify_all()
+        self._notify(change)
+        if queued:
+            self._ready()
+        return queued
+
+    def clear(self):
+        """Drops all the queued frames
+        """
+        with self._cond:
+            for lane in self._lanes:
+                for frame in lane:
+                    if frame.sent is not None:
+                        frame.sent.release()
+                lane.clear()
+            self._count = 0
+            self._bytes = 0
+            change = self._update()
+            self._cond.notify_all()
+        self._notify(change)
+
+    def coalesce(self):
+        """Keeps only the most recent of the queued coalescable frames
+        of each tag, lane and target, and returns the number of frames
+        removed
+        """
+        with self._cond:
+            if self._coalescable == 0:
+                return 0
+            self._coalescable = 0
+            removed = 0
+            for i, lane in enumerate(self._lanes):
+                seen = set()
+                kept = deque()
+                # walk from the most recent
+                for frame in reversed(lane):
+                    if frame.coalesce:
+                        key = (frame.tag, frame.target)
+                        if key in seen:
+                            self._count -= 1
+                            self._bytes -= frame.size
+                            self._stats[i].coalesced += 1
+                            removed += 1
+                            if frame.sent is not None:
+                                frame.sent.release()
+                            continue
+                        seen.add(key)
+                    kept.appendleft(frame)
+                if len(kept) != len(lane):
+                    self._lanes[i] = kept
+            change = self._update()
+            self._cond.notify_all()
+        self._notify(change)
+        return removed
+
+    def done(self):
+        """Tells that the frames last taken were sent
+        """
+        with self._cond:
+            self._inflight = 0
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Waits until all the queued frames are sent, and returns
+        whether they were
+
+        Args:
+          * timeout (float or None): the maximum waiting time in
+            seconds, or ``None`` to wait indefinitely
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._count > 0 or self._inflight > 0:
+                left = None if end is None else end - time.time()
+                if left is not None and left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
+    def wait(self, timeout):
+        """Waits until a frame is queued, and returns whether the
+        queue is not empty
+
+        Args:
+          * timeout (float): the maximum waiting time in seconds
+        """
+        with self._cond:
+            if not any(self._lanes):
+                self._cond.wait(timeout)
+            return any(self._lanes)
+
+    def _pick(self, now):
+        """Returns the index of the lane to serve next, or None
+        """
+        if self._lanes[CONTROL]:
+            return CONTROL
+        first = None
+        oldest = None
+        for i in range(CONTROL + 1, len(self._lanes)):
+            lane = self._lanes[i]
+            if not lane:
+                continue
+            if first is None:
+                first = i
+                if self.starvation is None:
+                    break
+            if now - lane[0].t >= self.starvation\
+                    and (oldest is None
+                         or lane[0].t < self._lanes[oldest][0].t):
+                oldest = i
+        return first if oldest is None else oldest
+
+    def take(self, join=0):
+        """Removes and returns the next frames to send: a list of one
+        frame, or of up to join+1 mergeable frames of the same lane and
+        target. Frames which deadline passed are discarded on the way
+
+        Args:
+          * join (int): the maximum number of frames to merge with the
+            first one
+        """
+        now = time.time()
+        group = []
+        with self._cond:
+            i = self._pick(now)
+            while i is not None:
+                first = self._pop(i)
+                if not self._expired(i, first, now):
+                    group.append(first)
+                    break
+                i = self._pick(now)
+            if group and join and first.mergeable:
+                lane = self._lanes[i]
+                while lane and len(group) <= join and lane[0].mergeable\
+                        and lane[0].target == first.target\
+                        and lane[0].distributed == first.distributed\
+                        and lane[0].once == first.once:
+                    frame = self._pop(i)
+                    if not self._expired(i, frame, now):
+                        group.append(frame)
+            if group:
+                stats = self._stats[i]
+                for frame in group:
+                    wait = now - frame.t
+                    stats.sent += 1
+                    stats.wait += wait
+                    stats.wait_max = max(stats.wait_max, wait)
+            self._inflight = len(group)
+            change = self._update()
+            self._cond.notify_all()
+        self._notify(change)
+        return group
+
+    def requeue(self, frames, redelivered=True):
+        """Puts frames taken back at the head of their lanes,
+        regardless of the water marks, to be taken again
+
+        Args:
+          * frames (list of _Frame): the frames, in their sending order
+          * redelivered (bool): whether the frames were sent to a
+            receiver which did not acknowledge them, else they were not
+            sent
+        """
+        with self._cond:
+            for frame in reversed(frames):
+                self._lanes[frame.lane].appendleft(frame)
+                self._count += 1
+                self._bytes += frame.size
+                stats = self._stats[frame.lane]
+                if redelivered:
+                    stats.redelivered += 1
+                else:
+                    stats.sent -= 1
+            change = self._update()
+            self._cond.notify_all()
+        self._notify(change)
+        self._ready()
+
+    def stats(self, reset=False):
+        """Returns the number of frames queued, sent, dropped, expired,
+        coalesced and redelivered, and the mean and maximum waiting
+        times in seconds of the sent frames, per lane name
+
+        Args:
+          * reset (bool): whether to reset the counters
+        """
+        res = {}
+        with self._cond:
+            for i, lane in enumerate(self._lanes):
+                stats = self._stats[i]
+                res[LANENAMES[i]] = {
+                    'queued': len(lane),
+                    'sent': stats.sent,
+                    'dropped': stats.dropped,
+                    'expired': stats.expired,
+                    'coalesced': stats.coalesced,
+                    'redelivered': stats.redelivered,
+                    'wait_mean': stats.wait / stats.sent if stats.sent
+                                    else 0.,
+                    'wait_max': stats.wait_max}
+                if reset:
+                    self._stats[i] = _LaneStats()
+        return res
+
+
+def _marks(high, low):
+    """Returns the high and low water marks
+    """
+    if high is None:
+        return None, None
+    high = max(1, int(high))
+    low = high // 2 if low is None else min(high, max(0, int(low)))
+    return high, low
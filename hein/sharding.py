@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import os
+import socket
+import struct
+import time
+import multiprocessing
+from multiprocessing import reduction
+from multiprocessing import Array
+from threading import Thread
+from threading import Condition
+
+from . import core
+from .shmring import ShmRing, Overrun
+
+
+__all__ = ['ShardPool']
+
+
+# record header in the ring: ping sequence (0 if not a ping), size of
+# the file following the line, length of the target name, length of the
+# file path, whether the line is acknowledged
+_RECORD = struct.Struct('<QQHH?')
+
+
+class ShardPool(object):
+    def __init__(self, nworkers, timeoutACK=1., ring_size=2**24,
+                 on_drop=None):
+        """Pool of worker processes that own the receivers' sockets,
+        and write to them the lines that the parent process puts once
+        in a shared memory ring
+
+        Args:
+          * nworkers (int): the number of worker processes
+          * timeoutACK (float or None): see ``SocTransmitter``
+          * ring_size (int): the size in octets of the shared ring,
+            must be larger than the largest line
+          * on_drop (callable or None): called in the parent process
+            with the name of a receiver dropped by a worker
+
+        Note:
+          * Writing in the ring waits until the slowest worker sent the
+            records it would overwrite, so a slow receiver slows the
+            broadcast down until it acknowledges or is dropped
+        """
+        self.nworkers = max(1, int(nworkers))
+        self.timeoutACK = timeoutACK
+        self.on_drop = on_drop
+        self.ring = ShmRing(size=ring_size)
+        self.overruns = 0
+        self._events = multiprocessing.Queue()
+        self._pings = {}
+        self._ping_seq = 0
+        self._cond = Condition()
+        # position in the ring of the next record of each worker
+        self._read = Array('Q', self.nworkers, lock=False)
+        for i in range(self.nworkers):
+            self._read[i] = self.ring.head
+        self._running = True
+        # name: worker index
+        self._where = {}
+        self._workers = []
+        for i in range(self.nworkers):
+            parent, child = multiprocessing.Pipe()
+            wake = multiprocessing.Semaphore(0)
+            proc = multiprocessing.Process(
+                target=shard_worker,
+                args=(i, child, self.ring.name, wake, self._events,
+                      self.timeoutACK, self._read))
+            proc.daemon = True
+            proc.start()
+            child.close()
+            self._workers.append((proc, parent, wake))
+        self._loopy = Thread(target=shard_events, args=(self,))
+        self._loopy.daemon = True
+        self._loopy.start()
+
+    def __str__(self):
+        return "Pool of {:d} shard workers, {:d} receivers".format(
+            self.nworkers, len(self._where))
+
+    __repr__ = __str__
+
+    def add(self, name, sock):
+        """Hands a receiver's socket over to the least loaded worker.
+        The socket is closed in the parent process
+
+        Args:
+          * name (str): the name of the receiver
+          * sock (socket): its socket
+        """
+        self.remove(name)
+        loads = [0] * self.nworkers
+        for i in self._where.values():
+            loads[i] += 1
+        i = loads.index(min(loads))
+        proc, conn, wake = self._workers[i]
+        conn.send(('add', name))
+        reduction.send_handle(conn, sock.fileno(), proc.pid)
+        # the worker owns a duplicate now, don't shut the connection down
+        sock.close()
+        self._where[name] = i
+
+    def remove(self, name):
+        """Closes a receiver's socket in its worker
+
+        Args:
+          * name (str): the name of the receiver
+        """
+        i = self._where.pop(name, None)
+        if i is not None:
+            self._workers[i][1].send(('remove', name))
+            self._workers[i][2].release()
+
+    def broadcast(self, line, ping=False, target=None, path=None, size=0,
+                  ack=True):
+        """Puts a line in the ring for all workers to send, and returns
+        the ping sequence number, or 0 if not a ping
+
+        Args:
+          * line (Byt): the line to send
+          * ping (bool): whether the results of the sending are needed
+          * target (str or None): the name of the only receiver to
+            send to, or ``None`` for all
+          * path (str or None): the file which content follows the line
+          * size (int): the number of octets of the file to send
+          * ack (bool): whether the receivers acknowledge the line
+        """
+        seq = 0
+        if ping:
+            with self._cond:
+                self._ping_seq += 1
+                seq = self._ping_seq
+                self._pings[seq] = [{}, 0]
+        target = b'' if target is None else str(target).encode('utf-8')
+        path = b'' if path is None else str(path).encode('utf-8')
+        record = b''.join((_RECORD.pack(seq, size, len(target), len(path),
+                                        ack),
+                           target, path, line))
+        self._room(len(record))
+        self.ring.write(record)
+        for proc, conn, wake in self._workers:
+            wake.release()
+        return seq
+
+    def _room(self, n):
+        """Waits until a record of n octets can be written without
+        overwriting one that a worker did not send yet
+        """
+        if n > self.ring.capacity:
+            # raised by the writing
+            return
+        while self._running:
+            end = self.ring.end(n)
+            if end - min(self._read) <= self.ring.capacity:
+                return
+            lag = [self._read[i] for i, (proc, conn, wake)
+                        in enumerate(self._workers) if proc.is_alive()]
+            if not lag or end - min(lag) <= self.ring.capacity:
+                return
+            time.sleep(0.001)
+
+    def wait_ping(self, seq, timeout):
+        """Returns the merged results of a ping from all workers
+
+        Args:
+          * seq (int): the ping sequence number
+          * timeout (float): the maximum waiting time in seconds
+        """
+        end = time.time() + timeout
+        with self._cond:
+            while self._pings[seq][1] < self.nworkers:
+                left = end - time.time()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            return self._pings.pop(seq)[0]
+
+    def close(self):
+        """Stops the workers, which close their receivers' sockets
+        """
+        if not self._running:
+            return
+        self._running = False
+        for proc, conn, wake in self._workers:
+            try:
+                conn.send(('close', None))
+            except (IOError, OSError):
+                pass
+            wake.release()
+        for proc, conn, wake in self._workers:
+            proc.join(1.)
+            if proc.is_alive():
+                proc.terminate()
+        self._events.put(None)
+        self._loopy.join(1.)
+        self._where = {}
+        self.ring.close()
+
+
+def shard_events(self):
+    """Infinite loop processing the events sent by the workers
+    """
+    while True:
+        event = self._events.get()
+        if event is None:
+            break
+        kind, arg = event
+        if kind == 'drop':
+            if self._where.get(arg[0]) == arg[1]:
+                del self._where[arg[0]]
+                if self.on_drop is not None:
+                    self.on_drop(arg[0])
+        elif kind == 'ping':
+            seq, res = arg
+            with self._cond:
+                if seq in self._pings:
+                    self._pings[seq][0].update(res)
+                    self._pings[seq][1] += 1
+                    self._cond.notify_all()
+        elif kind == 'overrun':
+            self.overruns += arg
+
+
+def _kill(sock):
+    try:
+        core.killSock(sock)
+    except socket.error:
+        pass
+
+
+def _tell(sock, line, ping, timeoutACK, path, size):
+    """Sends a line to a receiver, same as
+    ``SocTransmitter._tell_receiver``
+    """
+    try:
+        sock.sendall(line)
+        if path is not None:
+            with open(path, 'rb') as f:
+                core.sendfile(sock, f, size)
+    except (socket.error, IOError, OSError):
+        return False
+    if timeoutACK is None:
+        return core.getAR(sock) if ping else None
+    return core.getAR(sock, timeout=timeoutACK)
+
+
+def shard_worker(index, conn, ring_name, wake, events, timeoutACK, read):
+    """Infinite loop of a worker process, sending the lines of the
+    ring to its receivers, and publishing in read[index] the position
+    of the next record to send
+    """
+    ring = ShmRing(name=ring_name, create=False, untrack=False)
+    # start with the records written since the pool was created, which
+    # the producer kept for this worker
+    pos = read[index]
+    receivers = {}
+    running = True
+    while running:
+        wake.acquire(True, 0.1)
+        while running:
+            # a receiver added before a record was written gets it
+            running = _commands(conn, receivers)
+            if not running:
+                break
+            try:
+                rec = ring.read(pos)
+            except Overrun:
+                # lagged behind by more than the ring, skip to now and
+                # drop the receivers, which missed records
+                head = ring.head
+                events.put(('overrun', 1))
+                for name in list(receivers):
+                    _kill(receivers.pop(name))
+                    events.put(('drop', (name, index)))
+                pos = head
+                read[index] = pos
+                continue
+            if rec is None:
+                break
+            # the record is copied, the producer can overwrite it
+            data, pos = rec
+            read[index] = pos
+            seq, size, ntarget, npath, ack = _RECORD.unpack_from(data, 0)
+            start = _RECORD.size
+            target = data[start:start + ntarget]
+            target = target.decode('utf-8') if ntarget else None
+            start += ntarget
+            path = data[start:start + npath]
+            path = path.decode('utf-8') if npath else None
+            line = data[start + npath:]
+            res = {}
+            for name, sock in list(receivers.items()):
+                if target is not None and name != target:
+                    continue
+                ok = _tell(sock, line, seq > 0,
+                           timeoutACK if ack else None, path, size)
+                res[name] = ok
+                if ok is False:
+                    _kill(receivers.pop(name))
+                    events.put(('drop', (name, index)))
+            if seq > 0:
+                events.put(('ping', (seq, res)))
+    for sock in receivers.values():
+        _kill(sock)
+    ring.close()
+
+
+def _commands(conn, receivers):
+    """Applies the commands of the parent process pending in a worker,
+    and returns whether it keeps running
+    """
+    while conn.poll():
+        cmd, name = conn.recv()
+        if cmd == 'add':
+            fd = reduction.recv_handle(conn)
+            receivers[name] = socket.fromfd(fd, socket.AF_INET,
+                                            socket.SOCK_STREAM)
+            # fromfd made a duplicate
+            os.close(fd)
+        elif cmd == 'remove':
+            _kill(receivers.pop(name, None))
+        elif cmd == 'close':
+            return False
+    return True
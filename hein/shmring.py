@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import struct
+SHMON = True
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    SHMON = False
+
+
+__all__ = ['ShmRing']
+
+
+# header: absolute position of the end of the last record written,
+# and of the end of the record being written
+_HEADER = struct.Struct('<QQ')
+# record: length of the data
+_LEN = struct.Struct('<I')
+# length of a padding record, to wrap to the start of the ring
+_PAD = 0xffffffff
+# records start on aligned positions
+_ALIGN = 8
+# names of the blocks created by this process, which its resource
+# tracker must keep when they are attached to in this process too
+_CREATED = set()
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class Overrun(Exception):
+    """Raised when reading a record that has already been overwritten
+    """
+    pass
+
+
+class ShmRing(object):
+    def __init__(self, name=None, size=2**24, create=True, untrack=True):
+        """Single-producer, multi-consumer ring of records in shared
+        memory. The producer does not wait: consumers that lag by more
+        than the ring size lose records, which they detect, unless the
+        producer checks ``end`` against their positions before writing.
+
+        Args:
+          * name (str or None): the name of the shared memory block,
+            random if ``None`` when creating
+          * size (int): the size in octets of the ring, when creating
+          * create (bool): whether to create the shared memory block,
+            or to attach to an existing one
+          * untrack (bool): when attaching, whether to keep the block
+            away from the resource tracker of this process, which must
+            be done unless the process shares the tracker of the
+            creator (i.e. it is a child process of the creator). A
+            block created by this process stays tracked
+
+        Note:
+          * Positions are absolute counts of octets written since the
+            creation of the ring, so they never wrap
+        """
+        if not SHMON:
+            raise ImportError("shared memory rings require python 3.8+")
+        if create:
+            size = _HEADER.size + _align(max(4096, int(size)))
+            self._shm = shared_memory.SharedMemory(name=name, create=True,
+                                                   size=size)
+            _HEADER.pack_into(self._shm.buf, 0, 0, 0)
+            _CREATED.add(self._shm._name)
+        elif not untrack:
+            self._shm = shared_memory.SharedMemory(name=name)
+        else:
+            try:
+                self._shm = shared_memory.SharedMemory(name=name,
+                                                       track=False)
+            except TypeError:
+                # python < 3.13
+                self._shm = shared_memory.SharedMemory(name=name)
+                if self._shm._name not in _CREATED:
+                    _untrack(self._shm)
+        self._owner = bool(create)
+        self.buf = self._shm.buf
+        self.capacity = (self._shm.size - _HEADER.size) // _ALIGN * _ALIGN
+
+    def __str__(self):
+        return "Shared memory ring '{}' ({:d} octets)".format(
+            self.name, self.capacity)
+
+    __repr__ = __str__
+
+    @property
+    def name(self):
+        """The name of the shared memory block
+        """
+        return self._shm.name
+
+    @name.setter
+    def name(self, value):
+        pass
+
+    @property
+    def head(self):
+        """The position of the end of the last record written
+        """
+        return _HEADER.unpack_from(self.buf, 0)[0]
+
+    @head.setter
+    def head(self, value):
+        pass
+
+    def end(self, n):
+        """Returns the position of the end of a record of n octets of
+        data, if written now. Consumers which position is more than
+        ``capacity`` before it would lose records
+
+        Args:
+          * n (int): the length of the data of the record
+        """
+        head = self.head
+        size = _align(_LEN.size + int(n))
+        idx = head % self.capacity
+        if idx + size > self.capacity:
+            # wraps to the start of the ring
+            head += self.capacity - idx
+        return head + size
+
+    def write(self, data):
+        """Writes a record and returns its position
+
+        Args:
+          * data (bytes-like or list of bytes-like): the data of the
+            record, or its parts
+        """
+        parts = data if isinstance(data, (list, tuple)) else [data]
+        parts = [memoryview(part).cast('B') for part in parts]
+        n = sum(len(part) for part in parts)
+        size = _align(_LEN.size + n)
+        if size > self.capacity:
+            raise ValueError("record larger than the ring")
+        head = self.head
+        idx = head % self.capacity
+        if idx + size > self.capacity:
+            # not enough room before the end of the ring, wrap
+            wrap = head + self.capacity - idx
+            _HEADER.pack_into(self.buf, 0, head, wrap + size)
+            _LEN.pack_into(self.buf, _HEADER.size + idx, _PAD)
+            head = wrap
+            idx = 0
+        else:
+            _HEADER.pack_into(self.buf, 0, head, head + size)
+        start = _HEADER.size + idx + _LEN.size
+        for part in parts:
+            self.buf[start:start + len(part)] = part
+            start += len(part)
+        _LEN.pack_into(self.buf, _HEADER.size + idx, n)
+        _HEADER.pack_into(self.buf, 0, head + size, head + size)
+        return head
+
+    def _valid(self, pos):
+        """Whether the record at pos was not overwritten
+        """
+        reserved = _HEADER.unpack_from(self.buf, 0)[1]
+        return reserved - pos <= self.capacity
+
+    def locate(self, pos):
+        """Returns (offset, length, next position) of the record at pos
+        in ``buf``, or ``None`` if no record was written there yet.
+        Raises Overrun if it was overwritten
+
+        Args:
+          * pos (int): the position of the record
+        """
+        while True:
+            if pos >= self.head:
+                return None
+            if not self._valid(pos):
+                raise Overrun(pos)
+            idx = pos % self.capacity
+            n = _LEN.unpack_from(self.buf, _HEADER.size + idx)[0]
+            if n == _PAD:
+                pos += self.capacity - idx
+                continue
+            if not self._valid(pos):
+                raise Overrun(pos)
+            start = _HEADER.size + idx + _LEN.size
+            return start, n, pos + _align(_LEN.size + n)
+
+    def read(self, pos):
+        """Returns (data, next position) of the record at pos, or
+        ``None`` if no record was written there yet. Raises Overrun if
+        it was overwritten
+
+        Args:
+          * pos (int): the position of the record
+        """
+        res = self.locate(pos)
+        if res is None:
+            return None
+        start, n, nxt = res
+        data = bytes(self.buf[start:start + n])
+        # the writer may have overwritten it while copying
+        if not self._valid(pos):
+            raise Overrun(pos)
+        return data, nxt
+
+    def valid(self, pos):
+        """Whether the record at pos is still in the ring, to be checked
+        after using a view on it
+
+        Args:
+          * pos (int): the position of the record
+        """
+        return self._valid(pos)
+
+    def close(self):
+        """Detaches from the shared memory block, and destroys it if
+        it was created by this instance
+        """
+        self.buf = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # views on the ring still exist, memory is released with them
+            pass
+        if self._owner:
+            _CREATED.discard(self._shm._name)
+            try:
+                self._shm.unlink()
+            except (OSError, IOError):
+                pass
+
+
+def _untrack(shm):
+    """Prevents the resource tracker of an attaching process from
+    destroying a block it did not create
+    """
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
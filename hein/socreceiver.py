@@ -25,22 +25,109 @@
 ###############################################################################
 
 
+import os
 import socket
+import errno
+from functools import partial
 from threading import Thread
+from threading import Lock
 import select
 import time
+import struct
 from byt import Byt
 import json
+from collections import deque
+from copy import deepcopy
+try:
+    import queue
+except ImportError:
+    # python2
+    import Queue as queue
+try:
+    import selectors
+except ImportError:
+    # python2 backport
+    import selectors34 as selectors
 
 from . import core
+from .schema import Schema
+from .batch import MessageBatch
+from .multicast import McastListener, NAKRECORD
+from .shmring import ShmRing, Overrun
+from .reactor import shared_reactor
+from .profiler import DECODE, PROCESS, _Stage
 
 
 __all__ = ['SocReceiver']
 
 
+# connection states of a source
+IDLE = 0
+CONNECTING = 1
+WAITACK = 2
+WAITNAMEACK = 3
+OPEN = 4
+
+# number of clock offset measures kept per transmitter, the one of the
+# shortest round trip is used
+CLOCKSAMPLES = 8
+
+# compared to the frames when acknowledging them
+_SCHEMAQKEY = bytes(core.SCHEMAQKEY)
+
+
+class _Item(tuple):
+    """A message of the inbox, which ``meta`` attribute holds its
+    metadata
+    """
+    meta = None
+
+
+class _Source(object):
+    """Connection state of one transmitter
+    """
+    def __init__(self, source, host, port):
+        self.source = source
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.state = IDLE
+        self.reader = None
+        # file being received
+        self.sink = None
+        # time of next connection attempt, or of handshake timeout
+        self.deadline = 0.
+
+
+class _Clock(object):
+    """Clock offset of a transmitter, estimated from the round trips of
+    its pings
+    """
+    def __init__(self):
+        # arrival time of the last ping
+        self.ping = None
+        # (round trip, offset) of the last measures
+        self.samples = deque(maxlen=CLOCKSAMPLES)
+        # clock of the receiver minus clock of the transmitter
+        self.offset = 0.
+
+    def measure(self, sent, acked):
+        """Adds the measure of the last ping, which was sent and
+        acknowledged at these times of the transmitter: its arrival
+        is taken as the midpoint of the round trip
+        """
+        if self.ping is None:
+            return
+        self.samples.append((acked - sent, self.ping - (sent + acked) / 2.))
+        self.ping = None
+        self.offset = min(self.samples)[1]
+
+
 class SocReceiver(object):
     def __init__(self, port, name, buffer_size=1024, connect=True,
-                    connectWait=0.5, portname="", hostname=None):
+                    connectWait=0.5, portname="", hostname=None,
+                    zerocopy=False, file_dir=None, inbox=None,
+                    reactor=None, profiler=None):
         """
         Connects to a transmitting port in order to listen for
         any communication from it. In case the communication drops
@@ -59,8 +146,72 @@ class SocReceiver(object):
             identification purposes
           * hostname (str): the name of the host to connect to, default
             is given by ``socket.gethostbyname``
+          * zerocopy (bool): if ``True``, raw messages are given to
+            ``process`` as memoryviews on the receiving buffer, which
+            are only valid until ``process`` returns
+          * file_dir (str or None): the directory where the files sent
+            with ``tell_file`` are written, or ``None`` to receive them
+            in memory, see ``file_destination``
+          * inbox (int or None): if not ``None``, the messages are not
+            given to ``process`` but stored in an inbox of that many
+            messages, to be consumed with ``messages`` or
+            ``recv_many``. The listening waits while the inbox is full;
+            on a reactor, the receiver stops reading its sockets
+            meanwhile, without holding up the reactor
+          * reactor (Reactor, bool or None): the reactor on which the
+            connection and the listening run, instead of two threads
+            per receiver; ``True`` for the reactor shared by the
+            process, see ``shared_reactor``; ``False`` or ``None`` for
+            the threads. With a reactor, ``process`` is called from
+            the reactor thread
+          * profiler (Profiler or None): times the stages of the
+            messages, see ``Profiler``
         """
         self.buffer_size = max(1, int(buffer_size))
+        self.zerocopy = bool(zerocopy)
+        self.file_dir = None if file_dir is None else str(file_dir)
+        # file being received
+        self._sink = None
+        self._inbox = None if inbox is None\
+                        else queue.Queue(maxsize=max(1, int(inbox)))
+        # messages waiting for room in the inbox, and sources not read
+        # meanwhile, in reactor mode
+        self._pending = deque()
+        self._paused = set()
+        self._pending_lock = Lock()
+        # tag: maximum number of messages per batch
+        self.batched = {}
+        # [(source, tag, key), messages] of the batch being built
+        self._batch_run = None
+        self.schemas = {}
+        # (source, tag): [state, sequence]
+        self._delta = {}
+        self.delta_gaps = 0
+        # identifiers of the streams being received
+        self._streams = set()
+        # source: listener of the multicast group of the transmitter
+        self._mcast = {}
+        # multicast messages are dispatched from their own thread
+        self._dispatch_lock = Lock()
+        # source: shared memory ring of the transmitter
+        self._rings = {}
+        self.shm_overruns = 0
+        self.reactor = shared_reactor() if reactor is True\
+                            else (reactor or None)
+        self.profiler = profiler
+        # source: clock offset of the transmitter
+        self._clocks = {}
+        # tag: histogram of the latencies of the stamped messages
+        self._latency = {}
+        self._latency_lock = Lock()
+        # metadata of the message being processed
+        self.meta = None
+        # source: connection state of a transmitter, in reactor mode
+        self._sources = {}
+        self._lock = Lock()
+        self._removed = []
+        # next deadline of the connections on the reactor
+        self._timer = None
         self._soc = None
         self._loopConnect = False
         self._connected = False
@@ -114,6 +265,13 @@ class SocReceiver(object):
         if self.loopConnect:
             return
         self._loopConnect = True
+        if self.reactor is not None:
+            with self._lock:
+                if None not in self._sources:
+                    self._sources[None] = _Source(None, self.host,
+                                                  self.port)
+            self.reactor.call_soon(_react, self)
+            return
         loopy = Thread(target=connectme, args=(self, ))
         loopy.daemon = True
         loopy.start()
@@ -154,6 +312,12 @@ class SocReceiver(object):
         if not self.running:
             return
         self._running = False
+        if self.reactor is not None:
+            # connects again later, as the connection loop would
+            self.reactor.call(_reconnect, self, None)
+            return
+        self._mcast_close()
+        self._shm_close()
         core.killSock(self._soc)
         self._soc = None
 
@@ -173,9 +337,658 @@ class SocReceiver(object):
         e.g.
           * to_be_unpacked = hasattr(data, 'message')
           * to_be_unpacked = isinstance(data, hein.Message)
+
+        If the transmitter stamps its messages, ``self.meta`` holds the
+        'sent' time of the message, on the clock of the receiver, and
+        its 'latency' in seconds; else it is ``None``. The ``meta``
+        attribute of a ``MessageBatch`` lists the ones of its messages
         """
         print("{}{}".format("" if tag is None else "{}: ".format(tag), data))
 
+    def _frames(self, reader):
+        """Iterates over the frames of a reader, timed if profiled
+        """
+        if self.profiler is None:
+            return reader.frames()
+        return self.profiler.frames(reader.frames())
+
+    def _ack(self, comm):
+        """Returns the acknowledgement of a communication: SCHEMAOK
+        for the query of a schema registered with the same fingerprint
+        """
+        if memoryview(comm)[:core.KEYLENGTH] != _SCHEMAQKEY:
+            return core.ACK
+        thekey, tag, unpack, stamp, comm = core._split_header(comm)
+        schema = self.schemas.get(tag)
+        if schema is not None and bytes(comm) == "{:d}".format(
+                schema.fingerprint).encode(core.ENCODING):
+            return core.SCHEMAOK
+        return core.ACK
+
+    def _decode(self, comm, source=None):
+        """Dispatches a communication, timed if profiled
+        """
+        if self.profiler is None:
+            self._dispatch(comm, source)
+        else:
+            self.profiler.call(DECODE, self._dispatch, comm, source)
+
+    def _dispatch(self, comm, source=None):
+        """Decodes a full communication and hands it over to
+        ``process``
+
+        Args:
+          * comm (Byt or memoryview): the communication, without its
+            end characters
+          * source: the identifier of the transmitter it came from,
+            or ``None`` for a single-transmitter receiver
+        """
+        thekey, tag, unpack, stamp, comm = core._split_header(comm)
+        meta = None if stamp is None else self._stamped(stamp, tag, source)
+        if tag in self.batched and unpack\
+                and thekey in (core.JSONKEY, core.SCHEMAKEY):
+            self._batch(comm, thekey, tag, source, meta)
+            return
+        if self._batch_run is not None:
+            # keep the order of the messages
+            self._flush_batch()
+        # got a die key, just terminate
+        if thekey == core.DIEKEY:
+            self._die(source)
+        # pinging to see howzy going, just note the time for the clock
+        elif thekey == core.PINGKEY:
+            clock = self._clocks.get(source)
+            if clock is None:
+                clock = self._clocks[source] = _Clock()
+            clock.ping = time.time()
+        elif thekey == core.CLOCKKEY:
+            sent, acked = core.split_fields(comm, 1)
+            clock = self._clocks.get(source)
+            if clock is not None:
+                clock.measure(float(sent), float(acked))
+        elif thekey == core.RAWKEY:
+            if not self.zerocopy:
+                comm = core.to_byt(comm)
+            self._deliver(comm, tag, source, meta)
+        elif thekey == core.JSONKEY:
+            if unpack:
+                # decoded straight from the receiving buffer
+                self._deliver(core.json_loads(comm), tag, source, meta)
+            else:
+                self._deliver(core.Message(core.to_byt(comm)), tag, source,
+                              meta)
+        elif thekey == core.SCHEMAKEY:
+            schema = self.schemas.get(tag)
+            if schema is None:
+                print("WARNING: no schema registered for tag '{}', "\
+                      "message ignored".format(tag))
+                return
+            comm = core.to_byt(comm)
+            if not unpack:
+                self._deliver(core.Message(comm, loads=schema.unpack),
+                              tag, source, meta)
+                return
+            try:
+                data = schema.unpack(comm)
+            except (ValueError, struct.error):
+                print("WARNING: message does not match the schema "\
+                      "registered for tag '{}', message ignored"\
+                      .format(tag))
+                return
+            self._deliver(data, tag, source, meta)
+
+        elif thekey == core.DELTAKEY:
+            data = self._delta_decode(core.to_byt(comm), tag, source)
+            if data is not None:
+                self._deliver(data, tag, source, meta)
+
+        elif thekey == core.STREAMKEY:
+            self._stream(comm, tag, source)
+
+        elif thekey == core.FILEKEY:
+            size, name = core.split_fields(comm, 1)
+            size = int(size)
+            name = bytes(name).decode(core.ENCODING)
+            path = self.file_destination(name=name, tag=tag, size=size)
+            try:
+                self._sink = core.FileSink(size, path=path, name=name,
+                                           tag=tag)
+            except (IOError, OSError):
+                print("WARNING: could not open '{}', file received in "\
+                      "memory".format(path))
+                self._sink = core.FileSink(size, name=name, tag=tag)
+
+        elif thekey == core.MCASTKEY:
+            self._mcast_join(comm, source)
+
+        elif thekey == core.REPAIRKEY:
+            seq, found, line = core.split_fields(comm, 2)
+            listener = self._mcast.get(source)
+            if listener is not None:
+                listener.repair(int(seq), bytes(line) if int(found)
+                                            else None)
+
+        elif thekey == core.SHMOPENKEY:
+            self._shm_open(comm, source)
+
+        elif thekey == core.SHMKEY:
+            self._shm_read(int(comm), source)
+
+    def _stamped(self, stamp, tag, source=None):
+        """Measures the latency of a stamped message, and returns its
+        metadata
+        """
+        now = time.time()
+        clock = self._clocks.get(source)
+        sent = stamp if clock is None else stamp + clock.offset
+        with self._latency_lock:
+            hist = self._latency.get(tag)
+            if hist is None:
+                hist = self._latency[tag] = _Stage()
+            hist.add(now - sent)
+        return {'sent': sent, 'latency': now - sent}
+
+    def latency_stats(self, reset=False):
+        """Returns the statistics of the latency of the stamped messages
+        per tag: count, and mean, maximum, median, 90th and 99th
+        percentiles in seconds. The percentiles are the upper bounds of
+        the histogram buckets
+
+        Args:
+          * reset (bool): whether to reset the histograms
+        """
+        with self._latency_lock:
+            latency = self._latency
+            if reset:
+                self._latency = {}
+            return dict((tag, hist.stats()) for tag, hist in latency.items())
+
+    def clock_offset(self, source=None):
+        """Returns the estimated offset in seconds of the clock of the
+        receiver relatively to the one of a transmitter, or ``None`` if
+        not measured yet
+
+        Args:
+          * source: the identifier of the transmitter, ``None`` for a
+            single-transmitter receiver
+        """
+        clock = self._clocks.get(source)
+        if clock is None or not clock.samples:
+            return None
+        return clock.offset
+
+    def _mcast_join(self, comm, source=None):
+        """Joins the multicast group of a transmitter
+        """
+        host, port, session, seq = bytes(comm).decode(core.ENCODING)\
+                                        .split(',')
+        self._mcast_close(source)
+        try:
+            self._mcast[source] = McastListener(
+                (host, int(port)), int(session), int(seq),
+                deliver=lambda line: self._mcast_line(line, source),
+                nak=lambda first, last: self._send_nak(source, first, last))
+        except socket.error as e:
+            print("WARNING: could not join the multicast group {}:{} "\
+                  "({})".format(host, port, e))
+
+    def _mcast_close(self, source=None):
+        """Leaves the multicast group of a transmitter, or of all of
+        them if source is ``None``
+        """
+        if source is None:
+            listeners = list(self._mcast.values())
+            self._mcast.clear()
+        else:
+            listeners = [self._mcast.pop(source, None)]
+        for listener in listeners:
+            if listener is not None:
+                listener.close()
+
+    def _mcast_line(self, line, source=None):
+        """Dispatches the communications of a multicast line
+        """
+        with self._dispatch_lock:
+            for comm in core.split_flow(line)[:-1]:
+                self._decode(comm, source)
+            if self._batch_run is not None:
+                self._flush_batch()
+
+    def _shm_open(self, comm, source=None):
+        """Attaches to the shared memory ring of a transmitter, or
+        tells it to send everything over the socket
+        """
+        name = bytes(comm).decode(core.ENCODING)
+        self._shm_close(source)
+        try:
+            self._rings[source] = ShmRing(name=name, create=False)
+        except (ImportError, OSError, ValueError) as e:
+            print("WARNING: could not open the shared memory ring '{}' "\
+                  "({})".format(name, e))
+            sock = self._control_sock(source)
+            if sock is not None:
+                try:
+                    sock.sendall(bytes(core.SHMOFF))
+                except socket.error:
+                    pass
+
+    def _shm_close(self, source=None):
+        """Detaches from the shared memory ring of a transmitter, or
+        of all of them if source is ``None``
+        """
+        if source is None:
+            rings = list(self._rings.values())
+            self._rings.clear()
+        else:
+            rings = [self._rings.pop(source, None)]
+        for ring in rings:
+            if ring is not None:
+                ring.close()
+
+    def _shm_read(self, pos, source=None):
+        """Dispatches the communications of a record of the shared
+        memory ring, read in place
+        """
+        ring = self._rings.get(source)
+        if ring is None:
+            return
+        try:
+            res = ring.locate(pos)
+        except Overrun:
+            res = None
+        if res is None:
+            self.shm_overruns += 1
+            return
+        start, n, nxt = res
+        end = start + n
+        view = ring.buf
+        try:
+            while start < end:
+                l = core._SHMFRAME.unpack_from(view, start)[0]
+                start += core._SHMFRAME.size
+                comm = view[start:start + l]
+                start += l
+                if not ring.valid(pos):
+                    raise Overrun(pos)
+                self._decode(comm, source)
+        except Overrun:
+            self.shm_overruns += 1
+        finally:
+            del view
+
+    def _control_sock(self, source=None):
+        return self._soc
+
+    def _send_nak(self, source, first, last):
+        """Requests the retransmission of the multicast lines from
+        first to last
+        """
+        sock = self._control_sock(source)
+        if sock is None:
+            return
+        try:
+            sock.sendall(bytes(core.NAK) + NAKRECORD.pack(first, last))
+        except socket.error:
+            pass
+
+    @property
+    def multicast_lost(self):
+        """The number of multicast messages given up because they
+        could not be retransmitted
+        """
+        return sum(listener.lost for listener in list(self._mcast.values()))
+
+    @multicast_lost.setter
+    def multicast_lost(self, value):
+        pass
+
+    def set_batch(self, tag, max_n=1024):
+        """
+        Sets the batch mode for the json and schema messages of a tag:
+        the successive messages of the tag received together are given
+        to ``process`` as one columnar ``MessageBatch``
+
+        Args:
+          * tag (str[15] or None): the tag of the messages
+          * max_n (int or None): the maximum number of messages per
+            batch, or ``None`` to disable the batch mode
+
+        Note:
+          * Schema messages with fixed-size fields only are decoded
+            all at once
+          * Messages sent with unpack=False, and json messages which
+            are not dicts, are not batched but given one at a time
+        """
+        tag = core.clean_tag(tag)
+        if max_n is None:
+            self.batched.pop(tag, None)
+        else:
+            self.batched[tag] = max(1, int(max_n))
+
+    def _batch(self, comm, thekey, tag, source, meta=None):
+        """Adds a message, and its metadata, to the batch being built
+        """
+        run = (source, tag, thekey)
+        if self._batch_run is not None and self._batch_run[0] != run:
+            self._flush_batch()
+        if thekey == core.SCHEMAKEY:
+            if tag not in self.schemas:
+                print("WARNING: no schema registered for tag '{}', "\
+                      "message ignored".format(tag))
+                return
+            item = core.to_byt(comm)
+        else:
+            item = core.json_loads(comm)
+            if not isinstance(item, dict):
+                # only dicts make columns
+                if self._batch_run is not None:
+                    self._flush_batch()
+                self._deliver(item, tag, source, meta)
+                return
+        if self._batch_run is None:
+            self._batch_run = [run, [], []]
+        self._batch_run[1].append(item)
+        self._batch_run[2].append(meta)
+        if len(self._batch_run[1]) >= self.batched.get(tag, 1):
+            self._flush_batch()
+
+    def _flush_batch(self):
+        """Hands the batch being built over to ``process``
+        """
+        run, items, metas = self._batch_run
+        self._batch_run = None
+        source, tag, thekey = run
+        if thekey == core.SCHEMAKEY:
+            try:
+                batch = MessageBatch.from_packed(self.schemas[tag], items,
+                                                 tag=tag)
+            except (KeyError, ValueError, struct.error):
+                print("WARNING: messages do not match the schema "\
+                      "registered for tag '{}', batch ignored".format(tag))
+                return
+        else:
+            try:
+                batch = MessageBatch.from_dicts(items, tag=tag)
+            except (TypeError, ValueError) as e:
+                print("WARNING: could not batch the messages of tag "\
+                      "'{}' ({}), batch ignored".format(tag, e))
+                return
+        if any(meta is not None for meta in metas):
+            batch.meta = metas
+        self._deliver(batch, tag, source)
+
+    def _stream(self, comm, tag, source):
+        """Hands a chunk of a streamed message over to the stream
+        callbacks
+        """
+        sid, phase, data = core.split_fields(comm, 2)
+        sid = int(sid) if source is None else (source, int(sid))
+        if phase == core.STREAMSTART:
+            self._streams.add(sid)
+            self.process_stream_start(stream=sid, tag=tag,
+                                      meta=core.json_loads(core.to_byt(data)))
+        elif sid not in self._streams:
+            # joined in the middle of the stream
+            return
+        elif phase == core.STREAMCHUNK:
+            if not self.zerocopy:
+                data = core.to_byt(data)
+            self.process_stream_chunk(stream=sid, tag=tag, chunk=data)
+        elif phase in (core.STREAMEND, core.STREAMABORT):
+            self._streams.discard(sid)
+            self.process_stream_end(stream=sid, tag=tag,
+                                    aborted=phase == core.STREAMABORT)
+
+    def process_stream_start(self, stream, tag, meta):
+        """
+        Replace this function with your own processing of the start of
+        a streamed message
+
+        Args:
+          * stream: the identifier of the stream, an int, or a
+            (source, int) tuple for a MultiSocReceiver
+          * tag: the tag given by the sender, or None
+          * meta: the variable given by the sender
+        """
+        print("{}stream {} started: {}".format(
+            "" if tag is None else "{}: ".format(tag), stream, meta))
+
+    def process_stream_chunk(self, stream, tag, chunk):
+        """
+        Replace this function with your own processing of the chunks
+        of a streamed message
+
+        Args:
+          * stream: the identifier of the stream
+          * tag: the tag given by the sender, or None
+          * chunk (Byt or memoryview): the chunk, a memoryview only
+            valid until the function returns in zerocopy mode
+        """
+        pass
+
+    def process_stream_end(self, stream, tag, aborted):
+        """
+        Replace this function with your own processing of the end of
+        a streamed message
+
+        Args:
+          * stream: the identifier of the stream
+          * tag: the tag given by the sender, or None
+          * aborted (bool): whether the sender failed to read the
+            whole message
+        """
+        print("{}stream {} {}".format(
+            "" if tag is None else "{}: ".format(tag), stream,
+            "aborted" if aborted else "ended"))
+
+    def file_destination(self, name, tag, size):
+        """
+        Replace this function to choose where to write a file sent
+        with ``tell_file``. Returns the path of the file to write, or
+        ``None`` to receive it in memory
+
+        Args:
+          * name: the name of the file given by the sender
+          * tag: the tag given by the sender, or None
+          * size: the size of the file in octets
+        """
+        if self.file_dir is None:
+            return None
+        return os.path.join(self.file_dir, os.path.basename(name))
+
+    def process_file(self, name, tag, path, data):
+        """
+        Replace this function with your own processing of the files
+        sent with ``tell_file``
+
+        Args:
+          * name: the name of the file given by the sender
+          * tag: the tag given by the sender, or None
+          * path: the path of the file written, or None if received
+            in memory
+          * data (Byt): the content of the file if received in memory,
+            else None
+        """
+        print("{}file {} received{}".format(
+            "" if tag is None else "{}: ".format(tag), name,
+            "" if path is None else " in {}".format(path)))
+
+    def _file_done(self, sink, source=None):
+        res = sink.close()
+        if sink.path is None:
+            self._deliver_file(sink.name, sink.tag, None, res, source)
+        else:
+            self._deliver_file(sink.name, sink.tag, res, None, source)
+
+    def _deliver_file(self, name, tag, path, data, source=None):
+        self.process_file(name=name, tag=tag, path=path, data=data)
+
+    def _delta_decode(self, comm, tag, source):
+        """Applies a delta-encoded message to the state of its tag and
+        returns a deep copy of the full dict, which the caller can
+        change, or ``None`` if the state is not known yet
+        """
+        seq, kind, body = comm.split(core.DICTMAPPER, 2)
+        seq = int(seq)
+        body = core.json_loads(body)
+        key = (source, tag)
+        if kind == core.DELTAFULL:
+            self._delta[key] = [body, seq]
+            return deepcopy(body)
+        state = self._delta.get(key)
+        if state is None or state[1] != seq - 1:
+            # missed a message, wait for the next full dict
+            self._delta.pop(key, None)
+            self.delta_gaps += 1
+            return None
+        changed, removed = body
+        for k in removed:
+            state[0].pop(k, None)
+        state[0].update(changed)
+        state[1] = seq
+        return deepcopy(state[0])
+
+    def register_schema(self, tag, fields, record=False):
+        """
+        Registers the schema of the dict messages of a tag, as
+        registered on the transmitter. It must be registered before
+        connecting: the transmitter sends json messages of the tag to
+        all its receivers as long as one of them did not hold the same
+        schema when it connected
+
+        Args:
+          * tag (str[15]): the tag of the messages
+          * fields (list, OrderedDict or Schema): the (name, type)
+            pairs of the dict items, in a fixed order, see ``Schema``;
+            or ``None`` to unregister
+          * record (bool): if ``True``, messages are given to
+            ``process`` as lightweight named-tuples instead of dicts
+        """
+        tag = core.clean_tag(tag)
+        if fields is None:
+            self.schemas.pop(tag, None)
+        elif isinstance(fields, Schema):
+            self.schemas[tag] = fields
+        else:
+            self.schemas[tag] = Schema(fields, record=record)
+
+    def _deliver(self, data, tag, source=None, meta=None):
+        if self._inbox is not None:
+            self._store((data, tag), meta)
+            return
+        self.meta = meta
+        if self.profiler is not None:
+            self.profiler.call(PROCESS, self.process, data=data, tag=tag)
+        else:
+            self.process(data=data, tag=tag)
+
+    def _store(self, item, meta=None):
+        """Puts a message, and its metadata, in the inbox, waiting for
+        room while the receiver is running. In the selector thread of
+        a reactor, the message waits aside instead, and the sources are
+        not read until the inbox has room
+        """
+        if isinstance(item[0], memoryview):
+            # the buffer is reused once the message is stored
+            item = (core.to_byt(item[0]),) + item[1:]
+        item = _Item(item)
+        item.meta = meta
+        if self.reactor is not None and self.reactor.in_thread():
+            with self._pending_lock:
+                if not self._pending:
+                    try:
+                        self._inbox.put_nowait(item)
+                        return
+                    except queue.Full:
+                        pass
+                self._pending.append(item)
+            _pause(self)
+            return
+        while self.running:
+            try:
+                self._inbox.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def recv_many(self, max_n=100, timeout=None):
+        """
+        Returns a list of up to max_n messages from the inbox, as
+        (data, tag) tuples, waiting up to timeout seconds for the first
+        one. Returns an empty list if none came. The ``meta`` attribute
+        of a message is its metadata, see ``process``
+
+        Args:
+          * max_n (int): the maximum number of messages to return
+          * timeout (float or None): the maximum waiting time in
+            seconds, or ``None`` to wait indefinitely
+        """
+        if self._inbox is None:
+            raise ValueError("receiver has no inbox")
+        res = []
+        try:
+            res.append(self._inbox.get(timeout=timeout))
+        except queue.Empty:
+            return res
+        while len(res) < max_n:
+            try:
+                res.append(self._inbox.get_nowait())
+            except queue.Empty:
+                break
+        self._refill()
+        return res
+
+    def messages(self, timeout=None):
+        """
+        Iterates over the messages of the inbox, as (data, tag)
+        tuples, until none came within timeout seconds. The ``meta``
+        attribute of a message is its metadata, see ``process``
+
+        Args:
+          * timeout (float or None): the maximum waiting time in
+            seconds for each message, or ``None`` to wait indefinitely
+        """
+        if self._inbox is None:
+            raise ValueError("receiver has no inbox")
+        while True:
+            try:
+                item = self._inbox.get(timeout=timeout)
+            except queue.Empty:
+                return
+            self._refill()
+            yield item
+
+    def _refill(self):
+        """Moves the messages waiting aside to the inbox, and resumes
+        the reading of the sources once all are in
+        """
+        if not self._pending:
+            return
+        with self._pending_lock:
+            while self._pending:
+                try:
+                    self._inbox.put_nowait(self._pending[0])
+                except queue.Full:
+                    return
+                self._pending.popleft()
+        self.reactor.call_soon(_resume, self)
+
+    def _die(self, source=None):
+        self.close()
+
+    def _opened(self, src):
+        """Called-back when the connection of a source is open, in
+        reactor mode
+        """
+        self._soc = src.sock
+        self._running = True
+        self._newconnection()
+
+    def _closed(self, src):
+        if self._soc is src.sock:
+            self._running = False
+            self._soc = None
+
     def _newconnection(self):
         """
         Replace this function with proper new connection processing
@@ -187,48 +1000,70 @@ def tellme(self):
     """
     Infinite loop to listen the data from the port
     """
-    inBuff = Byt()
+    reader = core.FrameReader(self._soc, self.buffer_size)
     while self.running:
-        data = core.receive(self._soc, self.buffer_size, 1.)
-        if data is None:
+        n = reader.read(1.)
+        if n is None:
             continue
         if not self.running:
             self.close()
             break
-        if len(data) == 0:
+        if n == 0:
             # maybe the socket died, let's give it a chance
             try:
                 self.close()
             except:
                 pass
-        inBuff += data
-        res = core.split_flow(inBuff, -1)
-        if len(res) <= 1:
-            continue  # no full comm yet
-        try:
-            self._soc.send(core.ACK)
-        except:  # socket died for good
-            self._soc.close()
-            break
-        inBuff = res.pop(-1)  # the remainder
-        for comm in res:
-            thekey, comm = comm[:core.KEYLENGTH], comm[core.KEYLENGTH:]
-            tag, unpack, comm = comm.split(core.DICTMAPPER, 2)
-            tag = str(tag) if len(tag) > 0 else None
-            # got a die key, just terminate
-            if thekey == core.DIEKEY:
+            continue
+        while True:
+            acked = False
+            for comm in self._frames(reader):
+                if not acked and core._acked(comm):
+                    try:
+                        self._soc.send(self._ack(comm))
+                    except:  # socket died for good
+                        self._soc.close()
+                        self._running = False
+                        return
+                    acked = True
+                with self._dispatch_lock:
+                    self._decode(comm)
+                # raw file content follows, not frames
+                if self._sink is not None:
+                    break
+            if self._batch_run is not None:
+                with self._dispatch_lock:
+                    self._flush_batch()
+            if self._sink is None:
+                break
+            if not getfile(self, reader):
+                break
+    if self._sink is not None:
+        self._sink.close()
+        self._sink = None
+    self._running = False
+
+
+def getfile(self, reader):
+    """
+    Receives the content of a file following its header, and returns
+    whether it was received entirely
+    """
+    sink = self._sink
+    sink.feed(reader)
+    while not sink.done:
+        if not self.running:
+            return False
+        ready = select.select([self._soc], [], [], 1.)
+        if ready[0] and not sink.pull(self._soc):
+            try:
                 self.close()
-            # pinging to see howzy going, just pass
-            elif thekey == core.PINGKEY:
+            except:
                 pass
-            elif thekey == core.RAWKEY:
-                self.process(data=comm, tag=tag)
-            elif thekey == core.JSONKEY:
-                if int(unpack) == 1:
-                    self.process(data=core.json_loads(comm), tag=tag)
-                else:
-                    self.process(data=core.Message(comm), tag=tag)
-    self._running = False
+            return False
+    self._sink = None
+    self._file_done(sink)
+    return True
 
 
 def connectme(self):
@@ -271,3 +1106,256 @@ def connectme(self):
         # process might have died in between
         if time is None:
             break
+
+
+def _drop(self, src, wait=True):
+    """Closes the connection of a source, and schedules a new
+    connection attempt
+    """
+    self._paused.discard(src)
+    if src.sock is not None:
+        _unwatch(self, src)
+        try:
+            core.killSock(src.sock)
+        except socket.error:
+            pass
+        self._closed(src)
+    src.sock = None
+    src.reader = None
+    self._mcast_close(src.source)
+    self._shm_close(src.source)
+    if src.sink is not None:
+        src.sink.close()
+        src.sink = None
+    if src.state is not None:
+        src.state = IDLE
+        src.deadline = time.time() + (self._connectWait if wait else 0.)
+
+
+def _connect(self, src):
+    """Starts a non-blocking connection to a source
+    """
+    src.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    src.sock.setblocking(0)
+    err = src.sock.connect_ex((src.host, src.port))
+    if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+        _drop(self, src)
+        return
+    src.state = CONNECTING
+    src.deadline = time.time() + self._timeout
+    _watch(self, src, selectors.EVENT_WRITE)
+
+
+def _on_event(self, src, mask):
+    """Advances the connection state of a source on a socket event
+    """
+    if src.state == CONNECTING:
+        if src.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+            _drop(self, src)
+            return
+        src.state = WAITACK
+        src.deadline = time.time() + self._timeout
+        _watch(self, src, selectors.EVENT_READ, modify=True)
+        return
+    if src.state == OPEN:
+        _on_data(self, src)
+        return
+    try:
+        data = src.sock.recv(len(core.ACK))
+    except socket.error as e:
+        if e.args and e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+            return
+        data = ''
+    if len(data) == 0:
+        # the transmitter died, let's give it a chance later
+        _drop(self, src)
+        return
+    data = Byt(data)
+    if src.state == WAITACK:
+        if data != core.ACK:
+            _drop(self, src)
+            return
+        src.sock.sendall(Byt(self.name))
+        src.state = WAITNAMEACK
+        src.deadline = time.time() + self._timeout
+    elif src.state == WAITNAMEACK:
+        if data != core.ACK:
+            _drop(self, src)
+            return
+        src.state = OPEN
+        src.reader = core.FrameReader(src.sock, self.buffer_size)
+        self._opened(src)
+
+
+def _on_data(self, src):
+    """Reads the data of a connected source and dispatches the full
+    communications
+    """
+    if src.sink is not None:
+        # raw file content, straight from the socket
+        if not src.sink.pull(src.sock):
+            _drop(self, src)
+            return
+        if not src.sink.done:
+            return
+        _on_file(self, src)
+        return
+    n = src.reader.read(0.)
+    if n is None:
+        return
+    if n == 0:
+        # the transmitter died, let's give it a chance later
+        _drop(self, src)
+        return
+    while True:
+        acked = False
+        for comm in self._frames(src.reader):
+            if not acked and core._acked(comm):
+                try:
+                    src.sock.send(self._ack(comm))
+                except socket.error:
+                    _drop(self, src)
+                    return
+                acked = True
+            with self._dispatch_lock:
+                self._decode(comm, src.source)
+            # connection dropped by a die key
+            if src.state != OPEN:
+                return
+            if self._sink is not None:
+                break
+        if self._batch_run is not None:
+            with self._dispatch_lock:
+                self._flush_batch()
+        if self._sink is None:
+            return
+        src.sink, self._sink = self._sink, None
+        src.sink.feed(src.reader)
+        if not src.sink.done:
+            return
+        _on_file(self, src)
+
+
+def _pause(self):
+    """Stops reading the connected sources while messages wait for
+    room in the inbox
+    """
+    for src in list(self._sources.values()):
+        if src.state == OPEN and src not in self._paused:
+            _unwatch(self, src)
+            self._paused.add(src)
+
+
+def _resume(self):
+    """Reads the sources paused again, unless messages still wait
+    for room in the inbox
+    """
+    with self._pending_lock:
+        if self._pending:
+            return
+        paused, self._paused = self._paused, set()
+    for src in paused:
+        if src.state == OPEN and src.sock is not None:
+            _watch(self, src, selectors.EVENT_READ)
+
+
+def _on_file(self, src):
+    """Hands a fully received file over to ``process_file``
+    """
+    sink, src.sink = src.sink, None
+    self._file_done(sink, src.source)
+
+
+def _watch(self, src, events, modify=False):
+    """Watches the socket of a source, on the selector of the receiver
+    or on its reactor
+    """
+    if self.reactor is None:
+        if modify:
+            self._sel.modify(src.sock, events, src)
+        else:
+            self._sel.register(src.sock, events, src)
+    elif modify:
+        self.reactor.modify(src.sock, events)
+    else:
+        self.reactor.register(src.sock, partial(_on_ready, self, src),
+                              events)
+
+
+def _unwatch(self, src):
+    if self.reactor is not None:
+        self.reactor.unregister(src.sock)
+        return
+    try:
+        self._sel.unregister(src.sock)
+    except (KeyError, ValueError, AttributeError):
+        pass
+
+
+def _tick(self):
+    """Starts the connections of the idle sources which are due, drops
+    the handshakes which timed out, and returns the time in seconds
+    until the next deadline, or ``None``
+    """
+    now = time.time()
+    timeout = None
+    with self._lock:
+        sources = list(self._sources.values())
+        removed, self._removed = self._removed, []
+    for src in removed:
+        _drop(self, src)
+    for src in sources:
+        if src.state == IDLE and self.loopConnect\
+                and now >= src.deadline:
+            _connect(self, src)
+        elif src.state in (CONNECTING, WAITACK, WAITNAMEACK)\
+                and now >= src.deadline:
+            # handshake timed out
+            _drop(self, src)
+        if src.state == IDLE and not self.loopConnect:
+            continue
+        if src.state != OPEN:
+            left = max(0., src.deadline - now)
+            timeout = left if timeout is None else min(timeout, left)
+    return timeout
+
+
+def _react(self):
+    """Runs the connection deadlines of a receiver on its reactor
+    """
+    if self._timer is not None:
+        self._timer.cancel()
+        self._timer = None
+    timeout = _tick(self)
+    if timeout is not None:
+        self._timer = self.reactor.call_later(timeout, _react, self)
+
+
+def _reconnect(self, source):
+    """Closes the connection of a source on the reactor, to connect
+    again later
+    """
+    src = self._sources.get(source)
+    if src is not None:
+        _drop(self, src)
+    _react(self)
+
+
+def _halt(self):
+    """Closes all the connections of a receiver on its reactor
+    """
+    if self._timer is not None:
+        self._timer.cancel()
+        self._timer = None
+    for src in list(self._sources.values()):
+        _drop(self, src)
+
+
+def _on_ready(self, src, mask):
+    """Handles a socket event of a source on the reactor
+    """
+    if src.state is None:  # removed in between
+        _drop(self, src)
+    else:
+        _on_event(self, src, mask)
+    _react(self)
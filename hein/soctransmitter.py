@@ -25,24 +25,98 @@
 ###############################################################################
 
 
+import os
 import socket
+import errno
 from threading import Thread
+from threading import Lock
+from threading import Semaphore
+from itertools import count
+from functools import partial
+from copy import deepcopy
 import select
 import time
+import hashlib
 from byt import Byt
 from multiprocessing import Manager
 import json
 
 
 from . import core
+from .journal import Journal
+from .schema import Schema
+from .sharding import ShardPool
+from .shmring import ShmRing
+from .sendqueue import SendQueue, _Frame, CONTROL
+from .multicast import McastSender, NAKRECORD, parse_group
+from .reactor import shared_reactor
+from .profiler import ENCODE, QUEUE, PACING, SEND, ACK
 
 
 __all__ = ['SocTransmitter']
 
 
+# distribution modes of the messages over the receivers
+ROUNDROBIN = 'round_robin'
+LEASTOUTSTANDING = 'least_outstanding'
+KEYHASH = 'key_hash'
+DISTRIBUTIONS = (ROUNDROBIN, LEASTOUTSTANDING, KEYHASH)
+
+# interval in seconds between two pings measuring the clock offsets of
+# the receivers, when stamping
+CLOCKSYNC = 5.
+
+
+class _Throttle(object):
+    """Rate limit and sampling of the messages of a tag
+    """
+    __slots__ = ('rate', 'burst', 'every', 'tokens', 't', 'n', 'passed',
+                 'skipped')
+
+    def __init__(self, rate=None, burst=1, every=None):
+        # maximum rate in Hz, and size of the token bucket
+        self.rate = rate
+        self.burst = burst
+        # one message kept out of every
+        self.every = every
+        self.tokens = float(burst)
+        self.t = time.time()
+        self.n = 0
+        self.passed = 0
+        self.skipped = 0
+
+    def allow(self):
+        """Returns whether the next message goes through, and counts it
+        """
+        ok = True
+        if self.every is not None:
+            ok = self.n == 0
+            self.n = (self.n + 1) % self.every
+        if ok and self.rate is not None:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens
+                                + max(0., now - self.t) * self.rate)
+            self.t = now
+            if self.tokens >= 1.:
+                self.tokens -= 1.
+            else:
+                ok = False
+        if ok:
+            self.passed += 1
+        else:
+            self.skipped += 1
+        return ok
+
+
 class SocTransmitter(object):
     def __init__(self, port, nreceivermax, start=True, portname="",
-                 timeoutACK=1.):
+                 timeoutACK=1., journal=None, shards=0, ring_size=2**24,
+                 starvation=0.5, high_water=None, low_water=None,
+                 high_water_bytes=None, low_water_bytes=None,
+                 overflow='block', overflow_timeout=1., distribute=None,
+                 route_field=None, multicast=None, multicast_ttl=1,
+                 mtu=1400, multicast_history=1024, shm_ring=None,
+                 reactor=None, profiler=None, stamp=False):
         """Creates a transmitting socket to which receiving socket
         can listen.
 
@@ -57,7 +131,93 @@ class SocTransmitter(object):
           * timeoutACK (float or None): the timeout duration in seconds
             to wait for the acknowledgement receipt, or ``None`` to
             disable it
+          * journal (Journal, str or None): a journal, or the directory
+            of a journal, in which all broadcast frames are persisted
+            once sent, for audit and replay, or ``None`` to disable it.
+            A journal opened from a directory is closed by ``close``,
+            and opened again by ``start``
+          * shards (int): if >0, the number of worker processes to which
+            the receivers' sockets are handed over, so that writing to
+            the receivers and waiting for their acknowledgements is
+            spread over several cores. Requires python 3.8+
+          * ring_size (int): the size in octets of the shared memory
+            ring through which the lines are passed to the shard
+            workers, must be larger than the largest line
+          * starvation (float or None): the waiting time in seconds
+            after which a message is sent before the messages of higher
+            priorities, or ``None`` for strict priorities
+          * high_water (int or None): the number of messages waiting to
+            be sent above which ``overflow`` applies, or ``None`` for
+            no limit
+          * low_water (int or None): the number of messages waiting to
+            be sent below which the backpressure ends, default is half
+            high_water
+          * high_water_bytes, low_water_bytes (int or None): same as
+            high_water and low_water, in octets
+          * overflow (str): what ``tell`` and ``tell_raw`` do above a
+            high water mark: 'block' waits for room up to
+            ``overflow_timeout`` seconds (``None`` for no limit) then
+            returns False, 'reject' returns False, 'drop' drops the
+            oldest messages waiting, except delta messages and stream
+            chunks
+          * overflow_timeout (float or None): see overflow
+          * distribute (str or None): ``None`` to broadcast the
+            messages to all receivers, or how to send each message of
+            ``tell`` and ``tell_raw`` to one receiver only:
+            'round_robin' in turn, 'least_outstanding' to the receiver
+            with the fewest unacknowledged messages, 'key_hash' always
+            to the same receiver for a same key
+          * route_field (str or None): in 'key_hash' mode, the key of
+            the dict messages which value is the routing key, else the
+            tag is the routing key
+          * multicast (str, tuple or None): the multicast group, as
+            'address:port', to which the messages of ``tell`` and
+            ``tell_raw`` are sent once for all receivers, or ``None``
+            to send them to each receiver. The receivers join the group
+            on connection, and request the messages they missed
+          * multicast_ttl (int): the number of hops of the multicast
+            datagrams, 1 for the local network
+          * mtu (int): the maximum size in octets of the multicast IP
+            packets, larger messages are fragmented
+          * multicast_history (int): the number of multicast messages
+            kept for retransmission
+          * shm_ring (int or None): if not ``None``, the size in octets
+            of a shared memory ring in which the messages of ``tell``
+            and ``tell_raw`` are written once, for the receivers of the
+            same host to read them in place; only a notification is
+            sent to them. Requires python 3.8+
+          * reactor (Reactor, bool or None): the reactor on which the
+            accepting of the receivers and the sending run, instead of
+            two threads per transmitter, which adds a worker to it;
+            ``True`` for the reactor shared by the process, see
+            ``shared_reactor``; ``False`` or ``None`` for the threads
+          * profiler (Profiler or None): times the stages of the
+            messages, see ``Profiler``
+          * stamp (bool): whether to stamp the messages of ``tell``
+            and ``tell_raw`` with their sending time, for the receivers
+            to measure their latency. The receivers are then pinged
+            every few seconds to estimate their clock offsets
+
+        Note:
+          * In distribution mode, a receiver gets a new message once it
+            acknowledged the previous one, and the messages it did not
+            acknowledge are sent again to other receivers when it drops
+          * Pings, streams, files and delta messages are still
+            broadcast
         """
+        if distribute is not None and distribute not in DISTRIBUTIONS:
+            raise ValueError("distribute must be None or one of {}"\
+                                .format(DISTRIBUTIONS))
+        if distribute is not None and int(shards) > 0:
+            raise ValueError("distribute is not available with shards")
+        if multicast is not None and (distribute is not None
+                                      or int(shards) > 0):
+            raise ValueError("multicast is not available with shards or "\
+                             "distribute")
+        if shm_ring is not None and (multicast is not None
+                                     or int(shards) > 0):
+            raise ValueError("shm_ring is not available with shards or "\
+                             "multicast")
         self._running = False
         self.timeoutACK = None if timeoutACK is None else float(timeoutACK)
         self.port = int(port)
@@ -65,8 +225,73 @@ class SocTransmitter(object):
         self._nreceivermax = max(1, min(5, int(nreceivermax)))
         self.receivers = {}
         self._ping = Manager().Queue(maxsize=0)
-        self.sending_buffer = []
+        self.reactor = shared_reactor() if reactor is True\
+                            else (reactor or None)
+        self.profiler = profiler
+        self.stamp = bool(stamp)
+        # time of the next ping measuring the clock offsets
+        self._sync_next = 0.
+        # whether a sending is scheduled on the reactor
+        self._serving = False
+        # clock time of the pause of the sending, if profiled
+        self._paused = None
+        self._serve_lock = Lock()
+        self._control = None
+        self.sending_buffer = SendQueue(
+            starvation=starvation, high_water=high_water,
+            low_water=low_water, high_water_bytes=high_water_bytes,
+            low_water_bytes=low_water_bytes, overflow=overflow,
+            on_backpressure=self._backpressure,
+            on_ready=None if self.reactor is None else self._ready)
+        self.overflow_timeout = None if overflow_timeout is None\
+                                    else float(overflow_timeout)
         self.last_sent = 0.
+        # whether the journal was opened here, and is closed here
+        self._journal_owned = journal is not None\
+                                and not isinstance(journal, Journal)
+        if self._journal_owned:
+            journal = Journal(journal)
+        self.journal = journal
+        self.shards = max(0, int(shards))
+        self.ring_size = int(ring_size)
+        self._pool = None
+        self.schemas = {}
+        # name: tags of the schemas the receiver held when it connected
+        self._schema_ok = {}
+        # tag: [last state sent, sequence, messages since keyframe,
+        #       keyframe interval]
+        self._delta = {}
+        self._delta_lock = Lock()
+        self._stream_ids = count(1)
+        # tag: default time-to-live in seconds
+        self.ttls = {}
+        # tags which frames are coalesced under backlog
+        self.coalesced = set()
+        # tags which frames are not acknowledged
+        self.unreliable = set()
+        # tag: rate limit and sampling of its messages
+        self.throttles = {}
+        self._throttle_lock = Lock()
+        self.distribute = distribute
+        self.route_field = route_field
+        # name: (socket, frames sent and not acknowledged, sending time)
+        self._unacked = {}
+        # name: last time a line was sent to the receiver
+        self._last_line = {}
+        self._rr = 0
+        # lines distributed since the last pause, and time of the first
+        self._burst = 0
+        self._burst_t = 0.
+        self.multicast = None if multicast is None\
+                            else parse_group(multicast)
+        self.multicast_ttl = int(multicast_ttl)
+        self.mtu = int(mtu)
+        self.multicast_history = int(multicast_history)
+        self._mcast = None
+        self.shm_ring = None if shm_ring is None else int(shm_ring)
+        self._ring = None
+        # names of the receivers reading the ring
+        self._shm_local = set()
         if start:
             self.start()
 
@@ -85,12 +310,33 @@ class SocTransmitter(object):
         """
         if self.running:
             return
+        if self._journal_owned and self.journal.closed:
+            self.journal = Journal(self.journal.path)
+        if self.shm_ring is not None:
+            self._ring = ShmRing(size=self.shm_ring)
+        if self.multicast is not None:
+            self._mcast = McastSender(self.multicast,
+                                      ttl=self.multicast_ttl, mtu=self.mtu,
+                                      history=self.multicast_history)
+        if self.shards > 0:
+            self._pool = ShardPool(self.shards, timeoutACK=self.timeoutACK,
+                                   ring_size=self.ring_size,
+                                   on_drop=self._shard_dropped)
         self._soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self._soc.setblocking(0)
         self._soc.bind(('', self.port))
         self._soc.listen(self._nreceivermax)
         self._running = True
+        if self.reactor is not None:
+            self.reactor.attach()
+            self.reactor.register(self._soc, partial(_accept, self))
+            if self._mcast is not None or self._ring is not None\
+                    or self.stamp:
+                self._control = self.reactor.call_later(0.1, _control,
+                                                        self)
+            self._ready()
+            return
         loopy = Thread(target=accept_receivers, args=(self,))
         loopy.daemon = True
         loopy.start()
@@ -110,59 +356,477 @@ class SocTransmitter(object):
     def nreceivers(self, value):
         return
 
-    def _tell_receiver(self, name, txt, ping=False):
-        self.receivers[name].sendall(txt)
+    def _send_line(self, line, ping=False, target=None, path=None, size=0,
+                   ack=True):
+        """Sends a line, possibly followed by size octets of a file, to
+        all receivers, or to the target one, and returns the results of
+        the sending per receiver name. ack tells whether the receivers
+        acknowledge it
+        """
+        if self._pool is not None:
+            # shard workers do the sending
+            seq = self._pool.broadcast(line, ping, target, path, size, ack)
+            if not ping:
+                return {}
+            return self._pool.wait_ping(seq,
+                (self.timeoutACK or 1.) * max(1, self.nreceivers) + 1.)
+        res = {}
+        # make a list-copy
+        for name, receiver in list(self.receivers.items()):
+            if target is not None and name != target:
+                continue
+            res[name] = self._tell_receiver(name, line, ping, path, size,
+                                            ack)
+        return res
+
+    def _tell_receiver(self, name, txt, ping=False, path=None, size=0,
+                       ack=True):
+        prof = self.profiler
+        t0 = None if prof is None else prof.start(SEND)
+        sent = time.time()
+        try:
+            self.receivers[name].sendall(txt)
+        except socket.error:
+            # connection lost, found even without acknowledgement
+            return self._dropped(name=name)
+        if path is not None:
+            with open(path, 'rb') as f:
+                core.sendfile(self.receivers[name], f, size)
+        if t0 is not None:
+            prof.record(SEND, t0)
         # no ACK mode
-        if self.timeoutACK is None:
+        if self.timeoutACK is None or not (ack or ping):
             if ping:
                 # requested a ping, so give a bool anyway
-                return core.getAR(self.receivers[name])
+                ok = self._getAR(name)
+                if ok and self.stamp:
+                    self._clock(name, sent)
+                return ok
             else:
                 return None
-        elif not core.getAR(self.receivers[name], timeout=self.timeoutACK):
+        t0 = None if prof is None else prof.start(ACK)
+        ok = self._getAR(name, timeout=self.timeoutACK)
+        if t0 is not None:
+            prof.record(ACK, t0)
+        if not ok:
             return self._dropped(name=name)
+        if ping and self.stamp:
+            self._clock(name, sent)
+        return True
+
+    def _clock(self, name, sent):
+        """Sends to a receiver the sending and acknowledgement times
+        of the ping it just acknowledged, from which it estimates its
+        clock offset
+        """
+        txt = "{:.6f}:{:.6f}".format(sent, time.time())
+        self.sending_buffer.append(_Frame(
+            self._frame(txt.encode(core.ENCODING), core.CLOCKKEY,
+                        unpack=False),
+            target=name, lane=CONTROL))
+
+    def _probe(self):
+        """Pings the receivers every CLOCKSYNC seconds when stamping,
+        for them to estimate their clock offsets
+        """
+        if not self.stamp or self._pool is not None or not self.receivers:
+            return
+        now = time.time()
+        if now < self._sync_next:
+            return
+        self._sync_next = now + CLOCKSYNC
+        self.sending_buffer.append(_Frame(
+            self._frame(core._EMPTY, core.PINGKEY), ping=True, lane=CONTROL,
+            probe=True))
+
+    def _getAR(self, name, timeout=1.):
+        """Checks for the acknowledgement of a receiver, handling its
+        retransmission requests in multicast mode
+        """
+        sock = self.receivers[name]
+        if self._mcast is None and self._ring is None:
+            return core.getAR(sock, timeout=timeout)
+        end = time.time() + timeout
+        while True:
+            data = core.receive(sock, l=len(core.ACK),
+                                timeout=max(0., end - time.time()))
+            if data == core.NAK:
+                if not self._nak(name, sock, end - time.time()):
+                    return False
+                continue
+            elif data == core.SHMOFF:
+                self._shm_local.discard(name)
+                continue
+            return data == core.ACK
+
+    def _nak(self, name, sock, timeout):
+        """Reads the record of a retransmission request which NAK was
+        just read, queues the lines requested, and returns whether it
+        could
+        """
+        data = b''
+        while len(data) < NAKRECORD.size:
+            chunk = core.receive(sock, l=NAKRECORD.size - len(data),
+                                 timeout=max(0.1, timeout))
+            if not chunk:
+                return False
+            data += bytes(chunk)
+        first, last = NAKRECORD.unpack(data)
+        mcast = self._mcast
+        if mcast is None:
+            return True
+        first = max(first, mcast.seq - self.multicast_history + 1, 1)
+        for seq in range(first, min(last, mcast.seq) + 1):
+            line = mcast.get(seq)
+            txt = "{:d}:{:d}:".format(seq, line is not None)\
+                    .encode(core.ENCODING)
+            if line is not None:
+                txt += bytes(line)
+            self.sending_buffer.append(_Frame(
+                self._frame(txt, core.REPAIRKEY, unpack=False),
+                target=name, lane=CONTROL))
         return True
+
+    def _poll_control(self):
+        """Handles the retransmission requests and ring refusals
+        waiting on the receivers' sockets, and sends a heartbeat to the
+        multicast group if idle
+        """
+        for name, sock in list(self.receivers.items()):
+            try:
+                while select.select([sock], [], [], 0)[0]:
+                    data = sock.recv(len(core.ACK))
+                    if not data:
+                        self._dropped(name=name)
+                        break
+                    if data == bytes(core.NAK)\
+                            and not self._nak(name, sock, 1.):
+                        self._dropped(name=name)
+                        break
+                    elif data == bytes(core.SHMOFF):
+                        self._shm_local.discard(name)
+            except (select.error, socket.error, ValueError):
+                if name in self.receivers:
+                    self._dropped(name=name)
+        mcast = self._mcast
+        if mcast is not None and time.time() - mcast.last >= 1.:
+            mcast.heartbeat()
    
+    def _register(self, name, receiver):
+        """Registers a new receiver, which socket is handed over to a
+        shard worker in sharded mode
+        """
+        if not self._query_schemas(name, receiver):
+            core.killSock(receiver)
+            return
+        if self._pool is not None:
+            self._pool.add(name, receiver)
+            # the socket is owned by a shard worker
+            receiver = None
+        self.receivers[name] = receiver
+        self._delta_reset()
+        mcast = self._mcast
+        if mcast is not None:
+            txt = "{},{:d},{:d},{:d}".format(self.multicast[0],
+                                             self.multicast[1],
+                                             mcast.session, mcast.seq)
+            self.sending_buffer.append(_Frame(
+                self._frame(txt.encode(core.ENCODING), core.MCASTKEY,
+                            unpack=False),
+                target=name, lane=CONTROL))
+        self._shm_local.discard(name)
+        # measures its clock offset right away
+        self._sync_next = 0.
+        if self._ring is not None and _same_host(receiver):
+            self._shm_local.add(name)
+            self.sending_buffer.append(_Frame(
+                self._frame(self._ring.name.encode(core.ENCODING),
+                            core.SHMOPENKEY, unpack=False),
+                target=name, lane=CONTROL))
+        self._newconnection(name)
+
+    def _shard_dropped(self, name):
+        if name in self.receivers:
+            self._dropped(name=name)
+
     def _dropped(self, name):
         """Called-back function when a receiver did not send the
         acknowledgement within the timeout period.
-        Default behavior is drop the receiver and return False (used to
-        populate the answer of a ping call)
+        Default behavior is drop the receiver, queue again the messages
+        distributed to it and not acknowledged, and return False (used
+        to populate the answer of a ping call)
         
         Can be overriden, although ``name`` parameter is mandatory
         """
         del self.receivers[name]
+        self._redeliver(name)
         return False
 
-    def _tell(self, txt, key, tag=None, unpack=True):
-        """Does the real preparation and sending of the message
+    def _redeliver(self, name):
+        unacked = self._unacked.pop(name, None)
+        if unacked is not None:
+            self.sending_buffer.requeue(unacked[1])
+
+    def _route_key(self, tag, v):
+        """Returns the routing key of a message in key-hash mode
+        """
+        if self.route_field is not None and isinstance(v, dict)\
+                and self.route_field in v:
+            return v[self.route_field]
+        return tag
+
+    def _acks(self, timeout):
+        """Reads the acknowledgements of the distributed lines, waiting
+        up to timeout seconds for the first one, and drops the
+        receivers which did not acknowledge within timeoutACK
+        """
+        socks = {}
+        for name, (sock, frames, t) in list(self._unacked.items()):
+            if self.receivers.get(name) is not sock:
+                # dropped or replaced in between
+                del self._unacked[name]
+                self.sending_buffer.requeue(frames)
+            else:
+                socks[sock] = name
+        if not socks:
+            return
+        first = min(t for sock, frames, t in self._unacked.values())
+        timeout = max(0., min(timeout, first + self.timeoutACK - time.time()))
+        try:
+            ready = select.select(list(socks), [], [], timeout)[0]
+        except (select.error, socket.error, ValueError):
+            ready = list(socks)
+        for sock in ready:
+            name = socks[sock]
+            try:
+                data = sock.recv(64)
+            except socket.error:
+                data = b''
+            if bytes(core.ACK) in data:
+                unacked = self._unacked.pop(name, None)
+                prof = self.profiler
+                if unacked is not None and prof is not None\
+                        and prof.start(ACK) is not None:
+                    # from the sending of the line
+                    prof.record(ACK, prof.clock() - (time.time()
+                                                     - unacked[2]))
+            elif not data and name in self.receivers:
+                # connection closed
+                self._dropped(name=name)
+        now = time.time()
+        for name, (sock, frames, t) in list(self._unacked.items()):
+            if now - t > self.timeoutACK and name in self.receivers:
+                self._dropped(name=name)
+
+    def _settle(self):
+        """Waits until all distributed lines are acknowledged, or their
+        receivers dropped, before a broadcast
+        """
+        while self._unacked and self.running:
+            self._acks(self.timeoutACK)
+
+    def _distribute(self, frames):
+        """Sends the distributed frames, each to one receiver according
+        to the distribution mode, and returns the frames which could
+        not be sent for lack of receivers
+        """
+        while frames and self.running:
+            names = list(self.receivers)
+            if not names:
+                return frames
+            if self.distribute == KEYHASH:
+                name = _rendezvous(frames[0].route_key, names)
+                part = [frame for frame in frames
+                            if _rendezvous(frame.route_key, names) == name]
+            elif self.distribute == ROUNDROBIN:
+                name = names[self._rr % len(names)]
+                part = frames
+            else:
+                name = min(names, key=lambda n: (
+                    len(self._unacked[n][1]) if n in self._unacked else 0,
+                    self._last_line.get(n, 0.)))
+                part = frames
+            if name in self._unacked:
+                # one line at a time per receiver, wait for its ACK
+                self._acks(self.timeoutACK)
+                continue
+            if self.distribute == ROUNDROBIN:
+                self._rr += 1
+            frames = [frame for frame in frames if frame not in part]
+            _stamp(part)
+            line = part[0].line if len(part) == 1\
+                        else b''.join([frame.line for frame in part])
+            sock = self.receivers[name]
+            self._last_line[name] = time.time()
+            if self.timeoutACK is not None\
+                    and any(frame.ack for frame in part):
+                self._unacked[name] = (sock, part, self._last_line[name])
+            try:
+                # ACKs left by a line read in several chunks
+                while select.select([sock], [], [], 0)[0]\
+                        and sock.recv(64):
+                    pass
+                prof = self.profiler
+                t0 = None if prof is None else prof.start(SEND)
+                sock.sendall(line)
+                if t0 is not None:
+                    prof.record(SEND, t0)
+            except (select.error, socket.error, ValueError):
+                tracked = name in self._unacked
+                self._dropped(name=name)
+                if not tracked:
+                    self.sending_buffer.requeue(part)
+        return frames
+
+    def _frame(self, txt, key, tag=None, unpack=True, ack=True):
+        """Returns the framed message, which receivers acknowledge if
+        ack
+        """
+        tag = core.clean_tag(tag)
+        tag = b'' if tag is None else tag.encode(core.ENCODING)
+        flag = core._BONE if unpack else core._BZERO
+        if not ack:
+            flag += core._BNOACK
+        return b''.join((key, tag, core._BMAPPER, flag, core._BMAPPER,
+                         core._package(txt)))
+
+    def _tell(self, txt, key, tag=None, unpack=True, sent=None,
+              priority=core.PRIORITY_NORMAL, bounded=True, ttl=None,
+              route_key=None, t0=None, ack=True, paced=True):
+        """Does the real preparation and sending of the message. t0
+        is the clock time of the start of its encoding, if profiled,
+        ack tells whether the receivers acknowledge it, and paced
+        whether the following messages wait for the sending frequency
         """
         if not self.running:
             return False
-        tag = core._EMPTY if tag is None\
-            else Byt(core.clean_name(str(tag)[:core.TAGLEN]))
-        extra = tag + core.DICTMAPPER\
-                + (core._ONE if unpack else core._ZERO) + core.DICTMAPPER
-        self.sending_buffer.append((key + extra + core.package_message(txt),
-                                    key == core.PINGKEY))
-        return True
+        if key in (core.PINGKEY, core.DIEKEY):
+            lane = CONTROL
+        else:
+            lane = self.sending_buffer.lane(priority)
+        line = self._frame(txt, key, tag, unpack, ack)
+        deadline = None if ttl is None else time.time() + ttl
+        tag = core.clean_tag(tag)
+        coalesce = tag in self.coalesced and key in (core.RAWKEY,
+                                                      core.JSONKEY,
+                                                      core.SCHEMAKEY)
+        distributed = self.distribute is not None\
+                        and key in (core.RAWKEY, core.JSONKEY, core.SCHEMAKEY)
+        once = (self.multicast is not None or self.shm_ring is not None)\
+                    and not distributed\
+                    and key in (core.RAWKEY, core.JSONKEY, core.SCHEMAKEY,
+                                core.DELTAKEY)
+        frame = _Frame(line, ping=key == core.PINGKEY, sent=sent, lane=lane,
+                       deadline=deadline, tag=tag, coalesce=coalesce,
+                       distributed=distributed,
+                       route_key=tag if route_key is None else route_key,
+                       once=once, ack=ack, paced=paced,
+                       droppable=key not in (core.DELTAKEY, core.STREAMKEY))
+        if self.stamp and key in (core.RAWKEY, core.JSONKEY, core.SCHEMAKEY,
+                                  core.DELTAKEY):
+            # after the unpack flag
+            frame.stamp_at = line.index(core._BMAPPER,
+                                        line.index(core._BMAPPER,
+                                                   core.KEYLENGTH) + 1)
+        frame.journaled = self.journal is not None\
+                            and key in (core.RAWKEY, core.JSONKEY,
+                                        core.SCHEMAKEY, core.DELTAKEY)
+        if t0 is not None:
+            frame.stamp = self.profiler.record(ENCODE, t0)
+        if not bounded:
+            self.sending_buffer.append(frame)
+            return True
+        return self.sending_buffer.put(frame, timeout=self.overflow_timeout)
+
+    def _journal(self, frames):
+        """Appends the sent frames to the journal, once even if they
+        are sent again
+        """
+        for frame in frames:
+            if frame.journaled:
+                frame.journaled = False
+                self.journal.append(frame.line)
 
-    def tell_raw(self, txt, tag=None):
+    def replay(self, name=None, start=None, stop=None, start_time=None,
+               stop_time=None, maxsize=2**20):
+        """Re-sends a range of the journal to one or all receivers, and
+        returns the number of frames queued. The frames lose the
+        sending times they were stamped with, and are stamped again when
+        sent if the transmitter stamps its messages
+
+        Args:
+          * name (str or None): the name of the receiver to replay
+            to, or ``None`` for all receivers
+          * start (int or None): the first sequence number to replay
+          * stop (int or None): the last sequence number to replay
+          * start_time (float or None): the first timestamp to replay
+          * stop_time (float or None): the last timestamp to replay
+          * maxsize (int): frames are merged in lines of at most
+            ``maxsize`` octets before queuing
+        """
+        if self.journal is None or not self.running:
+            return 0
+        if name is not None and name not in self.receivers:
+            return 0
+        cnt = 0
+        lines = []
+        size = 0
+        # whether a frame of the line asks for an acknowledgement
+        ack = False
+        for seq, ts, frame in self.journal.replay(start=start, stop=stop,
+                                                  start_time=start_time,
+                                                  stop_time=stop_time):
+            lines.append(frame)
+            size += len(frame)
+            cnt += 1
+            ack = ack or core._acked(frame)
+            if size >= maxsize:
+                self._replay_line(lines, name, ack)
+                lines = []
+                size = 0
+                ack = False
+        if lines:
+            self._replay_line(lines, name, ack)
+        return cnt
+
+    def _replay_line(self, frames, name, ack):
+        """Queues journaled frames as one line, with their stamps of
+        sending time replaced
+        """
+        line, stamps = core._unstamp(frames)
+        frame = _Frame(line, target=name, ack=ack)
+        if self.stamp:
+            frame.stamp_at = stamps
+        self.sending_buffer.append(frame)
+
+    def tell_raw(self, txt, tag=None, priority=core.PRIORITY_NORMAL,
+                 ttl=None, reliable=None):
         """Broadcasts a raw message
 
         Args:
           * txt (Byt or str): the message
           * tag (str[15] or None): a key to indicate the kind of
             message transmitted
+          * priority (int): ``core.PRIORITY_HIGH``,
+            ``core.PRIORITY_NORMAL`` or ``core.PRIORITY_LOW``
+          * ttl (float or None): see ``tell``
+          * reliable (bool or None): see ``tell``
         """
         if not isinstance(txt, core.STRINGTYPES):
             return False
         if not len(txt) > 0:
             return False
-        txt = core.base_type2bytes(txt, keep_typ=False, json=False)
-        return self._tell(txt=txt, key=core.RAWKEY, tag=tag, unpack=False)
+        if self.throttles and not self._allow(tag):
+            return False
+        prof = self.profiler
+        t0 = None if prof is None else prof.start(ENCODE)
+        txt = core._base2bytes(txt, keep_typ=False, json=False)
+        return self._tell(txt=txt, key=core.RAWKEY, tag=tag, unpack=False,
+                          priority=priority, ttl=self._ttl(tag, ttl), t0=t0,
+                          ack=self._reliable(tag, reliable))
 
-    def tell(self, v, tag=None, unpack=True):
+    def tell(self, v, tag=None, unpack=True, priority=core.PRIORITY_NORMAL,
+             ttl=None, reliable=None):
         """Broadcasts an extended-json variable, cross-compatible
         between python 2 and 3
 
@@ -180,9 +844,401 @@ class SocTransmitter(object):
             message transmitted
           * unpack (bool): whether the message will be automatically
             decoded upon reception
+          * priority (int): ``core.PRIORITY_HIGH``,
+            ``core.PRIORITY_NORMAL`` or ``core.PRIORITY_LOW``; messages
+            of higher priority are sent first
+          * ttl (float or None): the time-to-live in seconds of the
+            message, after which it is discarded if still waiting to be
+            sent, default is given by ``set_ttl``
+          * reliable (bool or None): whether the receivers acknowledge
+            the message, default is given by ``set_reliable``
+
+        Note:
+          * If a schema is registered for the tag, held by all the
+            receivers, and v is a dict matching it, only its packed
+            values are sent
+          * If delta mode is set for the tag, and v is a dict, only
+            the items changed since the last message are sent, so all
+            messages of the tag should have the same priority
+          * Messages skipped by the rate limit of the tag, see
+            ``set_rate``, are not encoded, and ``False`` is returned
+        """
+        if self.throttles and not self._allow(tag):
+            return False
+        prof = self.profiler
+        t0 = None if prof is None else prof.start(ENCODE)
+        ctag = core.clean_tag(tag)
+        ack = self._reliable(ctag, reliable)
+        if ctag in self._delta and isinstance(v, dict):
+            # a lost delta would break the following ones
+            if self._tell(txt=self._delta_encode(ctag, v),
+                          key=core.DELTAKEY, tag=tag, unpack=True,
+                          priority=priority, t0=t0, ack=ack):
+                return True
+            # refused, the next message cannot build on this one
+            self._delta_reset(ctag)
+            return False
+        ttl = self._ttl(ctag, ttl)
+        route_key = self._route_key(ctag, v)
+        schema = self.schemas.get(ctag)
+        if schema is not None and isinstance(v, dict)\
+                and self._schema_held(ctag):
+            try:
+                v = schema.pack(v)
+            except ValueError:
+                pass
+            else:
+                return self._tell(txt=v, key=core.SCHEMAKEY, tag=tag,
+                                  unpack=unpack, priority=priority, ttl=ttl,
+                                  route_key=route_key, t0=t0, ack=ack)
+        v = core._dumps(v)
+        return self._tell(txt=v, key=core.JSONKEY, tag=tag, unpack=unpack,
+                          priority=priority, ttl=ttl, route_key=route_key,
+                          t0=t0, ack=ack)
+
+    def tell_stream(self, src, tag=None, chunk_size=2**16, meta=None,
+                    inflight=2, priority=core.PRIORITY_LOW):
+        """Broadcasts a large message as a sequence of chunks, which
+        are interleaved with the other messages. Blocks until the last
+        chunk is queued, and returns the stream identifier, or False
+
+        Args:
+          * src (file-like or iterable): the object to read the
+            message from, either through its ``read`` method or by
+            iterating over it to get Byt, str or bytes pieces
+          * tag (str[15] or None): a key to indicate the kind of
+            message transmitted
+          * chunk_size (int): the maximum size in octets of a chunk
+          * meta: any extended-json variable given to the receivers at
+            the start of the stream
+          * inflight (int): the maximum number of chunks waiting in the
+            sending buffer, which bounds the memory used, regardless of
+            the water marks
+          * priority (int): the priority of the chunks, see ``tell``
+
+        Note:
+          * Receivers get the stream through ``process_stream_start``,
+            ``process_stream_chunk`` and ``process_stream_end``
+          * The chunks are sent as fast as the receivers acknowledge
+            them, regardless of the sending frequency
+        """
+        if not self.running:
+            return False
+        chunk_size = max(1, int(chunk_size))
+        # check the priority before starting
+        self.sending_buffer.lane(priority)
+        sid = Byt("{:d}".format(next(self._stream_ids))) + core.DICTMAPPER
+        sent = Semaphore(max(1, int(inflight)))
+
+        def push(phase, data):
+            # wait for room in the sending buffer
+            while not sent.acquire(False):
+                if not self.running:
+                    return False
+                time.sleep(0.001)
+            return self._tell(txt=b''.join((sid, phase, core._BMAPPER, data)),
+                              key=core.STREAMKEY, tag=tag, unpack=False,
+                              sent=sent, priority=priority, bounded=False,
+                              paced=False)
+
+        if not push(core.STREAMSTART, core.json_dumps(meta)):
+            return False
+        try:
+            for chunk in _chunks(src, chunk_size):
+                if not push(core.STREAMCHUNK, chunk):
+                    return False
+        except Exception:
+            push(core.STREAMABORT, core._EMPTY)
+            raise
+        if not push(core.STREAMEND, core._EMPTY):
+            return False
+        return int(sid[:-1])
+
+    def tell_file(self, path, tag=None, name=None,
+                  priority=core.PRIORITY_LOW):
+        """Broadcasts the content of a file, sent from the kernel to
+        the receivers without copies when possible
+
+        Args:
+          * path (str): the path of the file
+          * tag (str[15] or None): a key to indicate the kind of
+            message transmitted
+          * name (str or None): the name of the file given to the
+            receivers, default is the base name of path
+          * priority (int): the priority of the file, see ``tell``
+
+        Note:
+          * The file is read when its turn to be sent comes
+          * Receivers get the file through ``process_file``
+        """
+        if not self.running or not os.path.isfile(path):
+            return False
+        if name is None:
+            name = os.path.basename(path)
+        lane = self.sending_buffer.lane(priority)
+        self.sending_buffer.append(_Frame((tag, str(name)), path=path,
+                                          lane=lane))
+        return True
+
+    def _file_header(self, frame, size):
+        tag, name = frame.line
+        txt = Byt("{:d}".format(size)) + core.DICTMAPPER\
+                + Byt(name.encode(core.ENCODING))
+        return self._frame(txt, core.FILEKEY, tag, unpack=False)
+
+    def set_ttl(self, tag, ttl):
+        """Sets the default time-to-live of the messages of a tag sent
+        with ``tell`` and ``tell_raw``: messages still waiting to be
+        sent after ttl seconds are discarded, so that a backlog is
+        caught up by skipping stale data
+
+        Args:
+          * tag (str[15] or None): the tag of the messages
+          * ttl (float or None): the time-to-live in seconds, or
+            ``None`` to disable it
+
+        Note:
+          * Messages of delta tags never expire
+        """
+        tag = core.clean_tag(tag)
+        if ttl is None:
+            self.ttls.pop(tag, None)
+        else:
+            self.ttls[tag] = max(0., float(ttl))
+
+    def set_coalesce(self, tag, coalesce=True):
+        """Sets the "latest value wins" mode for the messages of a tag
+        sent with ``tell`` and ``tell_raw``: when the sending buffer
+        is backlogged, only the most recent message of the tag waiting
+        to be sent is kept
+
+        Args:
+          * tag (str[15] or None): the tag of the messages
+          * coalesce (bool): whether to enable the mode
+
+        Note:
+          * Messages of delta tags are never coalesced
+          * The number of messages coalesced is given by
+            ``queue_stats``
+        """
+        tag = core.clean_tag(tag)
+        if coalesce:
+            self.coalesced.add(tag)
+        else:
+            self.coalesced.discard(tag)
+
+    def set_rate(self, tag, rate=None, burst=1, every=None):
+        """Limits the rate of the messages of a tag sent with ``tell``
+        and ``tell_raw``: the messages beyond the limit are skipped
+        before being encoded, and counted in ``rate_stats``
+
+        Args:
+          * tag (str[15] or None): the tag of the messages
+          * rate (float or None): the maximum rate in Hz, as a token
+            bucket, or ``None`` for no limit
+          * burst (int): the number of messages which can be sent at
+            once above the rate, after a pause
+          * every (int or None): if not ``None``, only one message
+            out of every is kept, before the rate limit applies
+
+        Note:
+          * With neither rate nor every, the limit of the tag is
+            removed
+        """
+        tag = core.clean_tag(tag)
+        if rate is not None and float(rate) <= 0:
+            raise ValueError("rate must be positive")
+        with self._throttle_lock:
+            if rate is None and every is None:
+                self.throttles.pop(tag, None)
+                return
+            self.throttles[tag] = _Throttle(
+                rate=None if rate is None else float(rate),
+                burst=max(1, int(burst)),
+                every=None if every is None else max(1, int(every)))
+
+    def rate_stats(self, reset=False):
+        """Returns the number of messages passed and skipped by the
+        rate limit of each tag, see ``set_rate``
+
+        Args:
+          * reset (bool): whether to reset the counters
+        """
+        res = {}
+        with self._throttle_lock:
+            for tag, throttle in self.throttles.items():
+                res[tag] = {'passed': throttle.passed,
+                            'skipped': throttle.skipped}
+                if reset:
+                    throttle.passed = 0
+                    throttle.skipped = 0
+        return res
+
+    def _allow(self, tag):
+        """Returns whether a message of a tag passes its rate limit
+        """
+        throttle = self.throttles.get(core.clean_tag(tag))
+        if throttle is None:
+            return True
+        with self._throttle_lock:
+            return throttle.allow()
+
+    def set_reliable(self, tag, reliable=True):
+        """Sets the reliability of the messages of a tag sent with
+        ``tell`` and ``tell_raw``: the receivers acknowledge reliable
+        messages, which sending waits for, and unreliable ones are
+        sent without waiting, e.g. for high-rate telemetry
+
+        Args:
+          * tag (str[15] or None): the tag of the messages
+          * reliable (bool): whether the messages are acknowledged
+
+        Note:
+          * A receiver which died is found when sending to it fails,
+            or with the next reliable message or ping
+          * Without timeoutACK, the sending never waits, but only the
+            unreliable messages ask for no acknowledgement
+          * The frames of unreliable messages carry a '~' after their
+            unpack flag, which receivers older than this option cannot
+            decode
+        """
+        tag = core.clean_tag(tag)
+        if reliable:
+            self.unreliable.discard(tag)
+        else:
+            self.unreliable.add(tag)
+
+    def _reliable(self, tag, reliable):
+        """Returns whether a message asks for an acknowledgement. The
+        frames of the reliable ones keep the plain unpack flag of the
+        older receivers
+        """
+        if reliable is None:
+            return core.clean_tag(tag) not in self.unreliable
+        return bool(reliable)
+
+    def _ttl(self, tag, ttl):
+        if ttl is not None:
+            return max(0., float(ttl))
+        return self.ttls.get(core.clean_tag(tag))
+
+    def set_delta(self, tag, keyframe=50):
+        """Sets the delta mode for the dict messages of a tag: only
+        the items added, changed or removed since the previous message
+        of the tag are sent, and the receivers rebuild the full dict.
+        A full dict is sent every ``keyframe`` messages, and after a
+        new receiver connected
+
+        Args:
+          * tag (str[15]): the tag of the messages
+          * keyframe (int or None): the interval in messages between two
+            full dicts, or ``None`` to disable the delta mode
+
+        Note:
+          * Delta messages are always unpacked upon reception
+          * Values are compared to a copy of the previously sent ones,
+            so in-place changes of mutable values are detected
+        """
+        tag = core.clean_tag(tag)
+        with self._delta_lock:
+            if keyframe is None:
+                self._delta.pop(tag, None)
+            else:
+                self._delta[tag] = [None, 0, 0, max(1, int(keyframe))]
+
+    def _delta_reset(self, tag=None):
+        """Forces a full dict at the next message of a delta tag, or
+        of all delta tags if tag is None
+        """
+        with self._delta_lock:
+            if tag is not None:
+                states = [self._delta[tag]] if tag in self._delta else []
+            else:
+                states = self._delta.values()
+            for state in states:
+                state[0] = None
+
+    def _delta_encode(self, tag, v):
+        """Returns the delta-encoded message of the dict v, and updates
+        the state of the tag
         """
-        v = core.json_dumps(v)
-        return self._tell(txt=v, key=core.JSONKEY, tag=tag, unpack=unpack)
+        with self._delta_lock:
+            state = self._delta[tag]
+            last, seq, cnt, keyframe = state
+            seq += 1
+            if last is None or cnt + 1 >= keyframe:
+                last = deepcopy(v)
+                kind = core.DELTAFULL
+                body = core._dumps(v)
+                cnt = 0
+            else:
+                changed = {}
+                for k, item in v.items():
+                    if k not in last or last[k] != item:
+                        changed[k] = item
+                removed = [k for k in last if k not in v]
+                for k in removed:
+                    del last[k]
+                last.update(deepcopy(changed))
+                kind = core.DELTADIFF
+                body = core._dumps([changed, removed])
+                cnt += 1
+            state[:3] = last, seq, cnt
+        return b''.join(("{:d}".format(seq).encode(core.ENCODING),
+                         core._BMAPPER, kind, core._BMAPPER, body))
+
+    def register_schema(self, tag, fields):
+        """Registers the schema of the dict messages of a tag, so that
+        ``tell`` sends only their packed values. Dicts that do not
+        match the schema are sent as usual. The same schema must be
+        registered on the receivers before they connect: each new
+        receiver is asked whether it holds it, and the messages of the
+        tag are sent as json as long as one of the receivers does not
+
+        Args:
+          * tag (str[15]): the tag of the messages
+          * fields (list, OrderedDict or Schema): the (name, type)
+            pairs of the dict items, in a fixed order, see ``Schema``
+            for the supported types; or ``None`` to unregister
+        """
+        tag = core.clean_tag(tag)
+        # the receivers connected held the previous one, if any
+        for tags in self._schema_ok.values():
+            tags.discard(tag)
+        if fields is None:
+            self.schemas.pop(tag, None)
+        elif isinstance(fields, Schema):
+            self.schemas[tag] = fields
+        else:
+            self.schemas[tag] = Schema(fields)
+
+    def _schema_held(self, tag):
+        """Whether all the receivers hold the schema of a tag
+        """
+        return all(tag in self._schema_ok.get(name, ())
+                        for name in list(self.receivers))
+
+    def _query_schemas(self, name, receiver):
+        """Asks a new receiver which of the schemas registered it holds,
+        before it gets any other line, and returns whether it answered
+        """
+        held = set()
+        timeout = 1. if self.timeoutACK is None else self.timeoutACK
+        for tag, schema in list(self.schemas.items()):
+            line = self._frame("{:d}".format(schema.fingerprint)\
+                                    .encode(core.ENCODING),
+                               core.SCHEMAQKEY, tag=tag, unpack=False)
+            try:
+                receiver.sendall(line)
+            except socket.error:
+                return False
+            data = core.receive(receiver, l=len(core.ACK), timeout=timeout)
+            if data == core.SCHEMAOK:
+                held.add(tag)
+            elif data != core.ACK:
+                return False
+        self._schema_ok[name] = held
+        return True
 
     def tell_dict(self, *args, **kwargs):
         """DEPRECATED, use tell instead
@@ -236,6 +1292,48 @@ class SocTransmitter(object):
         print("tell_report is deprecated, use tell instead")
         return False
 
+    def flush(self, timeout=None):
+        """Waits until all the messages waiting are sent, and returns
+        whether they were
+
+        Args:
+          * timeout (float or None): the maximum waiting time in
+            seconds, or ``None`` to wait indefinitely
+        """
+        return self.sending_buffer.flush(timeout=timeout)
+
+    def _ready(self):
+        """Schedules the sending on the reactor, when frames are
+        queued
+        """
+        with self._serve_lock:
+            if self._serving or not self.running:
+                return
+            self._serving = True
+        self.reactor.submit(_serve, self)
+
+    def _backpressure(self, full):
+        self.on_backpressure(full)
+
+    def on_backpressure(self, full):
+        """Call-back function when the sending buffer reaches a high
+        water mark, or gets back below the low water marks
+
+        Can be overriden, although ``full`` parameter is mandatory
+        """
+        pass
+
+    def queue_stats(self, reset=False):
+        """Returns the statistics of the sending buffer per priority
+        lane: number of messages queued, sent, dropped, expired,
+        coalesced and redelivered, and mean and maximum waiting times
+        in seconds
+
+        Args:
+          * reset (bool): whether to reset the counters
+        """
+        return self.sending_buffer.stats(reset=reset)
+
     def ping(self):
         """Pings all receivers to check their health, updates the
         receivers list and returns the result
@@ -250,6 +1348,8 @@ class SocTransmitter(object):
         """
         self._tell(txt=core._EMPTY, key=core.DIEKEY)
         for k, v in list(self.receivers.items()):
+            if self._pool is not None:
+                self._pool.remove(k)
             core.killSock(v)
             del self.receivers[k]
 
@@ -261,9 +1361,29 @@ class SocTransmitter(object):
         if not self.running:
             return
         self._running = False
-        self.sending_buffer = []
+        self.sending_buffer.clear()
         self.close_receivers()
+        if self.reactor is not None:
+            self.reactor.unregister(self._soc)
+            self.reactor.detach()
+            if self._control is not None:
+                self._control.cancel()
+                self._control = None
         core.killSock(self._soc)
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        if self._mcast is not None:
+            self._mcast.close()
+            self._mcast = None
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+        self._shm_local.clear()
+        if self._journal_owned:
+            self.journal.close()
+        elif self.journal is not None:
+            self.journal.flush()
 
     @property
     def running(self):
@@ -284,61 +1404,370 @@ class SocTransmitter(object):
         print('hello: {}'.format(name))
 
 
+def _chunks(src, size):
+    """Iterates over the chunks of at most size octets read from a
+    file-like or iterable object
+    """
+    if hasattr(src, 'read'):
+        while True:
+            data = src.read(size)
+            if not data:
+                return
+            yield core._base2bytes(data, keep_typ=False)
+    else:
+        for data in src:
+            data = core._base2bytes(data, keep_typ=False)
+            for i in range(0, len(data), size):
+                yield data[i:i + size]
+
+
+def _rendezvous(key, names):
+    """Returns the name which hash with the key is the highest, so
+    that only the keys of a receiver move when it drops
+    """
+    key = repr(key).encode(core.ENCODING)
+    return max(names, key=lambda name: hashlib.md5(
+        key + b'\x00' + str(name).encode(core.ENCODING)).digest())
+
+
 def send_buffer(self):
     """Infinite loop sending messages
     """
-    ALMOST = 0.85
     while self.running:
-        # make a list-copy
-        lines_to_send = list(self.sending_buffer)
-        if len(lines_to_send) == 0:
-            time.sleep(0.0001)
+        if self._mcast is not None or self._ring is not None:
+            self._poll_control()
+        self._probe()
+        if not self.sending_buffer.wait(0.1):
             # process might have died in between
             if time is None:
                 break
             continue
-        # too many lines to send.. gotta merge some to keep up
-        elif len(lines_to_send) >= ALMOST*core.SENDBUFFERFREQ:
-            # average amount of lines to be merged
-            avg_join = int(len(lines_to_send) / (ALMOST * core.SENDBUFFERFREQ))
-            # make init copy
-            new_lines_to_send = [[lines_to_send[0][0], lines_to_send[0][1], 1]]
-            # loop to merge
-            for line, ping in lines_to_send[1:]:
-                # if not ping and not previously ping and below average merge
-                if not (ping or new_lines_to_send[-1][1]\
-                        or new_lines_to_send[-1][2] > avg_join):
-                    new_lines_to_send[-1][0] += line
-                    new_lines_to_send[-1][2] += 1
-                else:  # just add new line
-                    new_lines_to_send.append([line, ping, 1])
-            # copy it back
-            lines_to_send = new_lines_to_send
-        # iterate on lines
-        for item in lines_to_send:
-            # merged lines have a thrid argument, default 1
-            line, ping = item[:2]
-            cnt = item[2] if len(item) > 2 else 1
-            t = time.time()
-            # in case of ping, init
-            ping_res = {}
-            # make a list-copy
-            for name, receiver in list(self.receivers.items()):
-                ping_res[name] = self._tell_receiver(name, line, ping)
-            if ping:
-                self._ping.put(ping_res)
-            # remove lines, possibly several if merged
-            for i in range(cnt):
-                del self.sending_buffer[0]
-            # wait for the right time to go on
-            while time.time()-t < 0.99 / core.SENDBUFFERFREQ:
-                time.sleep(0.1/core.SENDBUFFERFREQ)
-                # process might have died in between
-                if time is None:
-                    break
-        else:
-            self.last_sent = time.time()
+        until = _send_next(self)
+        prof = self.profiler
+        t0 = None if prof is None or until is None\
+                else prof.start(PACING)
+        # wait for the right time to go on
+        while until is not None and time.time() < until:
+            time.sleep(0.1/core.SENDBUFFERFREQ)
+            # process might have died in between
+            if time is None:
+                break
+        if t0 is not None:
+            prof.record(PACING, t0)
+
+
+def _send_next(self):
+    """Sends the next lines of the sending buffer, and returns the time
+    before which the following ones must wait, or ``None`` if they can
+    go right away
+    """
+    ALMOST = 0.85
+    # too many lines to send.. gotta merge some to keep up
+    avg_join = 0
+    backlog = len(self.sending_buffer)
+    if backlog >= ALMOST*core.SENDBUFFERFREQ\
+            and self.sending_buffer.coalesce():
+        # obsolete values of latest-wins tags dropped
+        backlog = len(self.sending_buffer)
+    # distributed lines are spread over the receivers
+    nlines = max(1, self.nreceivers) if self.distribute is not None\
+                else 1
+    if backlog >= ALMOST*core.SENDBUFFERFREQ*nlines:
+        # average amount of lines to be merged
+        avg_join = int(backlog / (ALMOST*core.SENDBUFFERFREQ*nlines))
+    # next lines by priority, possibly several to merge
+    group = self.sending_buffer.take(avg_join)
+    if not group:
+        return None
+    prof = self.profiler
+    if prof is not None:
+        now = prof.clock()
+        for frame in group:
+            if frame.stamp is not None:
+                prof.record(QUEUE, frame.stamp, now)
+    if self._burst == 0:
+        self._burst_t = time.time()
+    if group[0].distributed:
+        left = self._distribute(group)
+        if left:
+            # no receivers, keep them for later
+            self.sending_buffer.requeue(left, redelivered=False)
+        sent = [frame for frame in group if frame not in left]
+        self._journal(sent)
+        for frame in sent:
+            if frame.sent is not None:
+                frame.sent.release()
+        self.sending_buffer.done()
+        self.last_sent = time.time()
+        self._burst += 1
+        if self._burst < nlines and not left:
+            # one line per receiver before pausing
+            return None
+    else:
+        if self._unacked:
+            self._settle()
+        _stamp(group)
+        _broadcast(self, group)
+        self._journal(group)
+        if not any(frame.paced for frame in group):
+            # the chunks of a stream go as fast as acknowledged
+            return None
+    self._burst = 0
+    return self._burst_t + 0.99 / core.SENDBUFFERFREQ
+
+
+def _stamp(frames):
+    """Writes the sending time in the stamped frames, once
+    """
+    now = None
+    for frame in frames:
+        at = frame.stamp_at
+        if at is None:
             continue
+        if now is None:
+            now = b''.join((core._BSTAMP, "{:.6f}".format(time.time())\
+                                                .encode(core.ENCODING)))
+        if isinstance(at, list):
+            # merged frames
+            line = frame.line
+            pieces = []
+            start = 0
+            for pos in at:
+                pieces += [line[start:pos], now]
+                start = pos
+            pieces.append(line[start:])
+            frame.line = b''.join(pieces)
+        else:
+            frame.line = b''.join((frame.line[:at], now, frame.line[at:]))
+        frame.stamp_at = None
+
+
+def _serve(self):
+    """Sends the next lines of the sending buffer in a worker of the
+    reactor, and schedules the following ones
+    """
+    prof = self.profiler
+    if self._paused is not None and prof is not None:
+        prof.record(PACING, self._paused)
+        self._paused = None
+    if self.running:
+        if self._mcast is not None or self._ring is not None:
+            self._poll_control()
+        self._probe()
+        until = _send_next(self)
+        if until is not None and until > time.time():
+            if prof is not None:
+                self._paused = prof.start(PACING)
+            self.reactor.call_later(until - time.time(),
+                                    self.reactor.submit, _serve, self)
+            return
+        if self.running and len(self.sending_buffer):
+            self.reactor.submit(_serve, self)
+            return
+    with self._serve_lock:
+        self._serving = False
+    # frames queued in between
+    if len(self.sending_buffer):
+        self._ready()
+
+
+def _control(self):
+    """Polls the control messages of the receivers periodically on the
+    reactor, for multicast and shared memory modes, between two
+    sendings which would read the acknowledgements, and pings them
+    when stamping
+    """
+    if not self.running:
+        return
+    self._ready()
+    self._control = self.reactor.call_later(0.1, _control, self)
+
+
+def _same_host(sock):
+    """Whether the peer of a socket is on the same host
+    """
+    try:
+        peer = sock.getpeername()[0]
+        return peer.startswith('127.') or peer == sock.getsockname()[0]
+    except (socket.error, AttributeError):
+        return False
+
+
+def _shm_record(group):
+    """Returns the parts of the record of a group of frames in the
+    shared memory ring: the length of each frame, then the frame
+    un-escaped and without its end characters
+    """
+    parts = []
+    for frame in group:
+        line = frame.line
+        end = len(line) - len(core._BDMESSAGEEND)
+        if bytes.find(line, core._BESCAPEDMESSAGEEND, 0, end) >= 0:
+            comm = bytes.replace(line[:end], core._BESCAPEDMESSAGEEND,
+                                 core._BMESSAGEEND)
+        else:
+            comm = memoryview(line)[:end]
+        parts += [core._SHMFRAME.pack(len(comm)), comm]
+    return parts
+
+
+def _shm_send(self, ring, group):
+    """Writes a group of frames in the shared memory ring, notifies
+    the receivers reading it, sends the frames to the others, and
+    returns whether it could
+    """
+    try:
+        pos = ring.write(_shm_record(group))
+    except ValueError:
+        # larger than the ring
+        return False
+    ack = any(frame.ack for frame in group)
+    note = self._frame("{:d}".format(pos).encode(core.ENCODING),
+                       core.SHMKEY, unpack=False, ack=ack)
+    line = None
+    for name in list(self.receivers):
+        if name in self._shm_local:
+            txt = note
+        else:
+            if line is None:
+                line = b''.join([frame.line for frame in group])
+            txt = line
+        if name in self.receivers:
+            self._tell_receiver(name, txt, ack=ack)
+    return True
+
+
+def _broadcast(self, group):
+    """Sends a group of frames to all receivers, or to their target
+    """
+    path, size = group[0].path, 0
+    ring = self._ring
+    if group[0].once and ring is not None and _shm_send(self, ring, group):
+        path = None
+        line = None
+    elif path is not None:
+        try:
+            size = os.path.getsize(path)
+        except OSError:  # file vanished
+            path = None
+            line = None
+        else:
+            line = self._file_header(group[0], size)
+    elif len(group) == 1:
+        line = group[0].line
+    else:
+        line = b''.join([frame.line for frame in group])
+    ping, target = group[0].ping, group[0].target
+    ping_res = {}
+    mcast = self._mcast
+    if group[0].once and mcast is not None:
+        try:
+            # once for all receivers
+            mcast.send(line)
+            line = None
+        except ValueError:
+            # too large, sent to each receiver
+            pass
+    if line is not None:
+        ping_res = self._send_line(line, ping, target, path, size,
+                                   any(frame.ack for frame in group))
+    if ping and not group[0].probe:
+        self._ping.put(ping_res)
+    for frame in group:
+        if frame.sent is not None:
+            frame.sent.release()
+    self.sending_buffer.done()
+    self.last_sent = time.time()
+
+
+def _admit(self, receiver, name, alive):
+    """Registers a new receiver which sent its name, or refuses it.
+    alive tells whether the receiver of a name still listens
+    """
+    if name is None:
+        core.killSock(receiver)
+        return
+    name = str(name)
+    if name in self.receivers:  # reciever already has such name
+        if alive(name):  # still active
+            # refuse new connection
+            core.killSock(receiver)
+        else:  # not active anymore.. replace old connection
+            # close broken socket
+            core.killSock(self.receivers.get(name))
+            receiver.send(core.ACK)
+            self._register(name, receiver)
+    elif self.nreceivers < self._nreceivermax:
+        receiver.send(core.ACK)
+        self._register(name, receiver)
+    else:
+        core.killSock(receiver)
+
+
+def _alive(sock):
+    """Whether the receiver of a socket did not close it, without
+    waiting for it
+    """
+    if sock is None:
+        return False
+    try:
+        if not select.select([sock], [], [], 0)[0]:
+            return True
+        return len(sock.recv(1, socket.MSG_PEEK)) > 0
+    except (select.error, socket.error, ValueError):
+        return False
+
+
+def _accept(self, mask):
+    """Accepts a new receiver in the reactor, which then sends its name
+    """
+    try:
+        receiver, addr = self._soc.accept()
+    except (socket.error, AttributeError):
+        return
+    if not self.running:
+        core.killSock(receiver)
+        return
+    try:
+        receiver.send(core.ACK)
+    except socket.error:
+        receiver.close()
+        return
+    timer = self.reactor.call_later(5., _named, self, receiver, None)
+    self.reactor.register(receiver, partial(_named, self, receiver, timer))
+
+
+def _named(self, receiver, timer, mask=0):
+    """Admits a receiver which sent its name, or which did not within
+    the timeout if timer is ``None``
+    """
+    name = None
+    if mask:
+        receiver.setblocking(0)
+        try:
+            name = receiver.recv(15)
+        except socket.error as e:
+            if e.args and e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                # nothing to read after all
+                receiver.setblocking(1)
+                return
+        receiver.setblocking(1)
+    if timer is not None:
+        timer.cancel()
+    self.reactor.unregister(receiver)
+    name = Byt(name) if name else None
+    # the schemas query waits for the receiver
+    self.reactor.submit(_welcome, self, receiver, name)
+
+
+def _welcome(self, receiver, name):
+    """Admits a receiver in a worker of the reactor
+    """
+    try:
+        _admit(self, receiver, name, lambda name: _alive(
+                                            self.receivers.get(name)))
+    except socket.error:
+        receiver.close()
 
 
 def accept_receivers(self):
@@ -360,30 +1789,7 @@ def accept_receivers(self):
         if not self.running:
             core.killSock(receiver)
             break
-        upToLimit = False
-        if self.nreceivers >= self._nreceivermax:
-            # maybe replace old droped connection with new one
-            upToLimit = True
         receiver.send(core.ACK)
         name = core.receive(receiver, l=15, timeout=5.)
-        if name is not None:
-            name = str(name)
-            if name in self.receivers:  # reciever already has such name
-                if self.ping().get(name, False):  # still active
-                    # refuse new connection
-                    core.killSock(receiver)
-                else:  # not active anymore.. replace old connection
-                    # close broken socket
-                    core.killSock(self.receivers.get(name))
-                    receiver.send(core.ACK)
-                    self.receivers[name] = receiver
-                    self._newconnection(name)
-            else:  # name does not exist already
-                if not upToLimit:
-                    receiver.send(core.ACK)
-                    self.receivers[name] = receiver
-                    self._newconnection(name)
-                else:
-                    core.killSock(receiver)
-        else:
-            core.killSock(receiver)
+        _admit(self, receiver, name,
+               lambda name: self.ping().get(name, False))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import time
+from threading import Lock
+
+from ..socreceiver import SocReceiver
+
+
+HOST = '127.0.0.1'
+
+
+def wait_for(cond, timeout=5.):
+    """Waits until cond() is true, and returns its last value
+    """
+    end = time.time() + timeout
+    res = cond()
+    while not res and time.time() < end:
+        time.sleep(0.01)
+        res = cond()
+    return res
+
+
+class Collector(SocReceiver):
+    """Receiver which keeps the (tag, data) messages processed, and
+    sleeps delay seconds on each
+    """
+    def __init__(self, *args, **kwargs):
+        self.got = []
+        self.metas = []
+        self.delay = kwargs.pop('delay', 0.)
+        self._got_lock = Lock()
+        kwargs.setdefault('hostname', HOST)
+        SocReceiver.__init__(self, *args, **kwargs)
+
+    def process(self, data, tag):
+        if self.delay:
+            time.sleep(self.delay)
+        with self._got_lock:
+            self.got.append((tag, data))
+            self.metas.append(self.meta)
+
+    def _newconnection(self):
+        pass
+
+    def shut(self):
+        """Closes the receiver and stops its connection loop
+        """
+        self.stop_connectLoop()
+        self.close()
+
+    def datas(self, tag=None):
+        with self._got_lock:
+            return [data for t, data in self.got if tag is None or t == tag]
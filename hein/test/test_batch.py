@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+
+import pytest
+
+from ..soctransmitter import SocTransmitter
+from ..batch import MessageBatch
+from ._helpers import wait_for, Collector
+
+
+def test_from_dicts():
+    batch = MessageBatch.from_dicts([{'x': 1, 'y': 'a'}, {'x': 2}], tag='t')
+    assert len(batch) == 2
+    assert sorted(batch.names) == ['x', 'y']
+    assert list(batch['x']) == [1, 2]
+    assert list(batch['y']) == ['a', None]
+    with pytest.raises(TypeError):
+        MessageBatch.from_dicts([{'x': 1}, [1, 2]])
+
+
+def test_from_dicts_key_union():
+    batch = MessageBatch.from_dicts([{'x': 1}, {'y': 'b', 'x': 2},
+                                     {'z': 3.5}])
+    assert batch.names == ['x', 'y', 'z']
+    assert list(batch['x']) == [1, 2, None]
+    assert list(batch['y']) == [None, 'b', None]
+    assert list(batch['z']) == [None, None, 3.5]
+    assert list(batch.rows())[2] == {'x': None, 'y': None, 'z': 3.5}
+
+
+def test_batched_tag_with_non_dicts():
+    t = SocTransmitter(52111, 2)
+    r = Collector(52111, 'a')
+    r.set_batch('b', 100)
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        t.tell({'x': 1}, tag='b')
+        t.tell([1, 2], tag='b')
+        t.tell({'x': 2}, tag='b')
+        t.tell('after', tag='c')
+        assert t.flush(5)
+        assert wait_for(lambda: r.datas('c') == ['after'])
+        datas = r.datas('b')
+        assert [1, 2] in datas
+        rows = [row for d in datas if isinstance(d, MessageBatch)
+                    for row in d.rows()]
+        assert [int(row['x']) for row in rows] == [1, 2]
+        assert r.running
+    finally:
+        t.close()
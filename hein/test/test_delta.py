@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+
+from copy import deepcopy
+
+from ..soctransmitter import SocTransmitter
+from ._helpers import wait_for, Collector
+
+
+class Mutator(Collector):
+    """Changes the dicts it processes in place, once kept
+    """
+    def process(self, data, tag):
+        Collector.process(self, deepcopy(data), tag)
+        data['pos'].append(-1)
+        data['cfg']['gain'] = -1
+
+
+def test_delta_state_not_shared():
+    t = SocTransmitter(52201, 1)
+    t.set_delta('st', keyframe=10)
+    r = Mutator(52201, 'a')
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        # only 'i' changes after the first, full, dict
+        sent = [{'pos': [1, 2], 'cfg': {'gain': 2}, 'i': i}
+                for i in range(5)]
+        for v in sent:
+            t.tell(v, tag='st')
+        assert t.flush(5)
+        assert wait_for(lambda: len(r.got) == 5)
+        assert r.datas() == sent
+        assert r.delta_gaps == 0
+    finally:
+        t.close()
+        r.shut()
+
+
+def test_delta_not_dropped_on_overflow():
+    t = SocTransmitter(52202, 1, high_water=2, overflow='drop')
+    t.set_delta('st', keyframe=100)
+    r = Collector(52202, 'a', delay=0.01)
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        sent = [{'i': i} for i in range(21)]
+        for v in sent:
+            assert t.tell(v, tag='st')
+        assert t.flush(10)
+        assert wait_for(lambda: len(r.got) == 21)
+        assert r.datas() == sent
+        assert r.delta_gaps == 0
+    finally:
+        t.close()
+        r.shut()
+
+
+def test_delta_refused_forces_keyframe():
+    t = SocTransmitter(52203, 1, high_water=1, overflow='reject')
+    t.set_delta('st', keyframe=100)
+    r = Collector(52203, 'a', delay=0.01)
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        sent = []
+        for i in range(10):
+            sent.append({'i': i, 'k': 0})
+            assert t.tell(sent[-1], tag='st')
+            # the queue is full
+            assert not t.tell({'i': i, 'k': 1}, tag='st')
+            assert t.flush(5)
+        assert wait_for(lambda: len(r.got) == len(sent))
+        assert r.datas() == sent
+        assert r.delta_gaps == 0
+    finally:
+        t.close()
+        r.shut()
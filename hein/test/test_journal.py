@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+
+import shutil
+import tempfile
+
+from .. import core
+from ..journal import Journal
+from ..soctransmitter import SocTransmitter
+from ._helpers import wait_for, Collector
+
+
+def test_journal_sent_frames_only():
+    path = tempfile.mkdtemp()
+    t = SocTransmitter(52161, 1, journal=Journal(path), high_water=3,
+                       overflow='reject')
+    r = Collector(52161, 'a', delay=0.01)
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        for i in range(2):
+            # expired before being sent
+            assert t.tell(-1, ttl=1e-9)
+        queued = [i for i in range(50) if t.tell(i)]
+        assert len(queued) < 50
+        assert t.flush(10)
+        assert wait_for(lambda: r.datas() == queued)
+        frames = [frame for seq, ts, frame in t.journal.replay()]
+        assert len(frames) == len(queued)
+        for i, frame in zip(queued, frames):
+            assert bytes(frame) == bytes(t._frame(core._dumps(i),
+                                                  core.JSONKEY))
+    finally:
+        t.close()
+        r.shut()
+        t.journal.close()
+        shutil.rmtree(path)
+
+
+def _records(j):
+    return [bytes(frame) for seq, ts, frame in j.replay()]
+
+
+def test_journal_cut_at_bad_record():
+    path = tempfile.mkdtemp()
+    try:
+        j = Journal(path)
+        for i in range(5):
+            assert j.append(b'frame' + bytes([48 + i])) == i + 1
+        j.close()
+        segpath = j._segments[-1].segpath
+        with open(segpath, 'r+b') as f:
+            # one byte of the third frame
+            f.seek(3 * j._pos // 5 - 1)
+            f.write(b'X')
+        j = Journal(path)
+        assert _records(j) == [b'frame0', b'frame1']
+        assert j.last_seq == 2
+        assert j.append(b'again') == 3
+        j.close()
+        # nothing of the cut records comes back after the new one
+        j = Journal(path)
+        assert _records(j) == [b'frame0', b'frame1', b'again']
+        assert j.append(b'more') == 4
+        j.close()
+    finally:
+        shutil.rmtree(path)
+
+
+def test_journal_cut_in_closed_segment():
+    path = tempfile.mkdtemp()
+    try:
+        j = Journal(path, segment_size=4096)
+        for i in range(6):
+            j.append(b'frame' + bytes([48 + i]) * 2000)
+        assert len(j._segments) > 2
+        lost = j._segments[1].last
+        j.close()
+        with open(j._segments[1].segpath, 'r+b') as f:
+            f.seek(-1, 2)
+            f.write(b'X')
+        j = Journal(path)
+        assert len(j._segments) == 2
+        assert j.last_seq == lost - 1
+        assert j.append(b'again') == lost
+        assert _records(j)[-1] == b'again'
+        j.close()
+    finally:
+        shutil.rmtree(path)
+
+
+def test_journal_opened_from_path_is_closed():
+    path = tempfile.mkdtemp()
+    try:
+        t = SocTransmitter(52162, 1, journal=path)
+        assert not t.journal.closed
+        t.tell(1)
+        assert t.flush(5)
+        t.close()
+        assert t.journal.closed
+        t.start()
+        assert not t.journal.closed
+        t.close()
+        assert t.journal.closed
+        own = Journal(path)
+        t = SocTransmitter(52163, 1, journal=own)
+        t.close()
+        # given by the caller, left open
+        assert not own.closed
+        own.close()
+    finally:
+        shutil.rmtree(path)
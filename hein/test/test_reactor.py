@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+
+import time
+from threading import Event
+
+from ..soctransmitter import SocTransmitter
+from ..socreceiver import SocReceiver
+from ..multireceiver import MultiSocReceiver
+from ..reactor import Reactor
+from ._helpers import wait_for, Collector, HOST
+
+
+def test_reactor_calls():
+    reactor = Reactor(workers=1)
+    try:
+        done = Event()
+        res = []
+        reactor.call_soon(res.append, 1)
+        timer = reactor.call_later(0.05, res.append, 'cancelled')
+        timer.cancel()
+        reactor.call_later(0.1, done.set)
+        reactor.submit(res.append, 2)
+        assert done.wait(2)
+        assert sorted(res, key=str) == [1, 2]
+    finally:
+        reactor.close()
+    assert not reactor.running
+
+
+def test_reactor_false_is_threads():
+    t = SocTransmitter(52151, 2, reactor=False)
+    r = Collector(52151, 'a', reactor=False)
+    try:
+        assert t.reactor is None and r.reactor is None
+        assert wait_for(lambda: len(t.receivers) == 1)
+        t.tell('hi')
+        assert wait_for(lambda: r.datas() == ['hi'])
+    finally:
+        t.close()
+        r.shut()
+
+
+def test_reactor_delivery():
+    reactor = Reactor()
+    t = SocTransmitter(52152, 3, reactor=reactor)
+    rs = [Collector(52152, name, reactor=reactor) for name in ('a', 'b')]
+    m = MultiSocReceiver([('127.0.0.1', 52152)], 'm', reactor=reactor)
+    got = []
+    m.process = lambda data, tag, source: got.append(data)
+    m._newconnection = lambda source: None
+    try:
+        assert wait_for(lambda: len(t.receivers) == 3)
+        for i in range(100):
+            t.tell(i)
+        assert t.flush(10)
+        for r in rs:
+            assert wait_for(lambda: r.datas() == list(range(100)))
+        assert wait_for(lambda: got == list(range(100)))
+        assert t.ping() == {'a': True, 'b': True, 'm': True}
+    finally:
+        t.close()
+        m.stop_connectLoop()
+        m.close()
+        for r in rs:
+            r.shut()
+        reactor.close()
+
+
+def test_slow_acks_hold_no_other_transmitter():
+    reactor = Reactor(workers=1)
+    slow = SocTransmitter(52153, 1, reactor=reactor)
+    fast = SocTransmitter(52154, 1, reactor=reactor)
+    rslow = Collector(52153, 'slow', delay=0.1)
+    rfast = Collector(52154, 'fast', reactor=reactor)
+    try:
+        assert wait_for(lambda: len(slow.receivers) == 1)
+        assert wait_for(lambda: len(fast.receivers) == 1)
+        for i in range(30):
+            slow.tell(i)
+        time.sleep(0.2)
+        t0 = time.time()
+        for i in range(20):
+            fast.tell(i)
+        assert fast.flush(10)
+        assert time.time() - t0 < 1.
+        assert wait_for(lambda: rfast.datas() == list(range(20)))
+        assert slow.flush(10)
+    finally:
+        slow.close()
+        fast.close()
+        rslow.shut()
+        rfast.shut()
+        reactor.close()
+
+
+def test_full_inbox_holds_no_other_receiver():
+    reactor = Reactor()
+    full = SocTransmitter(52155, 1, reactor=reactor, timeoutACK=None)
+    other = SocTransmitter(52156, 1, reactor=reactor)
+    rfull = SocReceiver(52155, 'full', hostname=HOST, inbox=2,
+                        reactor=reactor)
+    rother = Collector(52156, 'other', reactor=reactor)
+    try:
+        assert wait_for(lambda: len(full.receivers) == 1)
+        assert wait_for(lambda: len(other.receivers) == 1)
+        for i in range(50):
+            full.tell(i)
+        assert full.flush(5)
+        time.sleep(0.2)
+        for i in range(20):
+            other.tell(i)
+        assert wait_for(lambda: rother.datas() == list(range(20)))
+        got = []
+        while len(got) < 50:
+            items = rfull.recv_many(timeout=5)
+            assert items
+            got += [data for data, tag in items]
+        assert got == list(range(50))
+    finally:
+        full.close()
+        other.close()
+        rfull.stop_connectLoop()
+        rfull.close()
+        rother.shut()
+        reactor.close()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+from ..soctransmitter import SocTransmitter
+from ..socreceiver import SocReceiver
+from ..multireceiver import MultiSocReceiver
+from ._helpers import wait_for, Collector, HOST
+
+
+class MultiCollector(MultiSocReceiver):
+    """Keeps the (source, data) messages processed
+    """
+    def __init__(self, *args, **kwargs):
+        self.got = []
+        kwargs.setdefault('hostname', HOST)
+        MultiSocReceiver.__init__(self, *args, **kwargs)
+
+    def process(self, data, tag, source):
+        self.got.append((source, data))
+
+    def _newconnection(self, source):
+        pass
+
+
+class ViewCollector(Collector):
+    """Keeps a copy of the raw messages, received as memoryviews
+    """
+    def process(self, data, tag):
+        Collector.process(self, (type(data), bytes(data)), tag)
+
+
+def test_inbox():
+    t = SocTransmitter(52221, 1)
+    r = SocReceiver(52221, 'a', hostname=HOST, inbox=100)
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        for i in range(10):
+            t.tell(i, tag='x')
+        assert t.flush(5)
+        first = r.recv_many(max_n=4, timeout=5)
+        assert first == [(i, 'x') for i in range(4)]
+        rest = [data for data, tag in r.messages(timeout=0.5)]
+        assert rest == list(range(4, 10))
+        assert r.recv_many(timeout=0.01) == []
+    finally:
+        t.close()
+        r.stop_connectLoop()
+        r.close()
+
+
+def test_zerocopy_raw():
+    t = SocTransmitter(52222, 1)
+    r = ViewCollector(52222, 'a', zerocopy=True)
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        t.tell_raw(b'abc')
+        t.tell_raw(b'defg')
+        assert t.flush(5)
+        assert wait_for(lambda: len(r.got) == 2)
+        assert r.datas() == [(memoryview, b'abc'), (memoryview, b'defg')]
+    finally:
+        t.close()
+        r.shut()
+
+
+def test_multireceiver():
+    ts = [SocTransmitter(port, 1) for port in (52223, 52224)]
+    r = MultiCollector({'one': 52223, 'two': 52224}, 'a')
+    try:
+        assert wait_for(lambda: len(r.connected_sources) == 2)
+        assert wait_for(lambda: all(len(t.receivers) == 1 for t in ts))
+        for i, t in enumerate(ts):
+            t.tell(i)
+            assert t.flush(5)
+        assert wait_for(lambda: len(r.got) == 2)
+        assert sorted(r.got) == [('one', 0), ('two', 1)]
+    finally:
+        r.stop_connectLoop()
+        r.close()
+        for t in ts:
+            t.close()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import pytest
+
+from ..soctransmitter import SocTransmitter
+from ..relay import Relay
+from ..shmring import SHMON
+from ._helpers import wait_for, Collector
+
+
+def _relay(port, **kwargs):
+    t = SocTransmitter(port, 2, **kwargs)
+    relay = Relay(port, 'relay', port + 1, hostname='127.0.0.1')
+    leaf = Collector(port + 1, 'leaf')
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1
+                                    and len(relay.transmitter.receivers) == 1)
+        # multicast and ring opening go first
+        t.ping()
+        for i in range(50):
+            t.tell({'i': i, 'end': b'\xac\x96\xac\x96'})
+        t.tell_raw(b'raw', tag='r')
+        assert t.flush(5)
+        assert wait_for(lambda: len(leaf.got) == 51)
+        assert [d['i'] for d in leaf.datas(None)[:50]] == list(range(50))
+        assert bytes(leaf.datas(None)[0]['end']) == b'\xac\x96\xac\x96'
+        assert [bytes(d) for d in leaf.datas('r')] == [b'raw']
+        # the relay reads the upstream transports, the leaf gets frames
+        assert not leaf._mcast and not leaf._rings
+        if 'multicast' in kwargs:
+            assert relay._mcast
+        if 'shm_ring' in kwargs:
+            assert relay._rings
+        if kwargs.get('stamp'):
+            # stamped again by the relay, which clock the leaf follows
+            assert relay.transmitter.stamp
+            assert all(meta is not None and meta['latency'] < 0.2
+                           for meta in leaf.metas)
+            assert wait_for(lambda: leaf.clock_offset() is not None)
+    finally:
+        relay.shutdown()
+        t.close()
+
+
+def test_relay_plain():
+    _relay(52131)
+
+
+def test_relay_multicast():
+    _relay(52133, multicast='239.255.42.97:52135')
+
+
+@pytest.mark.skipif(not SHMON, reason="requires python 3.8+")
+def test_relay_shm_ring():
+    _relay(52136, shm_ring=2**20)
+
+
+def test_relay_stamped():
+    _relay(52144, stamp=True)
+
+
+def test_relay_multicast_stamped():
+    _relay(52146, multicast='239.255.42.97:52148', stamp=True)
+
+
+@pytest.mark.skipif(not SHMON, reason="requires python 3.8+")
+def test_relay_shm_ring_stamped():
+    _relay(52149, shm_ring=2**20, stamp=True)
+
+
+def test_relay_chain():
+    t = SocTransmitter(52141, 2)
+    r1 = Relay(52141, 'r1', 52142, hostname='127.0.0.1')
+    r2 = Relay(52142, 'r2', 52143, hostname='127.0.0.1')
+    leaf = Collector(52143, 'leaf')
+    try:
+        assert wait_for(lambda: len(r2.transmitter.receivers) == 1)
+        assert wait_for(lambda: len(r1.transmitter.receivers) == 1)
+        for i in range(20):
+            t.tell(i)
+        assert t.flush(5)
+        assert wait_for(lambda: leaf.datas() == list(range(20)))
+    finally:
+        r2.shutdown()
+        r1.shutdown()
+        t.close()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+
+from ..soctransmitter import SocTransmitter
+from ._helpers import wait_for, Collector
+
+
+class Wire(Collector):
+    """Keeps the header of each frame received
+    """
+    def __init__(self, *args, **kwargs):
+        self.headers = []
+        Collector.__init__(self, *args, **kwargs)
+
+    def _dispatch(self, comm, source=None):
+        self.headers.append(bytes(comm)[:48])
+        Collector._dispatch(self, comm, source)
+
+
+def _flags(r, key=b'__jsn__'):
+    """Returns the unpack fields of the frames of a key, as a receiver
+    of the first versions splits them
+    """
+    return [h[7:].split(b':', 2)[1] for h in r.headers if h[:7] == key]
+
+
+def test_baseline_wire_without_timeout():
+    t = SocTransmitter(52121, 2, timeoutACK=None)
+    r = Wire(52121, 'a')
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        t.tell(1, tag='x')
+        t.tell(2, tag='x', unpack=False)
+        assert t.flush(5)
+        assert wait_for(lambda: len(r.got) == 2)
+        # older receivers do int(unpack)
+        assert [int(f) for f in _flags(r)] == [1, 0]
+    finally:
+        t.close()
+
+
+def test_unreliable_tags():
+    t = SocTransmitter(52122, 2)
+    t.set_reliable('tm', False)
+    rs = [Wire(52122, name) for name in ('a', 'b')]
+    try:
+        assert wait_for(lambda: len(t.receivers) == 2)
+        for i in range(300):
+            t.tell(i, tag='tm')
+        t.tell('cmd', tag='cmd')
+        t.tell('sure', tag='tm', reliable=True)
+        assert t.flush(10)
+        for r in rs:
+            assert wait_for(lambda: len(r.got) == 302)
+            assert r.datas('tm')[:300] == list(range(300))
+            flags = _flags(r)
+            assert flags.count(b'1~') == 300 and flags.count(b'1') == 2
+        assert t.ping() == {'a': True, 'b': True}
+    finally:
+        t.close()
+
+
+def test_dead_receiver_found_without_ack():
+    t = SocTransmitter(52123, 2)
+    t.set_reliable('tm', False)
+    r = Collector(52123, 'a')
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        r.stop_connectLoop()
+        r.close()
+        for k in range(20):
+            for i in range(200):
+                t.tell(i, tag='tm')
+            t.flush(5)
+            if not t.receivers:
+                break
+        assert not t.receivers
+    finally:
+        t.close()
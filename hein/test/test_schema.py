@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+
+from ..soctransmitter import SocTransmitter
+from ..reactor import Reactor
+from ._helpers import wait_for, Collector
+
+
+FIELDS = [('x', int), ('y', float)]
+
+
+class Keys(Collector):
+    """Keeps the key of each frame received
+    """
+    def __init__(self, *args, **kwargs):
+        self.keys = []
+        Collector.__init__(self, *args, **kwargs)
+
+    def _dispatch(self, comm, source=None):
+        self.keys.append(bytes(comm)[:7])
+        Collector._dispatch(self, comm, source)
+
+
+def _receiver(port, name, fields=None, **kwargs):
+    r = Keys(port, name, connect=False, **kwargs)
+    if fields is not None:
+        r.register_schema('pt', fields)
+    r.connect()
+    return r
+
+
+def _tell(t, rs, n=3):
+    for i in range(n):
+        t.tell({'x': i, 'y': 0.5}, tag='pt')
+    assert t.flush(5)
+    for r in rs:
+        assert wait_for(lambda: len(r.got) == n)
+        assert r.datas() == [{'x': i, 'y': 0.5} for i in range(n)]
+
+
+def test_schema_held_by_all():
+    t = SocTransmitter(52171, 2)
+    t.register_schema('pt', FIELDS)
+    rs = [_receiver(52171, name, FIELDS) for name in ('a', 'b')]
+    try:
+        assert wait_for(lambda: len(t.receivers) == 2)
+        assert t._schema_held('pt')
+        _tell(t, rs)
+        for r in rs:
+            assert r.keys == [b'__scq__'] + [b'__sch__'] * 3
+        # the receivers connected held the previous schema
+        t.register_schema('pt', [('x', int), ('y', float), ('z', int)])
+        assert not t._schema_held('pt')
+    finally:
+        t.close()
+        for r in rs:
+            r.shut()
+
+
+def test_json_unless_held_by_all():
+    reactor = Reactor()
+    t = SocTransmitter(52172, 3, reactor=reactor)
+    t.register_schema('pt', FIELDS)
+    rs = [_receiver(52172, 'a', FIELDS),
+          # lacks the schema
+          _receiver(52172, 'b', reactor=reactor),
+          # another schema of the tag
+          _receiver(52172, 'c', [('x', int), ('y', int)])]
+    try:
+        assert wait_for(lambda: len(t.receivers) == 3)
+        assert not t._schema_held('pt')
+        _tell(t, rs)
+        for r in rs:
+            assert r.keys == [b'__scq__'] + [b'__jsn__'] * 3
+    finally:
+        t.close()
+        for r in rs:
+            r.shut()
+        reactor.close()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import time
+
+from .. import core
+from ..sendqueue import SendQueue, _Frame, CONTROL
+
+
+def _lines(frames):
+    return [frame.line for frame in frames]
+
+
+def _drain(q):
+    res = []
+    while len(q):
+        res += _lines(q.take())
+    return res
+
+
+def test_lanes_order():
+    q = SendQueue(starvation=None)
+    for line, priority in (('low', core.PRIORITY_LOW),
+                           ('normal', core.PRIORITY_NORMAL),
+                           ('high', core.PRIORITY_HIGH)):
+        q.put(_Frame(line, lane=q.lane(priority)))
+    q.put(_Frame('ping', ping=True, lane=CONTROL))
+    assert _drain(q) == ['ping', 'high', 'normal', 'low']
+
+
+def test_starvation():
+    q = SendQueue(starvation=0.05)
+    q.put(_Frame('low', lane=q.lane(core.PRIORITY_LOW)))
+    time.sleep(0.1)
+    q.put(_Frame('high', lane=q.lane(core.PRIORITY_HIGH)))
+    assert _drain(q) == ['low', 'high']
+
+
+def test_ttl_expiry():
+    q = SendQueue()
+    q.put(_Frame('stale', deadline=time.time() - 1))
+    q.put(_Frame('fresh', deadline=time.time() + 60))
+    assert _drain(q) == ['fresh']
+    assert q.stats()['normal']['expired'] == 1
+
+
+def test_coalesce():
+    q = SendQueue()
+    for i in range(5):
+        q.put(_Frame(str(i), tag='pos', coalesce=True))
+        q.put(_Frame('cmd{}'.format(i), tag='cmd'))
+    assert q.coalesce() == 4
+    assert _drain(q) == ['cmd0', 'cmd1', 'cmd2', 'cmd3', '4', 'cmd4']
+    assert q.stats()['normal']['coalesced'] == 4
+
+
+def test_water_marks():
+    changes = []
+    q = SendQueue(high_water=3, overflow='reject',
+                  on_backpressure=changes.append)
+    assert [q.put(_Frame(str(i))) for i in range(5)] == [True] * 3\
+                                                         + [False] * 2
+    assert changes == [True]
+    # control frames are never refused
+    assert q.put(_Frame('ping', ping=True, lane=CONTROL))
+    _drain(q)
+    assert changes == [True, False]
+    q = SendQueue(high_water=3, overflow='drop')
+    for i in range(5):
+        assert q.put(_Frame(str(i)))
+    assert _drain(q) == ['2', '3', '4']
+
+
+def test_drop_keeps_undroppable():
+    q = SendQueue(high_water=2, overflow='drop')
+    assert q.put(_Frame('data'))
+    q.append(_Frame('chunk', droppable=False))
+    for i in range(3):
+        assert q.put(_Frame('delta{}'.format(i), droppable=False))
+    # the new frame is the only droppable one
+    assert not q.put(_Frame('last'))
+    assert _drain(q) == ['chunk', 'delta0', 'delta1', 'delta2']
+    assert q.stats()['normal']['dropped'] == 2
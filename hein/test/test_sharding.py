@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+from ..soctransmitter import SocTransmitter
+from ._helpers import wait_for, Collector
+
+
+def test_sharded_delivery():
+    t = SocTransmitter(52101, 3, shards=2)
+    rs = [Collector(52101, name) for name in ('a', 'b', 'c')]
+    try:
+        assert wait_for(lambda: len(t.receivers) == 3)
+        for i in range(100):
+            t.tell(i)
+        assert t.flush(10)
+        for r in rs:
+            assert wait_for(lambda: len(r.got) == 100)
+            assert r.datas() == list(range(100))
+        assert sorted(t.ping()) == ['a', 'b', 'c']
+    finally:
+        t.close()
+
+
+def test_slow_receiver_no_loss():
+    # a small ring which the slow receiver would overrun
+    t = SocTransmitter(52102, 2, shards=1, ring_size=8192)
+    r = Collector(52102, 'a', delay=0.002)
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        for i in range(300):
+            t.tell('x' * 200 + str(i))
+        assert t.flush(60)
+        assert wait_for(lambda: len(r.got) == 300, 10)
+        assert t._pool.overruns == 0
+        assert 'a' in t.receivers
+    finally:
+        t.close()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+from ..shmring import SHMON, ShmRing, Overrun
+
+
+pytestmark = pytest.mark.skipif(not SHMON, reason="requires python 3.8+")
+
+
+def test_ring_records():
+    ring = ShmRing(size=4096)
+    reader = ShmRing(name=ring.name, create=False)
+    try:
+        pos = [ring.write(b'x' * 100 + str(i).encode()) for i in range(100)]
+        # the first records were overwritten
+        with pytest.raises(Overrun):
+            reader.read(pos[0])
+        data, end = reader.read(pos[-1])
+        assert bytes(data) == b'x' * 100 + b'99' and end == ring.head
+        assert reader.read(end) is None
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_attached_by_creator_process():
+    # the resource tracker complains at exit if the block is unregistered
+    # twice, by the attaching and the creating instances
+    code = "\n".join((
+        "from hein.shmring import ShmRing",
+        "ring = ShmRing(size=4096)",
+        "reader = ShmRing(name=ring.name, create=False)",
+        "reader.close()",
+        "ring.close()"))
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    res = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                         cwd=root, timeout=60)
+    assert res.returncode == 0
+    assert b'KeyError' not in res.stderr
+    assert b'leaked' not in res.stderr
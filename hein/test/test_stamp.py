@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+
+import time
+import shutil
+import tempfile
+
+from .. import core
+from ..journal import Journal
+from ..soctransmitter import SocTransmitter
+from ..batch import MessageBatch
+from ._helpers import wait_for, Collector
+
+
+def test_stamped_when_sent():
+    t = SocTransmitter(52191, 1, stamp=True)
+    r = Collector(52191, 'a')
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        # the last ones wait about 0.5 s in the sending buffer
+        for i in range(50):
+            t.tell(i)
+        assert t.flush(10)
+        assert wait_for(lambda: len(r.got) == 50)
+        assert all(meta is not None for meta in r.metas)
+        assert max(meta['latency'] for meta in r.metas) < 0.2
+        sent = [meta['sent'] for meta in r.metas]
+        assert sent == sorted(sent) and sent[-1] - sent[0] > 0.3
+    finally:
+        t.close()
+        r.shut()
+
+
+def test_meta_of_inbox_and_batches():
+    t = SocTransmitter(52192, 2, stamp=True)
+    r = Collector(52192, 'a', inbox=100)
+    b = Collector(52192, 'b')
+    b.set_batch('x', 10)
+    try:
+        assert wait_for(lambda: len(t.receivers) == 2)
+        for i in range(20):
+            t.tell({'i': i}, tag='x')
+        assert t.flush(10)
+        items = []
+        while len(items) < 20:
+            got = r.recv_many(timeout=5)
+            assert got
+            items += got
+        assert [data for data, tag in items] == [{'i': i}
+                                                   for i in range(20)]
+        sent = [item.meta['sent'] for item in items]
+        assert sent == sorted(sent) and sent[0] < sent[-1]
+        assert wait_for(lambda: sum(len(batch) for batch in b.datas()) == 20)
+        for batch in b.datas():
+            assert isinstance(batch, MessageBatch)
+            assert len(batch.meta) == len(batch)
+            assert all('latency' in meta for meta in batch.meta)
+    finally:
+        t.close()
+        r.shut()
+        b.shut()
+
+
+def test_unstamp():
+    frames = [core._package(b'__jsn__x:1@12.5:[1]'),
+              core._package(b'__jsn__x:1:[2]'),
+              core._package(b'__jsn__:1~@3.25:[3]')]
+    line, stamps = core._unstamp(frames)
+    assert line == b''.join(core._package(f) for f in (
+        b'__jsn__x:1:[1]', b'__jsn__x:1:[2]', b'__jsn__:1~:[3]'))
+    assert [line[i:i + 1] for i in stamps] == [b':', b':']
+    assert core._unstamp(frames[1:2]) == (frames[1], None)
+
+
+def test_replay_stamped_again():
+    path = tempfile.mkdtemp()
+    t = SocTransmitter(52193, 1, stamp=True, journal=Journal(path))
+    r = Collector(52193, 'a')
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        for i in range(5):
+            t.tell(i)
+        assert t.flush(5)
+        assert wait_for(lambda: len(r.got) == 5)
+        time.sleep(0.5)
+        assert t.replay() == 5
+        assert t.flush(5)
+        assert wait_for(lambda: len(r.got) == 10)
+        assert r.datas() == list(range(5)) * 2
+        assert max(meta['latency'] for meta in r.metas) < 0.2
+        assert r.metas[5]['sent'] - r.metas[4]['sent'] > 0.4
+    finally:
+        t.close()
+        r.shut()
+        t.journal.close()
+        shutil.rmtree(path)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+
+import io
+import time
+import hashlib
+from threading import Thread
+
+from ..soctransmitter import SocTransmitter
+from ._helpers import wait_for, Collector
+
+
+class Streams(Collector):
+    """Keeps the digest and number of chunks of the streams received
+    """
+    def __init__(self, *args, **kwargs):
+        self.streams = []
+        Collector.__init__(self, *args, **kwargs)
+
+    def process_stream_start(self, stream, tag, meta):
+        self._hash = hashlib.md5()
+        self._n = 0
+
+    def process_stream_chunk(self, stream, tag, chunk):
+        self._hash.update(chunk)
+        self._n += 1
+
+    def process_stream_end(self, stream, tag, aborted):
+        self.streams.append((aborted, self._n, self._hash.hexdigest()))
+
+
+def test_stream_unpaced():
+    t = SocTransmitter(52181, 1)
+    r = Streams(52181, 'a')
+    blob = bytes(bytearray(range(256))) * 2**10
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        others = Thread(target=lambda: [t.tell(i) for i in range(5)])
+        t0 = time.time()
+        others.start()
+        # 256 chunks, which would take 2.5 s at the sending frequency
+        assert t.tell_stream(io.BytesIO(blob), tag='blob', chunk_size=2**10)
+        assert t.flush(10)
+        assert time.time() - t0 < 1.5
+        others.join()
+        assert wait_for(lambda: len(r.streams) == 1)
+        assert r.streams == [(False, 256, hashlib.md5(blob).hexdigest())]
+        assert wait_for(lambda: r.datas() == list(range(5)))
+    finally:
+        t.close()
+        r.shut()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  HEIN - Advanced Subscriber-Publisher Socket Communication
+#  Copyright (C) 2017  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import os
+import shutil
+import tempfile
+
+from ..soctransmitter import SocTransmitter
+from ..profiler import Profiler
+from ._helpers import wait_for, Collector
+
+
+class FileCollector(Collector):
+    """Keeps the (name, tag, data) of the files received
+    """
+    def __init__(self, *args, **kwargs):
+        self.files = []
+        Collector.__init__(self, *args, **kwargs)
+
+    def process_file(self, name, tag, path, data):
+        self.files.append((name, tag, data))
+
+
+def test_rate_and_sampling():
+    t = SocTransmitter(52211, 1)
+    try:
+        t.set_rate('s', every=3)
+        assert [bool(t.tell(i, tag='s')) for i in range(6)]\
+                    == [True, False, False] * 2
+        t.set_rate('r', rate=1e-3, burst=2)
+        assert [bool(t.tell_raw('m', tag='r')) for i in range(4)]\
+                    == [True, True, False, False]
+        assert t.rate_stats() == {'s': {'passed': 2, 'skipped': 4},
+                                  'r': {'passed': 2, 'skipped': 2}}
+        t.set_rate('s')
+        assert list(t.rate_stats()) == ['r']
+    finally:
+        t.close()
+
+
+def test_round_robin():
+    t = SocTransmitter(52212, 2, distribute='round_robin')
+    rs = [Collector(52212, name) for name in ('a', 'b')]
+    try:
+        assert wait_for(lambda: len(t.receivers) == 2)
+        for i in range(20):
+            t.tell(i)
+        assert t.flush(5)
+        assert wait_for(lambda: sum(len(r.got) for r in rs) == 20)
+        assert sorted(rs[0].datas() + rs[1].datas()) == list(range(20))
+        assert all(r.got for r in rs)
+    finally:
+        t.close()
+        for r in rs:
+            r.shut()
+
+
+def test_file():
+    path = tempfile.mkdtemp()
+    src = os.path.join(path, 'data.bin')
+    with open(src, 'wb') as f:
+        f.write(os.urandom(100000))
+    t = SocTransmitter(52213, 1)
+    r = FileCollector(52213, 'a')
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        assert t.tell_file(src, tag='f')
+        t.tell('after')
+        assert t.flush(5)
+        assert wait_for(lambda: r.datas() == ['after'])
+        assert len(r.files) == 1
+        name, tag, data = r.files[0]
+        with open(src, 'rb') as f:
+            assert (name, tag, bytes(data)) == ('data.bin', 'f', f.read())
+    finally:
+        t.close()
+        r.shut()
+        shutil.rmtree(path)
+
+
+def test_profiler_stages():
+    prof = Profiler()
+    t = SocTransmitter(52214, 1, profiler=prof)
+    r = Collector(52214, 'a', profiler=prof)
+    try:
+        assert wait_for(lambda: len(t.receivers) == 1)
+        for i in range(10):
+            t.tell(i)
+        assert t.flush(5)
+        assert wait_for(lambda: len(r.got) == 10)
+        stats = prof.stats()
+        for stage in ('encode', 'queue', 'send', 'ack', 'decode',
+                      'process'):
+            assert stats[stage]['count'] >= 1
+        assert stats['encode']['count'] == 10
+        assert 'process' in prof.report()
+    finally:
+        t.close()
+        r.shut()